@@ -0,0 +1,74 @@
+import sys
+import shutil
+import argparse
+import tempfile
+import numpy as np
+
+import utils
+
+parser = argparse.ArgumentParser(description='Check that every training batch has at least two examples of nonzero weight')
+parser.add_argument('-b', '--batch_sizes', nargs='+', type=int, default=[2, 3, 8, 32], help='Batch sizes to check')
+parser.add_argument('-n', '--num_batches', type=int, default=3, help='Number of full batches of the checked corpora')
+parser.add_argument('-s', '--seed', type=int, default=0, help='Seed of the random corpora')
+args = vars(parser.parse_args())
+
+
+def random_corpus(num_examples, num_tokens, vocab_size, rng):
+    """
+    Padded index matrix of random sequences of 1 to num_tokens words
+    """
+    x = rng.randint(1, vocab_size, size=(num_examples, num_tokens))
+    lengths = rng.randint(1, num_tokens + 1, size=num_examples)
+    x[np.arange(num_tokens)[None, :] >= lengths[:, None]] = 0
+
+    return x
+
+
+def check_batches(name, batches, num_examples):
+    """
+    Checks that every batch has at least two examples of nonzero weight and that all examples are weighted
+    """
+    weights = [batch[-1] for batch in batches]
+    num_nonzero = [np.count_nonzero(w) for w in weights]
+    covered = sum(num_nonzero) == num_examples
+    passes = min(num_nonzero) >= 2 and covered
+
+    print('{:<40} batches = {:>3}, min nonzero weights = {}, all examples weighted = {} {}'.format(
+        name, len(batches), min(num_nonzero), covered, '' if passes else '<- FAILED'))
+
+    return passes
+
+
+if __name__ == "__main__":
+
+    rng = np.random.RandomState(args['seed'])
+    passes = True
+    for batch_size in args['batch_sizes']:
+        # len(x) % batch_size == 1: the remainder batch holds a single example
+        num_examples = args['num_batches'] * batch_size + 1
+        word_index = dict((str(i), i) for i in range(50))
+        x = random_corpus(num_examples, 10, 50, rng)
+        y = random_corpus(num_examples, 10, 50, rng)
+        weights = rng.randint(1, 4, size=num_examples).astype(np.float32)
+
+        print('-'*50)
+        print('batch_size = {}, examples = {}'.format(batch_size, num_examples))
+        for kwargs in [{}, {'shuffle': True, 'seed': 1}, {'num_buckets': 2, 'seed': 1}, {'weights': weights},
+                       {'max_tokens': batch_size * 10}]:
+            name = ', '.join('{}={}'.format(k, 'array' if k == 'weights' else v) for k, v in sorted(kwargs.items()))
+            batches = list(utils.get_weighted_batches(x, batch_size, keep_remainder=True, **kwargs))
+            passes = check_batches('x ' + name, batches, num_examples) and passes
+            batches = list(utils.get_weighted_batches_xy(x, y, batch_size, keep_remainder=True, **kwargs))
+            passes = check_batches('xy ' + name, batches, num_examples) and passes
+
+        dataset_dir = tempfile.mkdtemp()
+        try:
+            utils.write_sharded_dataset(dataset_dir, [(x, y)], [word_index, word_index], fields=('x', 'y'))
+            dataset = utils.ShardedDataset(dataset_dir, seed=1)
+            batches = list(utils.get_weighted_batches_xy(dataset, None, batch_size, keep_remainder=True))
+            passes = check_batches('xy sharded', batches, num_examples) and passes
+        finally:
+            shutil.rmtree(dataset_dir)
+
+    print('-'*50)
+    sys.exit(0 if passes else 1)
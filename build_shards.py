@@ -0,0 +1,36 @@
+import argparse
+
+import utils
+
+parser = argparse.ArgumentParser(description='Build a sharded on-disk training set for corpora larger than memory (see --train_shards)')
+parser.add_argument('-i', '--input_path', help='Text file (1 sentence per line) for snli or csv file (line,reply columns) for dialog', required=True)
+parser.add_argument('-o', '--output_dir', help='Directory of the sharded dataset', required=True)
+parser.add_argument('--num_tokens', type=int, default=20, help='max number of words/tokens in a sentence (text file)')
+parser.add_argument('--vocab_size', type=int, default=30000, help='vocabulary size (text file)')
+parser.add_argument('--encoder_num_tokens', type=int, default=20, help='max number of words/tokens in the input sequence (csv file)')
+parser.add_argument('--encoder_vocab', type=int, default=20000, help='encoder vocabulary size (csv file)')
+parser.add_argument('--decoder_num_tokens', type=int, default=20, help='max number of words/tokens in the generated sequence (csv file)')
+parser.add_argument('--decoder_vocab', type=int, default=20000, help='decoder vocabulary size (csv file)')
+parser.add_argument('--shard_size', type=int, default=1000000, help='number of examples per shard')
+parser.add_argument('--chunk_size', type=int, default=100000, help='number of examples tokenized at a time')
+parser.add_argument('--num_workers', type=int, default=1, help='number of processes used to tokenize the corpus')
+parser.add_argument('--tokenizer', type=str, default='nltk', help='word tokenizer: nltk | native')
+args = vars(parser.parse_args())
+
+
+if __name__ == "__main__":
+
+    filters = '!"#$%&()*+/:;<=>@[\\]^`{|}~\t\n'
+
+    if args['input_path'].endswith('.csv'):
+        utils.build_pair_shards(args['input_path'], args['output_dir'], filters,
+                                args['encoder_num_tokens'], args['encoder_vocab'],
+                                args['decoder_num_tokens'], args['decoder_vocab'],
+                                args['shard_size'], args['chunk_size'], args['num_workers'], args['tokenizer'])
+    else:
+        utils.build_sentence_shards(args['input_path'], args['output_dir'], filters,
+                                    args['num_tokens'], args['vocab_size'],
+                                    args['shard_size'], args['chunk_size'], args['num_workers'], args['tokenizer'])
+
+    dataset = utils.ShardedDataset(args['output_dir'])
+    print('[INFO] Wrote {} examples in {} shards to {}'.format(len(dataset), len(dataset.shards), args['output_dir']))
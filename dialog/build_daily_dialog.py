@@ -0,0 +1,73 @@
+from pathsetup import run_path_setup
+run_path_setup()
+
+import os
+import argparse
+import multiprocessing
+import numpy as np
+
+import utils
+
+parser = argparse.ArgumentParser(description='Build the DailyDialog line/reply files from the raw dialogues')
+parser.add_argument('--train', default='data/DailyDial/original/train.utts.txt', help='raw training dialogues, 1 dialogue per line with utterances ending in __eou__')
+parser.add_argument('--valid', default='data/DailyDial/original/valid.utts.txt', help='raw validation dialogues')
+parser.add_argument('--test', default='data/DailyDial/original/test.utts.txt', help='raw test dialogues')
+parser.add_argument('-o', '--output_dir', default='data/DailyDial/de_duplicated/', help='directory of the line/reply csv files')
+parser.add_argument('--seed', type=int, default=1337, help='seed of the shuffling of the pairs of each split')
+args = vars(parser.parse_args())
+
+SPLITS = ['train', 'valid', 'test']
+INDEX_DIR = 'pair_index'  # Not matched by the csv files listed in w2v_generator.py
+
+
+def parse_dialogues(split):
+    """
+    Reads the raw dialogues of a split once, storing every (cleaned) utterance a single time.
+    Consecutive utterances form the (line, reply) pairs, which are shuffled with a fixed seed.
+    """
+    utterance_ids = dict()
+    pair_ids = []
+    with open(args[split], 'r', buffering=1 << 20) as f:
+        for dialogue in f:
+            ids = [utterance_ids.setdefault(utils.clean_sentence(u), len(utterance_ids))
+                   for u in dialogue.split('__eou__')[:-1]]
+            pair_ids.extend(zip(ids, ids[1:]))
+
+    pair_ids = np.array(pair_ids, dtype=np.int32).reshape(-1, 2)
+    pair_ids = pair_ids[np.random.RandomState(args['seed'] + SPLITS.index(split)).permutation(len(pair_ids))]
+
+    return list(utterance_ids), pair_ids
+
+
+def write_split(job):
+    """
+    Writes the pair index and the csv file of a split.
+    """
+    split, utterances, pair_ids = job
+    file_name = 'df_daily_train.csv' if split == 'train' else 'df_daily_{}_without_duplicates.csv'.format(split)
+
+    utils.save_pair_index(os.path.join(args['output_dir'], INDEX_DIR), split, utterances, pair_ids)
+    utils.write_pairs_csv(os.path.join(args['output_dir'], file_name), utils.iter_indexed_pairs(utterances, pair_ids))
+
+    return file_name, len(pair_ids)
+
+
+def main():
+    with multiprocessing.Pool(len(SPLITS)) as pool:
+        corpora = dict(zip(SPLITS, pool.map(parse_dialogues, SPLITS)))
+
+        # Validation and test pairs which also occur in the training set are removed
+        train_pairs = set(utils.iter_indexed_pairs(*corpora['train']))
+        for split in SPLITS[1:]:
+            utterances, pair_ids = corpora[split]
+            keep = [pair not in train_pairs for pair in utils.iter_indexed_pairs(utterances, pair_ids)]
+            corpora[split] = (utterances, pair_ids[np.array(keep, dtype=bool)])
+
+        os.makedirs(args['output_dir'], exist_ok=True)
+        jobs = [(split,) + corpora[split] for split in SPLITS]
+        for file_name, num_pairs in pool.map(write_split, jobs):
+            print('[INFO] {}: {} pairs'.format(file_name, num_pairs))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+from pathsetup import run_path_setup
+run_path_setup()
+
+import os
+import re
+import zlib
+import shutil
+import argparse
+import multiprocessing
+import numpy as np
+
+import utils
+
+parser = argparse.ArgumentParser(description='Build the Cornell Movie Dialog line/reply files from the raw corpus')
+parser.add_argument('-i', '--input_dir', default='data/CornellMovieDialog/raw/', help='directory with movie_lines.txt and movie_conversations.txt')
+parser.add_argument('-o', '--output_dir', default='data/CornellMovieDialog/', help='directory of the line/reply csv files')
+parser.add_argument('--num_valid_movies', type=int, default=50, help='number of movies in the validation set')
+parser.add_argument('--num_test_movies', type=int, default=50, help='number of movies in the test set')
+parser.add_argument('--seed', type=int, default=1337, help='seed of the assignment of movies to splits')
+parser.add_argument('--num_partitions', type=int, default=64, help='number of movie partitions, each is processed in memory at once')
+parser.add_argument('--num_workers', type=int, default=4, help='number of processes building partitions')
+args = vars(parser.parse_args())
+
+SPLITS = ['train', 'valid', 'test']
+SEPARATOR = ' +++$+++ '
+ENCODING = 'iso-8859-1'
+LINE_ID_RE = re.compile(r'L\d+')
+
+
+def partition_dir():
+    return os.path.join(args['output_dir'], 'partitions.tmp')
+
+
+def partition_path(p, name):
+    return os.path.join(partition_dir(), '{:03d}_{}'.format(p, name))
+
+
+def scatter(file_name, files):
+    """
+    Streams a raw corpus file into the partitions of its movies, returns the movie ids seen.
+    """
+    movies = set()
+    with open(os.path.join(args['input_dir'], file_name), 'r', encoding=ENCODING, buffering=1 << 20) as f:
+        for row in f:
+            movie = row.split(SEPARATOR)[2]
+            movies.add(movie)
+            files[zlib.crc32(movie.encode('utf-8')) % args['num_partitions']].write(row)
+
+    return movies
+
+
+def assign_movies(movies):
+    """
+    Assigns movies to splits with a fixed seed, so that the splits do not share movies.
+    """
+    movies = sorted(movies, key=lambda m: int(m[1:]))
+    order = np.random.RandomState(args['seed']).permutation(len(movies))
+    num_valid, num_test = args['num_valid_movies'], args['num_test_movies']
+
+    split_of = {movies[i]: 'train' for i in order[num_valid + num_test:]}
+    split_of.update({movies[i]: 'valid' for i in order[:num_valid]})
+    split_of.update({movies[i]: 'test' for i in order[num_valid:num_valid + num_test]})
+
+    return split_of
+
+
+def build_partition(job):
+    """
+    Resolves the conversations of one partition into (line, reply, movie_id) rows of the split of their movie.
+    Pairs with an utterance that is empty after cleaning are skipped.
+    """
+    p, split_of = job
+
+    texts = dict()
+    with open(partition_path(p, 'lines'), 'r', encoding='utf-8') as f:
+        for row in f:
+            fields = row.rstrip('\n').split(SEPARATOR, 4)
+            texts[fields[0]] = utils.clean_sentence(fields[4])
+
+    rows = {split: [] for split in SPLITS}
+    with open(partition_path(p, 'conversations'), 'r', encoding='utf-8') as f:
+        for row in f:
+            fields = row.split(SEPARATOR)
+            movie, line_ids = fields[2], LINE_ID_RE.findall(fields[3])
+            for line_id, reply_id in zip(line_ids, line_ids[1:]):
+                line, reply = texts.get(line_id), texts.get(reply_id)
+                if line and reply:
+                    rows[split_of[movie]].append((line, reply, movie))
+
+    for split in SPLITS:
+        utils.write_pairs_csv(partition_path(p, split + '.csv'), rows[split], header=None)
+
+    return [len(rows[split]) for split in SPLITS]
+
+
+def main():
+    os.makedirs(partition_dir(), exist_ok=True)
+
+    files = [open(partition_path(p, 'lines'), 'w', encoding='utf-8', buffering=1 << 20)
+             for p in range(args['num_partitions'])]
+    scatter('movie_lines.txt', files)
+    for f in files:
+        f.close()
+
+    files = [open(partition_path(p, 'conversations'), 'w', encoding='utf-8', buffering=1 << 20)
+             for p in range(args['num_partitions'])]
+    split_of = assign_movies(scatter('movie_conversations.txt', files))
+    for f in files:
+        f.close()
+
+    with multiprocessing.Pool(args['num_workers']) as pool:
+        counts = pool.map(build_partition, [(p, split_of) for p in range(args['num_partitions'])])
+
+    # The partitions are concatenated in a fixed order, so the output does not depend on num_workers
+    for j, split in enumerate(SPLITS):
+        csv_path = os.path.join(args['output_dir'], 'df_movie_{}.csv'.format(split))
+        utils.write_pairs_csv(csv_path, [], header=('line', 'reply', 'movie_id'))
+        with open(csv_path, 'a', buffering=1 << 20) as out:
+            for p in range(args['num_partitions']):
+                with open(partition_path(p, split + '.csv'), 'r') as part:
+                    shutil.copyfileobj(part, out)
+        print('[INFO] {}: {} pairs'.format(csv_path, sum(c[j] for c in counts)))
+
+    shutil.rmtree(partition_dir())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+from pathsetup import run_path_setup
+run_path_setup()
+
+import os
+import time
+import argparse
+import pandas as pd
+
+import utils
+
+parser = argparse.ArgumentParser(description='Find (near-)duplicate line/reply pairs of evaluation files in a training file with MinHash LSH')
+parser.add_argument('-r', '--reference', help='training csv file (line,reply columns)', required=True)
+parser.add_argument('-i', '--input_paths', nargs='+', help='csv files checked against the training file, e.g., validation and test', required=True)
+parser.add_argument('-o', '--output_dir', default='', help='if given, write the input files without the duplicates to this directory')
+parser.add_argument('-t', '--threshold', type=float, default=0.8, help='minimum Jaccard similarity of the word n-grams of duplicates (1.0: exact duplicates only)')
+parser.add_argument('-n', '--ngram', type=int, default=2, help='word n-gram size')
+parser.add_argument('--num_perm', type=int, default=128, help='number of MinHash permutations')
+parser.add_argument('-m', '--max_examples', type=int, default=5, help='number of duplicates to print per file')
+args = vars(parser.parse_args())
+
+
+def read_shingles(data):
+    return [utils.pair_shingles(line, reply, args['ngram'])
+            for line, reply in zip(data['line'].astype(str), data['reply'].astype(str))]
+
+
+if __name__ == "__main__":
+
+    start = time.time()
+    lsh = utils.MinHashLSH(args['num_perm'], args['threshold'])
+    reference = pd.read_csv(args['reference'])
+    lsh.index(lsh.compute_signatures(read_shingles(reference)))
+    print('[INFO] Indexed {} pairs of {} ({} bands of {} rows) in {:.1f}s'.format(
+        len(reference), args['reference'], lsh.num_bands, lsh.band_size, time.time() - start))
+
+    for path in args['input_paths']:
+        start = time.time()
+        data = pd.read_csv(path)
+        matches = lsh.query(lsh.compute_signatures(read_shingles(data)))
+
+        print('-'*50)
+        print('{}: {} of {} pairs are duplicates ({:.1f}s)'.format(path, len(matches), len(data), time.time() - start))
+        for i, j, similarity in matches[:args['max_examples']]:
+            print('  {:.2f} {!r} -> {!r}'.format(similarity, tuple(data.iloc[i][['line', 'reply']]),
+                                                 tuple(reference.iloc[j][['line', 'reply']])))
+
+        if args['output_dir']:
+            os.makedirs(args['output_dir'], exist_ok=True)
+            duplicates = data.index[[i for i, _, _ in matches]]
+            data.drop(duplicates).to_csv(os.path.join(args['output_dir'], os.path.basename(path)), index=False)
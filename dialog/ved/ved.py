@@ -29,6 +29,7 @@ class VEDModel(object):
 
         self.encoder_vocab_size = config['encoder_vocab']
         self.decoder_vocab_size = config['decoder_vocab']
+        self.shared_vocab = config['shared_vocab']
 
         self.encoder_num_tokens = config['encoder_num_tokens']
         self.decoder_num_tokens = config['decoder_num_tokens']
@@ -44,6 +45,14 @@ class VEDModel(object):
         self.anneal_till = config['anneal_till']
 
         self.batch_size = config['batch_size']
+        self.num_buckets = config['num_buckets']
+        self.shuffle = config['shuffle']
+        self.keep_remainder = config['keep_remainder']
+        self.seed = config['seed']
+        self.max_tokens = config['max_tokens']
+        self.graph_input = config['graph_input']
+        self.summary_every = config['summary_every']
+        self.prefetch_batches = config['prefetch_batches']
         self.epochs = config['n_epochs']
 
         self.encoder_embeddings_matrix = encoder_embeddings_matrix
@@ -81,18 +90,60 @@ class VEDModel(object):
     def init_placeholders(self):
         with tf.name_scope("model_inputs"):
             # Create palceholders for inputs to the model
-            self.input_data = tf.placeholder(tf.int32, [self.batch_size, self.encoder_num_tokens], name='input')
-            self.target_data = tf.placeholder(tf.int32, [self.batch_size, self.decoder_num_tokens], name='targets')
+            if self.graph_input:
+                # Training batches come from the input pipeline, other batches are fed as usual
+                source_ids, target_ids, source_lengths, target_lengths = self.build_input_pipeline()
+                self.input_data = tf.placeholder_with_default(source_ids, [None, None], name='input')
+                self.target_data = tf.placeholder_with_default(target_ids, [None, None], name='targets')
+                self.source_sentence_length = tf.placeholder_with_default(source_lengths, shape=(None,),
+                                                                          name='source_sentence_length')
+                self.target_sentence_length = tf.placeholder_with_default(target_lengths, shape=(None,),
+                                                                          name='target_sentence_length')
+            else:
+                self.input_data = tf.placeholder(tf.int32, [None, None], name='input')
+                self.target_data = tf.placeholder(tf.int32, [None, None], name='targets')
+                self.source_sentence_length = tf.placeholder(tf.int32, shape=(None,),
+                                                             name='source_sentence_length')
+                self.target_sentence_length = tf.placeholder(tf.int32, shape=(None,),
+                                                             name='target_sentence_length')
             self.lr = tf.placeholder(tf.float32, name='learning_rate', shape=())
             self.keep_prob = tf.placeholder(tf.float32, name='keep_prob')  # Dropout Keep Probability
-            self.source_sentence_length = tf.placeholder(tf.int32, shape=(self.batch_size,),
-                                                         name='source_sentence_length')
-            self.target_sentence_length = tf.placeholder(tf.int32, shape=(self.batch_size,),
-                                                         name='target_sentence_length')
             self.word_dropout_keep_prob = tf.placeholder(tf.float32, name='word_drop_keep_prob', shape=())
             self.lambda_coeff = tf.placeholder(tf.float32, name='lambda_coeff', shape=())
+            self.example_weights = tf.placeholder_with_default(tf.ones(tf.shape(self.input_data)[:1]), shape=(None,),
+                                                               name='example_weights')  # Loss weights
             self.z_temperature = tf.placeholder(tf.float32, name='z_temperature', shape=())
 
+    def build_input_pipeline(self):
+        """
+        Reads the training batches in the graph: the input and output id matrices of the training set are fed once
+        per epoch to initialize self.train_iterator, the sequence lengths are computed in the graph and up to
+        graph_input batches are prepared ahead of the training step.
+        """
+        with tf.name_scope("input_pipeline"):
+            self.train_source_ids = tf.placeholder(tf.int32, [None, None], name='train_source_ids')
+            self.train_target_ids = tf.placeholder(tf.int32, [None, None], name='train_target_ids')
+            self.shuffle_seed = tf.placeholder(tf.int64, shape=(), name='shuffle_seed')
+
+            dataset = tf.contrib.data.Dataset.from_tensor_slices((self.train_source_ids, self.train_target_ids))
+            if self.shuffle:
+                dataset = dataset.shuffle(tf.cast(tf.shape(self.train_source_ids)[0], tf.int64), seed=self.shuffle_seed)
+            dataset = dataset.batch(self.batch_size)
+            if not self.keep_remainder:
+                dataset = dataset.filter(lambda source_ids, target_ids: tf.equal(tf.shape(source_ids)[0], self.batch_size))
+
+            def add_lengths(source_ids, target_ids):
+                source_lengths = tf.reduce_sum(
+                    tf.cast(tf.not_equal(source_ids, self.encoder_word_index['PAD']), tf.int32), axis=1)
+                target_lengths = tf.reduce_sum(tf.cast(tf.not_equal(target_ids, self.pad), tf.int32), axis=1)
+                return (source_ids[:, :tf.reduce_max(source_lengths)], target_ids[:, :tf.reduce_max(target_lengths)],
+                        source_lengths, target_lengths)
+
+            dataset = dataset.map(add_lengths, output_buffer_size=self.graph_input)
+            self.train_iterator = dataset.make_initializable_iterator()
+
+            return self.train_iterator.get_next()
+
     def embedding_layer(self):
         with tf.name_scope("encoder_inputs"):
             self.encoder_embeddings = tf.Variable(
@@ -102,17 +153,20 @@ class VEDModel(object):
             self.enc_embed_input = self.enc_embed_input[:, :tf.reduce_max(self.source_sentence_length), :]
 
         with tf.name_scope("decoder_inputs"):
-            self.decoder_embeddings = tf.Variable(
-                initial_value=np.array(self.decoder_embeddings_matrix, dtype=np.float32),
-                dtype=tf.float32, trainable=False)
+            if self.shared_vocab:
+                self.decoder_embeddings = self.encoder_embeddings
+            else:
+                self.decoder_embeddings = tf.Variable(
+                    initial_value=np.array(self.decoder_embeddings_matrix, dtype=np.float32),
+                    dtype=tf.float32, trainable=False)
             keep = tf.where(
-                tf.random_uniform([self.batch_size, self.decoder_num_tokens]) < self.word_dropout_keep_prob,
-                tf.fill([self.batch_size, self.decoder_num_tokens], True),
-                tf.fill([self.batch_size, self.decoder_num_tokens], False))
+                tf.random_uniform(tf.shape(self.target_data)) < self.word_dropout_keep_prob,
+                tf.fill(tf.shape(self.target_data), True),
+                tf.fill(tf.shape(self.target_data), False))
             ending = tf.cast(keep, dtype=tf.int32) * self.target_data
-            ending = tf.strided_slice(ending, [0, 0], [self.batch_size, -1], [1, 1],
+            ending = tf.strided_slice(ending, [0, 0], [tf.shape(ending)[0], -1], [1, 1],
                                         name='slice_input')  # Minus 1 implies everything till the last dim
-            self.dec_input = tf.concat([tf.fill([self.batch_size, 1], self.decoder_word_index['GO']), ending], 1,
+            self.dec_input = tf.concat([tf.fill([tf.shape(self.target_data)[0], 1], self.decoder_word_index['GO']), ending], 1,
                                         name='dec_input')
             self.dec_embed_input = tf.nn.embedding_lookup(self.decoder_embeddings, self.dec_input)
             self.max_tar_len = tf.reduce_max(self.target_sentence_length)
@@ -174,7 +228,7 @@ class VEDModel(object):
  
             self.output_layer = Dense(self.decoder_vocab_size)
  
-            self.init_state = dec_cell.zero_state(self.batch_size, tf.float32) # tf.contrib.rnn.LSTMStateTuple(self.c_N, self.h_N) # self.enc_state[0] 
+            self.init_state = dec_cell.zero_state(tf.shape(self.z_vector)[0], tf.float32) # tf.contrib.rnn.LSTMStateTuple(self.c_N, self.h_N) # self.enc_state[0] 
  
             with tf.name_scope("training_decoder"):
                 training_helper = tf.contrib.seq2seq.TrainingHelper(inputs=self.dec_embed_input,
@@ -198,7 +252,7 @@ class VEDModel(object):
                 start_token = self.decoder_word_index['GO']
                 end_token = self.decoder_word_index['EOS']
  
-                start_tokens = tf.tile(tf.constant([start_token], dtype=tf.int32), [self.batch_size],
+                start_tokens = tf.tile(tf.constant([start_token], dtype=tf.int32), [tf.shape(self.z_vector)[0]],
                                        name='start_tokens')
  
                 inference_helper = tf.contrib.seq2seq.GreedyEmbeddingHelper(self.decoder_embeddings,
@@ -223,7 +277,7 @@ class VEDModel(object):
                 start_token = self.decoder_word_index['GO']
                 end_token = self.decoder_word_index['EOS']
  
-                start_tokens = tf.tile(tf.constant([start_token], dtype=tf.int32), [self.batch_size],
+                start_tokens = tf.tile(tf.constant([start_token], dtype=tf.int32), [tf.shape(self.z_vector)[0]],
                                        name='start_tokens')
  
                 inference_helper = tf.contrib.seq2seq.GreedyEmbeddingHelper(self.decoder_embeddings,
@@ -262,7 +316,7 @@ class VEDModel(object):
             self.var_list = tf.trainable_variables()
             self.lossL2 = tf.add_n([tf.nn.l2_loss(v) for v in self.var_list if 'bias' not in v.name]) * 0.001
 
-            self.cost = tf.reduce_sum(self.xent_loss + self.kl_loss_weighted) # + self.lossL2
+            self.cost = tf.reduce_sum(self.example_weights * (self.xent_loss + self.kl_loss_weighted)) # + self.lossL2
 
     def optimize(self):
         # Optimizer
@@ -357,31 +411,30 @@ class VEDModel(object):
             sess.run(tf.global_variables_initializer())
 
             writer = tf.summary.FileWriter(self.logs_dir, sess.graph)
+            data_inputs = [] if self.graph_input else [self.input_data, self.target_data,
+                                                       self.source_sentence_length, self.target_sentence_length,
+                                                       self.example_weights]
+            train_step = utils.TrainStepExecutor(sess, [self.train_op], self.summary_op, data_inputs,
+                                                 [self.lr, self.keep_prob, self.lambda_coeff, self.z_temperature, self.word_dropout_keep_prob],
+                                                 self.summary_every, self.prefetch_batches,
+                                                 log_fetches=[tf.reduce_mean(self.xent_loss)])
 
             for epoch_i in range(1, self.epochs + 1):
 
                 start_time = time.time()
 
-                for batch_i, (input_batch, output_batch, source_sent_lengths, tar_sent_lengths) in enumerate(
-                        utils.get_batches_xy(x_train, y_train, self.batch_size)):
+                for batch_i, (batch_feed, last_batch) in enumerate(train_step.iter_batches(self.get_train_feeds(sess, x_train, y_train, epoch_i))):
 
                     try:
                         iter_i += 1
 
-                        _, _summary, self.train_xent = sess.run(
-                            [self.train_op, self.summary_op, self.xent_loss],
-                            feed_dict={self.input_data: input_batch,
-                                       self.target_data: output_batch,
-                                       self.lr: learning_rate,
-                                       self.source_sentence_length: source_sent_lengths,
-                                       self.target_sentence_length: tar_sent_lengths,
-                                       self.keep_prob: self.dropout_keep_prob,
-                                       self.lambda_coeff: lambda_val,
-                                       self.z_temperature: self.z_temp,
-                                       self.word_dropout_keep_prob: wd_anneal,
-                                       })
-
-                        writer.add_summary(_summary, iter_i)
+                        logs, _summary = train_step.run(
+                            iter_i, batch_feed, [learning_rate, self.dropout_keep_prob, lambda_val, self.z_temp, wd_anneal], last_batch)
+                        if logs is not None:
+                            self.train_xent = logs[0]
+
+                        if _summary is not None:
+                            writer.add_summary(_summary, iter_i)
 
                         # KL Annealing till some iteration
                         if iter_i <= self.anneal_till:
@@ -401,28 +454,60 @@ class VEDModel(object):
                 # Anneal word dropout from 1.0 to the limit
                 wd_anneal = np.max([self.word_dropout_keep_probability, wd_anneal - 0.05])
                 
+                print(train_step.report())
                 time_consumption = time.time() - start_time
                 self.monitor(x_val, y_val, true_val, sess, epoch_i, time_consumption)
 
+    def get_train_feeds(self, sess, x_train, y_train, epoch_i):
+        """
+        Yields the feed_dict entries of the training batches of an epoch. With graph_input, the input pipeline is
+        initialized instead and the entries are empty, the batches are read in the graph.
+        """
+        if not self.graph_input:
+            for input_batch, output_batch, source_sent_lengths, tar_sent_lengths, weights_batch in \
+                    utils.get_weighted_batches_xy(x_train, y_train, self.batch_size, None, self.num_buckets,
+                                                  self.shuffle, self.seed + epoch_i, self.keep_remainder,
+                                                  self.max_tokens):
+                yield {self.input_data: input_batch,
+                       self.target_data: output_batch,
+                       self.source_sentence_length: source_sent_lengths,
+                       self.target_sentence_length: tar_sent_lengths,
+                       self.example_weights: weights_batch}
+            return
+
+        if not isinstance(x_train, np.ndarray) or self.num_buckets or self.max_tokens:
+            raise ValueError('graph_input needs in-memory id matrices and fixed-size batches')
+
+        sess.run(self.train_iterator.initializer, feed_dict={self.train_source_ids: x_train,
+                                                             self.train_target_ids: y_train,
+                                                             self.shuffle_seed: self.seed + epoch_i})
+        num_batches = len(x_train) // self.batch_size
+        if self.keep_remainder and len(x_train) % self.batch_size:
+            num_batches += 1
+        for _ in range(num_batches):
+            yield {}
+
     def validate(self, sess, x_val, y_val, true_val):
         # Calculate BLEU on validation data
         hypotheses_val = []
         references_val = []
 
-        for batch_i, (input_batch, output_batch, source_sent_lengths, tar_sent_lengths) in enumerate(
-                utils.get_batches_xy(x_val, y_val, self.batch_size)):
+        for batch_i, (input_batch, output_batch, source_sent_lengths, tar_sent_lengths, mask) in enumerate(
+                utils.get_batches_xy(x_val, y_val, self.batch_size, keep_remainder=True,
+                                     max_tokens=self.max_tokens)):
             answer_logits = sess.run(self.inference_logits,
                                      feed_dict={self.input_data: input_batch,
                                                 self.source_sentence_length: source_sent_lengths,
                                                 self.keep_prob: 1.0,
                                                 self.word_dropout_keep_prob: 1.0,
                                                 self.z_temperature: self.z_temp})
+            answer_logits = answer_logits[mask]
 
-            for k, pred in enumerate(answer_logits):
+            for pred in answer_logits:
                 hypotheses_val.append(
                     word_tokenize(
-                        " ".join([self.decoder_idx_word[i] for i in pred if i not in [self.pad, -1, self.eos]])))
-                references_val.append([word_tokenize(true_val[batch_i * self.batch_size + k])])
+                        utils.join_subwords([self.decoder_idx_word[i] for i in pred if i not in [self.pad, -1, self.eos]])))
+                references_val.append([word_tokenize(true_val[len(references_val)])])
                 
         self.val_pred = ([" ".join(sent) for sent in hypotheses_val])
         self.val_ref  = ([" ".join(sent[0]) for sent in references_val])
@@ -443,21 +528,23 @@ class VEDModel(object):
             saver = tf.train.Saver()
             saver.restore(sess, checkpoint)
 
-            for batch_i, (input_batch, output_batch, source_sent_lengths, tar_sent_lengths) in enumerate(
-                    utils.get_batches_xy(x_test, y_test, self.batch_size)):
+            for batch_i, (input_batch, output_batch, source_sent_lengths, tar_sent_lengths, mask) in enumerate(
+                    utils.get_batches_xy(x_test, y_test, self.batch_size, keep_remainder=True,
+                                         max_tokens=self.max_tokens)):
                 result = sess.run(self.inference_logits, feed_dict={self.input_data: input_batch,
                                                                     self.source_sentence_length: source_sent_lengths,
                                                                     self.keep_prob: 1.0,
                                                                     self.word_dropout_keep_prob: 1.0,
                                                                     self.z_temperature: self.z_temp})
+                result = result[mask]
 
                 pred_logits.extend(result)
 
-                for k, pred in enumerate(result):
+                for pred in result:
                     hypotheses_test.append(
-                        word_tokenize(" ".join(
-                            [self.decoder_idx_word[i] for i in pred if i not in [self.pad, -1, self.eos]])))
-                    references_test.append([word_tokenize(true_test[batch_i * self.batch_size + k])])
+                        word_tokenize(
+                            utils.join_subwords([self.decoder_idx_word[i] for i in pred if i not in [self.pad, -1, self.eos]])))
+                    references_test.append([word_tokenize(true_test[len(references_test)])])
 
             bleu_scores = utils.calculate_bleu_scores(references_test, hypotheses_test)
 
@@ -471,12 +558,12 @@ class VEDModel(object):
             print('I:      {}'.format(input_test[k].strip()))
             print('A:     {}'.format(true_test[k].strip()))
             print('G: {}\n'.format(
-                " ".join([self.decoder_idx_word[i] for i in pred if i not in [self.pad, self.eos]])))
+                utils.join_subwords([self.decoder_idx_word[i] for i in pred if i not in [self.pad, self.eos]])))
             
     def get_generated_test_output_sentences(self, preds):
         gen_sentences = []
         for pred in preds:
-            gen_sentences.append((" ".join([self.decoder_idx_word[i] for i in pred if i not in [self.pad, self.eos]])))
+            gen_sentences.append((utils.join_subwords([self.decoder_idx_word[i] for i in pred if i not in [self.pad, self.eos]])))
         
         return gen_sentences         
 
@@ -501,17 +588,19 @@ class VEDModel(object):
                 answer_logits = []
                 pred_sentences = []
 
-                for batch_i, (input_batch, output_batch, source_sent_lengths, tar_sent_lengths) in enumerate(
-                        utils.get_batches_xy(x_test_repeated, y_test_repeated, self.batch_size)):
+                for batch_i, (input_batch, output_batch, source_sent_lengths, tar_sent_lengths, mask) in enumerate(
+                        utils.get_batches_xy(x_test_repeated, y_test_repeated, self.batch_size, keep_remainder=True,
+                                             max_tokens=self.max_tokens)):
                     result = sess.run(self.inference_logits, feed_dict={self.input_data: input_batch,
                                                                         self.source_sentence_length: source_sent_lengths,
                                                                         self.keep_prob: 1.0,
                                                                         self.word_dropout_keep_prob: 1.0,
                                                                         self.z_temperature: self.z_temp})
+                    result = result[mask]
                     answer_logits.extend(result)
 
                 for idx, (actual, pred) in enumerate(zip(x_test_repeated, answer_logits)):
-                    pred_sentences.append(" ".join([self.decoder_idx_word[i] for i in pred if i not in [self.pad, self.eos]]))
+                    pred_sentences.append(utils.join_subwords([self.decoder_idx_word[i] for i in pred if i not in [self.pad, self.eos]]))
 
                     if (idx + 1) % num_samples == 0:
                         word_list = [word_tokenize(p) for p in pred_sentences]
@@ -545,7 +634,7 @@ class VEDModel(object):
 
             for pred in result:
                 print('G: {}'.format(
-                    " ".join([self.decoder_idx_word[i] for i in pred if i not in [self.pad, self.eos]])))
+                    utils.join_subwords([self.decoder_idx_word[i] for i in pred if i not in [self.pad, self.eos]])))
                 
     def random_sample_save(self, checkpoint, num_batches=1):
 
@@ -563,7 +652,7 @@ class VEDModel(object):
                                          self.z_temperature: self.z_temp})
 
                 for pred in result:
-                    sent = " ".join([self.decoder_idx_word[i] for i in pred if i not in [self.pad, self.eos]])
+                    sent = utils.join_subwords([self.decoder_idx_word[i] for i in pred if i not in [self.pad, self.eos]])
                     gen_samples.append(sent)
 
         # Create directories for saving sentences generated by random sampling
@@ -575,14 +664,14 @@ class VEDModel(object):
         with open(pwd + '/samples/' + 'sample.txt', 'w') as f:
             f.write('\n'.join(gen_samples))
             
-    def random_sample_in_session(self, sess):
-        z_sampled = np.random.normal(size=(self.batch_size, self.latent_dim))
+    def random_sample_in_session(self, sess, num_samples=10):
+        z_sampled = np.random.normal(size=(num_samples, self.latent_dim))
         result = sess.run(self.inference_logits,feed_dict={self.z_vector: z_sampled, self.keep_prob: 1.0,})
 
         generated = ''
 
-        for pred in result[:10]:
-            generated += '\t\t' + ' '.join([self.decoder_idx_word[i] for i in pred if i not in [self.pad, self.eos]]) + '\n'
+        for pred in result:
+            generated += '\t\t' + utils.join_subwords([self.decoder_idx_word[i] for i in pred if i not in [self.pad, self.eos]]) + '\n'
         return generated
 
     def linear_interpolate(self, checkpoint, num_samples):
@@ -596,7 +685,7 @@ class VEDModel(object):
             steps = np.linspace(0, 1, num_samples)[:, None]
             sampled.append(s1_z * (1 - steps) + s2_z * steps)
 
-        sampled = np.reshape(np.array(sampled), newshape=(self.batch_size, self.latent_dim))
+        sampled = np.reshape(np.array(sampled), newshape=(-1, self.latent_dim))
         with tf.Session() as sess:
             sess.run(tf.global_variables_initializer())
             saver = tf.train.Saver()
@@ -611,7 +700,7 @@ class VEDModel(object):
                 if i % num_samples == 0:
                     print()
                 print('G: {}'.format(
-                    " ".join([self.decoder_idx_word[i] for i in pred if i not in [self.pad, self.eos]])))
+                    utils.join_subwords([self.decoder_idx_word[i] for i in pred if i not in [self.pad, self.eos]])))
                 
     def linear_interpolate_between_inputs(self, checkpoint, start_sent, end_sent, num_samples=8):
 
@@ -626,8 +715,8 @@ class VEDModel(object):
         end_idx_seq = np.concatenate([end_idx_seq, np.zeros(max(0, self.decoder_num_tokens - len(end_idx_seq)))])[
                         :self.decoder_num_tokens]
 
-        # Reshape/tile so that the input has first dimension as batch size
-        inp_idx_seq = np.tile(np.vstack([start_idx_seq, end_idx_seq]), [self.batch_size//2, 1])
+        # The batch dimension is dynamic, only the two sentences are encoded
+        inp_idx_seq = np.vstack([start_idx_seq, end_idx_seq])
         # source_sent_lengths = [np.count_nonzero(seq) for seq in inp_idx_seq]
 
         # Get z_vector of first and last sentence
@@ -641,8 +730,7 @@ class VEDModel(object):
         steps = np.linspace(0, 1, num_samples)[:, None]
         sampled.append(s1_z * (1 - steps) + s2_z * steps)
 
-        sampled = np.tile(sampled[0], [self.batch_size//num_samples, 1])
-        # sampled = np.reshape(np.array(sampled), newshape=(self.batch_size, self.latent_dim))
+        sampled = sampled[0]
         with tf.Session() as sess:
             sess.run(tf.global_variables_initializer())
             saver = tf.train.Saver()
@@ -653,9 +741,9 @@ class VEDModel(object):
                                          self.keep_prob: 1.0,
                                          })
 
-            for i, pred in enumerate(result[:num_samples]):
+            for i, pred in enumerate(result):
                 print('G: {}'.format(
-                    " ".join([self.decoder_idx_word[i] for i in pred if i not in [self.pad, self.eos]])))
+                    utils.join_subwords([self.decoder_idx_word[i] for i in pred if i not in [self.pad, self.eos]])))
 
     def get_neighbourhood(self, checkpoint, x_test, temp=1.0, num_samples=10):
         answer_logits = []
@@ -667,19 +755,21 @@ class VEDModel(object):
             saver = tf.train.Saver()
             saver.restore(sess, checkpoint)
 
-            for batch_i, (input_batch, output_batch, source_sent_lengths, tar_sent_lengths) in enumerate(
-                    utils.get_batches_xy(x_test, y_test, self.batch_size)):
+            for batch_i, (input_batch, output_batch, source_sent_lengths, tar_sent_lengths, mask) in enumerate(
+                    utils.get_batches_xy(x_test, y_test, self.batch_size, keep_remainder=True,
+                                         max_tokens=self.max_tokens)):
                 result = sess.run(self.inference_logits, feed_dict={self.input_data: input_batch,
                                                                     self.source_sentence_length: sent_lengths,
                                                                     self.keep_prob: 1.0,
                                                                     self.word_dropout_keep_prob: 1.0,
                                                                     self.z_temperature: temp})
+                result = result[mask]
                 answer_logits.extend(result)
 
             for idx, (actual, pred) in enumerate(zip(x_test_repeated, answer_logits)):
-                pred_sentences.append(" ".join([self.decoder_idx_word[i] for i in pred if i not in [self.pad, self.eos]]))
+                pred_sentences.append(utils.join_subwords([self.decoder_idx_word[i] for i in pred if i not in [self.pad, self.eos]]))
 
         for j in range(len(pred_sentences)):
             if j % num_samples == 0:
-                print('\nA: {}'.format(" ".join([self.decoder_idx_word[i] for i in x_test_repeated[j] if i not in [self.pad, self.eos]])))
+                print('\nA: {}'.format(utils.join_subwords([self.decoder_idx_word[i] for i in x_test_repeated[j] if i not in [self.pad, self.eos]])))
             print('G: {}'.format(pred_sentences[j]))
@@ -1,15 +1,27 @@
+from pathsetup import run_path_setup
+run_path_setup()
+
 import os
+import re
 import argparse
+import multiprocessing
 import gensim
 import numpy as np
 import pandas as pd
 from nltk.tokenize import word_tokenize
+import utils
 
 
 W2V_DIR = 'w2v_models/'
 
 parser = argparse.ArgumentParser(description='Create word2vec embeddings for the specified dataset')
 parser.add_argument('-d', '--dataset', help='Specify dataset: movie or daily', required=True)
+parser.add_argument('--streaming', type=int, default=0, help='if 1, tokenize in a process pool into a corpus file which gensim streams from disk (for corpora larger than memory)')
+parser.add_argument('--num_workers', type=int, default=multiprocessing.cpu_count(), help='number of tokenizing processes and gensim threads (--streaming)')
+parser.add_argument('--chunk_size', type=int, default=100000, help='number of sentences tokenized at a time, sentences are shuffled within their chunk (--streaming)')
+parser.add_argument('--tokenizer', type=str, default='nltk', help='word tokenizer: nltk | native (--streaming, --update)')
+parser.add_argument('-u', '--update', nargs='+', default=[], help='new csv files (line,reply columns): the latest word2vec model of the dataset is updated with their pairs only, and saved as a new version')
+parser.add_argument('--update_epochs', type=int, default=5, help='number of epochs over the new pairs (--update)')
 args = vars(parser.parse_args())
 
 
@@ -29,6 +41,15 @@ def main():
         print('Invalid Argument !')
         return
 
+    if args['update']:
+        update_w2v(iter_data(args['update'], ''), args['tokenizer'])
+        return
+
+    if args['streaming']:
+        create_w2v_streaming(iter_data(files, data_dir))
+        print('Word2Vec created successfully for {}'.format(args['dataset']))
+        return
+
     df_list = pd.concat(load_data(files, data_dir))
     df_list.reset_index(inplace=True, drop=True)
     data = list(df_list.iloc[:, 0] + df_list.iloc[:, 1]) # 1st and 2nd column, i.e., line and reply
@@ -44,6 +65,16 @@ def load_data(files, data_dir):
     return df_list
 
 
+def iter_data(files, data_dir, chunk_size=100000):
+    """
+    Lazily reads the csv files, yielding line and reply of a pair joined in the same way as in main.
+    """
+    for f in files:
+        for df in pd.read_csv(data_dir + f, chunksize=chunk_size):
+            for sentence in df.iloc[:, 0] + df.iloc[:, 1]:
+                yield sentence
+
+
 def create_w2v(sentences):
     np.random.shuffle(sentences)
     sentences = [word_tokenize(s) for s in sentences]
@@ -54,7 +85,60 @@ def create_w2v(sentences):
                                        iter=50)
         
     w2v_model.save(W2V_DIR + 'w2vmodel_' + args['dataset'] + '.pkl')
+    utils.export_w2v_vectors(w2v_model, W2V_DIR + 'w2vmodel_' + args['dataset'] + '.pkl')
+
+
+def create_w2v_streaming(sentences):
+    corpus_path = W2V_DIR + 'w2vmodel_' + args['dataset'] + '.tok.txt'
+    utils.write_w2v_corpus(sentences, corpus_path, args['chunk_size'], args['num_workers'], args['tokenizer'])
+    w2v_model = utils.train_w2v_streaming(corpus_path, workers=args['num_workers'])
+
+    w2v_model.save(W2V_DIR + 'w2vmodel_' + args['dataset'] + '.pkl')
+    utils.export_w2v_vectors(w2v_model, W2V_DIR + 'w2vmodel_' + args['dataset'] + '.pkl')
+
+
+def w2v_versions():
+    """
+    Returns the (version, path) pairs of the word2vec models of the dataset, the model of w2v_generator.py is
+    version 0 and update_w2v adds versions w2vmodel_<dataset>_v<version>.pkl.
+    """
+    versions = []
+    if os.path.exists(W2V_DIR + 'w2vmodel_' + args['dataset'] + '.pkl'):
+        versions.append((0, W2V_DIR + 'w2vmodel_' + args['dataset'] + '.pkl'))
+    for f in os.listdir(W2V_DIR):
+        match = re.match(r'w2vmodel_{}_v(\d+)\.pkl$'.format(re.escape(args['dataset'])), f)
+        if match:
+            versions.append((int(match.group(1)), W2V_DIR + f))
+
+    return sorted(versions)
+
+
+def update_w2v(sentences, tokenizer='nltk'):
+    """
+    Extends the vocabulary of the latest word2vec model with the new sentences and trains it on them only.
+    The sentences are word tokenized with the given tokenizer ('nltk' or 'native'), like the training corpus.
+    """
+    versions = w2v_versions()
+    if not versions:
+        print('No word2vec model for {}, run without --update first'.format(args['dataset']))
+        return
+    version, base_path = versions[-1]
+
+    sentences = list(sentences)
+    np.random.shuffle(sentences)
+    sentences = utils.word_tokenize_sentences(sentences, tokenizer)
+
+    w2v_model = gensim.models.Word2Vec.load(base_path)
+    vocab_size = len(w2v_model.wv.vocab)
+    w2v_model.build_vocab(sentences, update=True)
+    w2v_model.train(sentences, total_examples=len(sentences), epochs=args['update_epochs'])
+
+    w2v_path = W2V_DIR + 'w2vmodel_{}_v{}.pkl'.format(args['dataset'], version + 1)
+    w2v_model.save(w2v_path)
+    utils.export_w2v_vectors(w2v_model, w2v_path)
+    print('Word2Vec {} updated with {} sentences ({} new words): {}'.format(
+        base_path, len(sentences), len(w2v_model.wv.vocab) - vocab_size, w2v_path))
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -29,6 +29,7 @@ class DetWEDModel(object):
 
         self.encoder_vocab_size = config['encoder_vocab']
         self.decoder_vocab_size = config['decoder_vocab']
+        self.shared_vocab = config['shared_vocab']
 
         self.encoder_num_tokens = config['encoder_num_tokens']
         self.decoder_num_tokens = config['decoder_num_tokens']
@@ -42,6 +43,14 @@ class DetWEDModel(object):
         self.min_learning_rate = config['min_learning_rate']
 
         self.batch_size = config['batch_size']
+        self.num_buckets = config['num_buckets']
+        self.shuffle = config['shuffle']
+        self.keep_remainder = config['keep_remainder']
+        self.seed = config['seed']
+        self.max_tokens = config['max_tokens']
+        self.graph_input = config['graph_input']
+        self.summary_every = config['summary_every']
+        self.prefetch_batches = config['prefetch_batches']
         self.epochs = config['n_epochs']
 
         self.encoder_embeddings_matrix = encoder_embeddings_matrix
@@ -80,16 +89,69 @@ class DetWEDModel(object):
     def init_placeholders(self):
         with tf.name_scope("model_inputs"):
             # Create palceholders for inputs to the model
-            self.input_data = tf.placeholder(tf.int32, [self.batch_size, self.encoder_num_tokens], name='input')
-            self.target_data = tf.placeholder(tf.int32, [self.batch_size, self.decoder_num_tokens], name='targets')
+            if self.graph_input:
+                # Training batches come from the input pipeline, other batches are fed as usual
+                source_ids, target_ids, source_lengths, target_lengths, batch_weights = self.build_input_pipeline()
+                self.input_data = tf.placeholder_with_default(source_ids, [None, None], name='input')
+                self.target_data = tf.placeholder_with_default(target_ids, [None, None], name='targets')
+                self.source_sentence_length = tf.placeholder_with_default(source_lengths, shape=(None,),
+                                                                          name='source_sentence_length')
+                self.target_sentence_length = tf.placeholder_with_default(target_lengths, shape=(None,),
+                                                                          name='target_sentence_length')
+                self.example_weights = tf.placeholder_with_default(batch_weights, shape=(None,),
+                                                                   name='example_weights')  # Loss weights
+            else:
+                self.input_data = tf.placeholder(tf.int32, [None, None], name='input')
+                self.target_data = tf.placeholder(tf.int32, [None, None], name='targets')
+                self.source_sentence_length = tf.placeholder(tf.int32, shape=(None,),
+                                                             name='source_sentence_length')
+                self.target_sentence_length = tf.placeholder(tf.int32, shape=(None,),
+                                                             name='target_sentence_length')
+                self.example_weights = tf.placeholder_with_default(tf.ones(tf.shape(self.input_data)[:1]), shape=(None,),
+                                                                   name='example_weights')  # Loss weights
             self.lr = tf.placeholder(tf.float32, name='learning_rate', shape=())
             self.keep_prob = tf.placeholder(tf.float32, name='keep_prob')  # Dropout Keep Probability
-            self.source_sentence_length = tf.placeholder(tf.int32, shape=(self.batch_size,),
-                                                         name='source_sentence_length')
-            self.target_sentence_length = tf.placeholder(tf.int32, shape=(self.batch_size,),
-                                                         name='target_sentence_length')
             self.lambda_coeff = tf.placeholder(tf.float32, name='lambda_coeff', shape=())
             
+    def build_input_pipeline(self):
+        """
+        Reads the training batches in the graph: the input and output id matrices of the training set are fed once
+        per epoch to initialize self.train_iterator, the sequence lengths are computed in the graph and up to
+        graph_input batches are prepared ahead of the training step. The final partial batch of keep_remainder is
+        filled up with its own examples at loss weight 0, as get_weighted_batches_xy does. Unlike there, a
+        single remaining example is not added to the previous batch, the MMD penalty of its batch is dropped.
+        """
+        with tf.name_scope("input_pipeline"):
+            self.train_source_ids = tf.placeholder(tf.int32, [None, None], name='train_source_ids')
+            self.train_target_ids = tf.placeholder(tf.int32, [None, None], name='train_target_ids')
+            self.shuffle_seed = tf.placeholder(tf.int64, shape=(), name='shuffle_seed')
+
+            dataset = tf.contrib.data.Dataset.from_tensor_slices((self.train_source_ids, self.train_target_ids))
+            if self.shuffle:
+                dataset = dataset.shuffle(tf.cast(tf.shape(self.train_source_ids)[0], tf.int64), seed=self.shuffle_seed)
+            dataset = dataset.batch(self.batch_size)
+            if not self.keep_remainder:
+                dataset = dataset.filter(lambda source_ids, target_ids: tf.equal(tf.shape(source_ids)[0], self.batch_size))
+
+            def add_weights(source_ids, target_ids):
+                num_valid = tf.shape(source_ids)[0]
+                repeats = tf.range(self.batch_size) % num_valid
+                weights = tf.cast(tf.range(self.batch_size) < num_valid, tf.float32)
+                return tf.gather(source_ids, repeats), tf.gather(target_ids, repeats), weights
+
+            def add_lengths(source_ids, target_ids, weights):
+                source_lengths = tf.reduce_sum(
+                    tf.cast(tf.not_equal(source_ids, self.encoder_word_index['PAD']), tf.int32), axis=1)
+                target_lengths = tf.reduce_sum(tf.cast(tf.not_equal(target_ids, self.pad), tf.int32), axis=1)
+                return (source_ids[:, :tf.reduce_max(source_lengths)], target_ids[:, :tf.reduce_max(target_lengths)],
+                        source_lengths, target_lengths, weights)
+
+            dataset = dataset.map(add_weights)
+            dataset = dataset.map(add_lengths, output_buffer_size=self.graph_input)
+            self.train_iterator = dataset.make_initializable_iterator()
+
+            return self.train_iterator.get_next()
+
     def embedding_layer(self):
         with tf.name_scope("encoder_inputs"):
             self.encoder_embeddings = tf.Variable(
@@ -99,10 +161,13 @@ class DetWEDModel(object):
             self.enc_embed_input = self.enc_embed_input[:, :tf.reduce_max(self.source_sentence_length), :]
 
         with tf.name_scope("decoder_inputs"):
-            self.decoder_embeddings = tf.Variable(
-                initial_value=np.array(self.decoder_embeddings_matrix, dtype=np.float32),
-                dtype=tf.float32, trainable=False)
-            self.dec_input = tf.concat([tf.fill([self.batch_size, 1], self.decoder_word_index['GO']),  self.target_data], 1,
+            if self.shared_vocab:
+                self.decoder_embeddings = self.encoder_embeddings
+            else:
+                self.decoder_embeddings = tf.Variable(
+                    initial_value=np.array(self.decoder_embeddings_matrix, dtype=np.float32),
+                    dtype=tf.float32, trainable=False)
+            self.dec_input = tf.concat([tf.fill([tf.shape(self.target_data)[0], 1], self.decoder_word_index['GO']),  self.target_data], 1,
                                         name='dec_input')
             self.dec_embed_input = tf.nn.embedding_lookup(self.decoder_embeddings, self.dec_input)
             self.max_tar_len = tf.reduce_max(self.target_sentence_length)
@@ -139,7 +204,7 @@ class DetWEDModel(object):
     def sample_gaussian(self):
         """(Differentiably!) draw sample from Gaussian with given shape, subject to random noise epsilon"""
         with tf.name_scope('sample_gaussian'):
-            self.z_sampled = tf.random_normal([self.batch_size, self.latent_dim], name='z_sampled') # Dimension [batch_size x latent_dim]
+            self.z_sampled = tf.random_normal([tf.shape(self.z_tilda)[0], self.latent_dim], name='z_sampled') # Dimension [batch_size x latent_dim]
 
     def build_decoder(self):
         with tf.variable_scope("decode"):
@@ -150,7 +215,7 @@ class DetWEDModel(object):
  
             self.output_layer = Dense(self.decoder_vocab_size)
  
-            self.init_state = dec_cell.zero_state(self.batch_size, tf.float32) # tf.contrib.rnn.LSTMStateTuple(self.c_N, self.h_N) # self.enc_state[0] 
+            self.init_state = dec_cell.zero_state(tf.shape(self.z_tilda)[0], tf.float32) # tf.contrib.rnn.LSTMStateTuple(self.c_N, self.h_N) # self.enc_state[0] 
  
             with tf.name_scope("training_decoder"):
                 training_helper = tf.contrib.seq2seq.TrainingHelper(inputs=self.dec_embed_input,
@@ -174,7 +239,7 @@ class DetWEDModel(object):
                 start_token = self.decoder_word_index['GO']
                 end_token = self.decoder_word_index['EOS']
  
-                start_tokens = tf.tile(tf.constant([start_token], dtype=tf.int32), [self.batch_size],
+                start_tokens = tf.tile(tf.constant([start_token], dtype=tf.int32), [tf.shape(self.z_tilda)[0]],
                                        name='start_tokens')
  
                 inference_helper = tf.contrib.seq2seq.GreedyEmbeddingHelper(self.decoder_embeddings,
@@ -199,7 +264,7 @@ class DetWEDModel(object):
                 start_token = self.decoder_word_index['GO']
                 end_token = self.decoder_word_index['EOS']
  
-                start_tokens = tf.tile(tf.constant([start_token], dtype=tf.int32), [self.batch_size],
+                start_tokens = tf.tile(tf.constant([start_token], dtype=tf.int32), [tf.shape(self.z_sampled)[0]],
                                        name='start_tokens')
  
                 inference_helper = tf.contrib.seq2seq.GreedyEmbeddingHelper(self.decoder_embeddings,
@@ -208,7 +273,7 @@ class DetWEDModel(object):
  
                 inference_decoder = basic_decoder.BasicDecoder(dec_cell,
                                                                inference_helper,
-                                                               initial_state=self.init_state,
+                                                               initial_state=dec_cell.zero_state(tf.shape(self.z_sampled)[0], tf.float32),
                                                                latent_vector=self.z_sampled,
                                                                output_layer=self.output_layer)
  
@@ -219,11 +284,18 @@ class DetWEDModel(object):
  
                 self.inference_logits = tf.identity(self.inference_logits.sample_id, name='predictions')
  
-    def mmd_penalty(self, sample_qz, sample_pz):
-        n = self.batch_size
-        n = tf.cast(n, tf.int32)
+    def mmd_penalty(self, sample_qz, sample_pz, weights_pz):
+        n = tf.shape(sample_qz)[0]
         nf = tf.cast(n, tf.float32)
-        half_size = (n * n - n) / 2
+        half_size = (n * n - n) // 2
+
+        # Weighted kernel averages over the samples of pz, uniform weights give the usual unbiased estimate.
+        # The penalty is dropped for a batch with less than two samples of nonzero weight (no pairs of pz)
+        has_pairs = tf.cast(tf.count_nonzero(weights_pz) >= 2, tf.float32)
+        weights_pz = weights_pz / tf.maximum(tf.reduce_sum(weights_pz), 1e-8)
+        pair_weights_pz = tf.multiply(tf.matmul(weights_pz[:, None], weights_pz[None, :]), 1. - tf.eye(n))
+        pair_weights_pz = pair_weights_pz / tf.maximum(tf.reduce_sum(pair_weights_pz), 1e-8)
+        cross_weights = tf.tile(weights_pz[None, :], [n, 1]) / nf  # distances are [qz x pz]
 
         norms_pz = tf.reduce_sum(tf.square(sample_pz), axis=1, keep_dims=True)
         dotprods_pz = tf.matmul(sample_pz, sample_pz, transpose_b=True)
@@ -244,12 +316,11 @@ class DetWEDModel(object):
                 tf.reshape(distances_qz, [-1]), half_size).values[half_size - 1]
             # if opts['verbose']:
             #     sigma2_k = tf.Print(sigma2_k, [sigma2_k], 'Kernel width:')
-            res1 = tf.exp(- distances_qz / 2. / sigma2_k)
-            res1 += tf.exp(- distances_pz / 2. / sigma2_k)
-            res1 = tf.multiply(res1, 1. - tf.eye(n))
+            res1 = tf.multiply(tf.exp(- distances_qz / 2. / sigma2_k), 1. - tf.eye(n))
             res1 = tf.reduce_sum(res1) / (nf * nf - nf)
+            res1 += tf.reduce_sum(tf.exp(- distances_pz / 2. / sigma2_k) * pair_weights_pz)
             res2 = tf.exp(- distances / 2. / sigma2_k)
-            res2 = tf.reduce_sum(res2) * 2. / (nf * nf)
+            res2 = tf.reduce_sum(res2 * cross_weights) * 2.
             stat = res1 - res2
         elif self.config['kernel'] == 'IMQ':
             # k(x, y) = C / (C + ||x - y||^2)
@@ -269,28 +340,29 @@ class DetWEDModel(object):
             stat = 0.
             for scale in [.1, .2, .5, 1., 2., 5., 10.]:
                 C = Cbase * scale
-                res1 = C / (C + distances_qz)
-                res1 += C / (C + distances_pz)
-                res1 = tf.multiply(res1, 1. - tf.eye(n))
+                res1 = tf.multiply(C / (C + distances_qz), 1. - tf.eye(n))
                 res1 = tf.reduce_sum(res1) / (nf * nf - nf)
+                res1 += tf.reduce_sum(C / (C + distances_pz) * pair_weights_pz)
                 res2 = C / (C + distances)
-                res2 = tf.reduce_sum(res2) * 2. / (nf * nf)
+                res2 = tf.reduce_sum(res2 * cross_weights) * 2.
                 stat += res1 - res2
-        return stat
+        return stat * has_pairs
 
     def loss(self):
         with tf.name_scope('losses'):
-            self.wasserstein_loss = self.mmd_penalty(self.z_sampled, self.z_tilda)
+            self.wasserstein_loss = self.mmd_penalty(self.z_sampled, self.z_tilda, self.example_weights)
 
             # Create the weights for sequence_loss
             masks = tf.sequence_mask(self.target_sentence_length, self.decoder_num_tokens, dtype=tf.float32, name='masks')
 
-            self.xent_loss = tf.contrib.seq2seq.sequence_loss(
+            # Average over the tokens of the batch, with every example counted example_weights times
+            token_weights = masks[:, :self.max_tar_len] * self.example_weights[:, None]
+            self.xent_loss = tf.reduce_sum(tf.contrib.seq2seq.sequence_loss(
                 self.training_logits,
                 self.target_data[:, :self.max_tar_len],
-                weights=masks[:, :self.max_tar_len],
-                average_across_timesteps=True,
-                average_across_batch=True)
+                weights=token_weights,
+                average_across_timesteps=False,
+                average_across_batch=False)) / tf.reduce_sum(token_weights)
             
             # L2-Regularization
             self.var_list = tf.trainable_variables()
@@ -377,29 +449,30 @@ class DetWEDModel(object):
             sess.run(tf.global_variables_initializer())
 
             writer = tf.summary.FileWriter(self.logs_dir, sess.graph)
+            data_inputs = [] if self.graph_input else [self.input_data, self.target_data,
+                                                       self.source_sentence_length, self.target_sentence_length,
+                                                       self.example_weights]
+            train_step = utils.TrainStepExecutor(sess, [self.train_op], self.summary_op, data_inputs,
+                                                 [self.lr, self.keep_prob, self.lambda_coeff],
+                                                 self.summary_every, self.prefetch_batches,
+                                                 log_fetches=[tf.reduce_mean(self.xent_loss)])
 
             for epoch_i in range(1, self.epochs + 1):
 
                 start_time = time.time()
 
-                for batch_i, (input_batch, output_batch, source_sent_lengths, tar_sent_lengths) in enumerate(
-                        utils.get_batches_xy(x_train, y_train, self.batch_size)):
+                for batch_i, (batch_feed, last_batch) in enumerate(train_step.iter_batches(self.get_train_feeds(sess, x_train, y_train, epoch_i))):
 
                     try:
                         iter_i += 1
 
-                        _, _summary, self.train_xent = sess.run(
-                            [self.train_op, self.summary_op, self.xent_loss],
-                            feed_dict={self.input_data: input_batch,
-                                       self.target_data: output_batch,
-                                       self.lr: learning_rate,
-                                       self.source_sentence_length: source_sent_lengths,
-                                       self.target_sentence_length: tar_sent_lengths,
-                                       self.keep_prob: self.dropout_keep_prob,
-                                       self.lambda_coeff: self.lambda_val,
-                                       })
-
-                        writer.add_summary(_summary, iter_i)
+                        logs, _summary = train_step.run(
+                            iter_i, batch_feed, [learning_rate, self.dropout_keep_prob, self.lambda_val], last_batch)
+                        if logs is not None:
+                            self.train_xent = logs[0]
+
+                        if _summary is not None:
+                            writer.add_summary(_summary, iter_i)
                         
                     except Exception as e:
                         print(iter_i, e)
@@ -408,27 +481,59 @@ class DetWEDModel(object):
                 # Reduce learning rate, but not below its minimum value
                 learning_rate = np.max([self.min_learning_rate, learning_rate * self.learning_rate_decay])
                 
+                print(train_step.report())
                 time_consumption = time.time() - start_time
                 self.monitor(x_val, y_val, true_val, sess, epoch_i, time_consumption)
 
+    def get_train_feeds(self, sess, x_train, y_train, epoch_i):
+        """
+        Yields the feed_dict entries of the training batches of an epoch. With graph_input, the input pipeline is
+        initialized instead and the entries are empty, the batches are read in the graph.
+        """
+        if not self.graph_input:
+            for input_batch, output_batch, source_sent_lengths, tar_sent_lengths, weights_batch in \
+                    utils.get_weighted_batches_xy(x_train, y_train, self.batch_size, None, self.num_buckets,
+                                                  self.shuffle, self.seed + epoch_i, self.keep_remainder,
+                                                  self.max_tokens):
+                yield {self.input_data: input_batch,
+                       self.target_data: output_batch,
+                       self.source_sentence_length: source_sent_lengths,
+                       self.target_sentence_length: tar_sent_lengths,
+                       self.example_weights: weights_batch}
+            return
+
+        if not isinstance(x_train, np.ndarray) or self.num_buckets or self.max_tokens:
+            raise ValueError('graph_input needs in-memory id matrices and fixed-size batches')
+
+        sess.run(self.train_iterator.initializer, feed_dict={self.train_source_ids: x_train,
+                                                             self.train_target_ids: y_train,
+                                                             self.shuffle_seed: self.seed + epoch_i})
+        num_batches = len(x_train) // self.batch_size
+        if self.keep_remainder and len(x_train) % self.batch_size:
+            num_batches += 1
+        for _ in range(num_batches):
+            yield {}
+
     def validate(self, sess, x_val, y_val, true_val):
         # Calculate BLEU on validation data
         hypotheses_val = []
         references_val = []
 
-        for batch_i, (input_batch, output_batch, source_sent_lengths, tar_sent_lengths) in enumerate(
-                utils.get_batches_xy(x_val, y_val, self.batch_size)):
+        for batch_i, (input_batch, output_batch, source_sent_lengths, tar_sent_lengths, mask) in enumerate(
+                utils.get_batches_xy(x_val, y_val, self.batch_size, keep_remainder=True,
+                                     max_tokens=self.max_tokens)):
             answer_logits = sess.run(self.validate_sent,
                                      feed_dict={self.input_data: input_batch,
                                                 self.source_sentence_length: source_sent_lengths,
                                                 self.keep_prob: 1.0,
                                                 })
+            answer_logits = answer_logits[mask]
             
-            for k, pred in enumerate(answer_logits):
+            for pred in answer_logits:
                 hypotheses_val.append(
                     word_tokenize(
-                        " ".join([self.decoder_idx_word[i] for i in pred if i not in [self.pad, -1, self.eos]])))
-                references_val.append([word_tokenize(true_val[batch_i * self.batch_size + k])])
+                        utils.join_subwords([self.decoder_idx_word[i] for i in pred if i not in [self.pad, -1, self.eos]])))
+                references_val.append([word_tokenize(true_val[len(references_val)])])
                 
         self.val_pred = ([" ".join(sent) for sent in hypotheses_val])
         self.val_ref  = ([" ".join(sent[0]) for sent in references_val])
@@ -449,20 +554,22 @@ class DetWEDModel(object):
             saver = tf.train.Saver()
             saver.restore(sess, checkpoint)
 
-            for batch_i, (input_batch, output_batch, source_sent_lengths, tar_sent_lengths) in enumerate(
-                    utils.get_batches_xy(x_test, y_test, self.batch_size)):
+            for batch_i, (input_batch, output_batch, source_sent_lengths, tar_sent_lengths, mask) in enumerate(
+                    utils.get_batches_xy(x_test, y_test, self.batch_size, keep_remainder=True,
+                                         max_tokens=self.max_tokens)):
                 result = sess.run(self.validate_sent, feed_dict={self.input_data: input_batch,
                                                                     self.source_sentence_length: source_sent_lengths,
                                                                     self.keep_prob: 1.0,
                                                                     })
+                result = result[mask]
 
                 pred_logits.extend(result)
 
-                for k, pred in enumerate(result):
+                for pred in result:
                     hypotheses_test.append(
                         word_tokenize(
-                            " ".join([self.decoder_idx_word[i] for i in pred if i not in [self.pad, -1, self.eos]])))
-                    references_test.append([word_tokenize(true_test[batch_i * self.batch_size + k])])
+                            utils.join_subwords([self.decoder_idx_word[i] for i in pred if i not in [self.pad, -1, self.eos]])))
+                    references_test.append([word_tokenize(true_test[len(references_test)])])
 
             bleu_scores = utils.calculate_bleu_scores(references_test, hypotheses_test)
 
@@ -473,7 +580,7 @@ class DetWEDModel(object):
     def get_generated_test_output_sentences(self, preds):
         gen_sentences = []
         for pred in preds:
-            gen_sentences.append((" ".join([self.decoder_idx_word[i] for i in pred if i not in [self.pad, self.eos]])))
+            gen_sentences.append((utils.join_subwords([self.decoder_idx_word[i] for i in pred if i not in [self.pad, self.eos]])))
         
         return gen_sentences  
 
@@ -483,7 +590,7 @@ class DetWEDModel(object):
             print('I:      {}'.format(input_test[k].strip()))
             print('A:     {}'.format(true_test[k].strip()))
             print('G: {}\n'.format(
-                " ".join([self.decoder_idx_word[i] for i in pred if i not in [self.pad, self.eos]])))
+                utils.join_subwords([self.decoder_idx_word[i] for i in pred if i not in [self.pad, self.eos]])))
 
     def get_diversity_metrics(self, checkpoint, x_test, y_test, num_samples=10, num_iterations=3):
 
@@ -506,16 +613,18 @@ class DetWEDModel(object):
                 answer_logits = []
                 pred_sentences = []
 
-                for batch_i, (input_batch, output_batch, source_sent_lengths, tar_sent_lengths) in enumerate(
-                        utils.get_batches_xy(x_test_repeated, y_test_repeated, self.batch_size)):
+                for batch_i, (input_batch, output_batch, source_sent_lengths, tar_sent_lengths, mask) in enumerate(
+                        utils.get_batches_xy(x_test_repeated, y_test_repeated, self.batch_size, keep_remainder=True,
+                                             max_tokens=self.max_tokens)):
                     result = sess.run(self.validate_sent, feed_dict={self.input_data: input_batch,
                                                                         self.source_sentence_length: source_sent_lengths,
                                                                         self.keep_prob: 1.0,
                                                                         })
+                    result = result[mask]
                     answer_logits.extend(result)
 
                 for idx, (actual, pred) in enumerate(zip(x_test_repeated, answer_logits)):
-                    pred_sentences.append(" ".join([self.decoder_idx_word[i] for i in pred if i not in [self.pad, self.eos]]))
+                    pred_sentences.append(utils.join_subwords([self.decoder_idx_word[i] for i in pred if i not in [self.pad, self.eos]]))
 
                     if (idx + 1) % num_samples == 0:
                         word_list = [word_tokenize(p) for p in pred_sentences]
@@ -549,7 +658,7 @@ class DetWEDModel(object):
 
             for pred in result:
                 print('G: {}'.format(
-                    " ".join([self.decoder_idx_word[i] for i in pred if i not in [self.pad, self.eos]])))
+                    utils.join_subwords([self.decoder_idx_word[i] for i in pred if i not in [self.pad, self.eos]])))
 
     def random_sample_save(self, checkpoint, num_batches=1):
 
@@ -567,7 +676,7 @@ class DetWEDModel(object):
                                          })
 
                 for pred in result:
-                    sent = " ".join([self.decoder_idx_word[i] for i in pred if i not in [self.pad, self.eos]])
+                    sent = utils.join_subwords([self.decoder_idx_word[i] for i in pred if i not in [self.pad, self.eos]])
                     gen_samples.append(sent)
 
         # Create directories for saving sentences generated by random sampling
@@ -579,14 +688,14 @@ class DetWEDModel(object):
         with open(pwd + '/samples/' + 'sample.txt', 'w') as f:
             f.write('\n'.join(gen_samples))
                 
-    def random_sample_in_session(self, sess):
-        z_sampled = np.random.normal(size=(self.batch_size, self.latent_dim))
+    def random_sample_in_session(self, sess, num_samples=10):
+        z_sampled = np.random.normal(size=(num_samples, self.latent_dim))
         result = sess.run(self.inference_logits,feed_dict={self.z_sampled: z_sampled, self.keep_prob: 1.0,})
 
         generated = ''
 
-        for pred in result[:10]:
-            generated += '\t\t' + ' '.join([self.decoder_idx_word[i] for i in pred if i not in [self.pad, self.eos]]) + '\n'
+        for pred in result:
+            generated += '\t\t' + utils.join_subwords([self.decoder_idx_word[i] for i in pred if i not in [self.pad, self.eos]]) + '\n'
         return generated
     
     def linear_interpolate(self, checkpoint, num_samples):
@@ -600,7 +709,7 @@ class DetWEDModel(object):
             steps = np.linspace(0, 1, num_samples)[:, None]
             sampled.append(s1_z * (1 - steps) + s2_z * steps)
 
-        sampled = np.reshape(np.array(sampled), newshape=(self.batch_size, self.latent_dim))
+        sampled = np.reshape(np.array(sampled), newshape=(-1, self.latent_dim))
         with tf.Session() as sess:
             sess.run(tf.global_variables_initializer())
             saver = tf.train.Saver()
@@ -615,7 +724,7 @@ class DetWEDModel(object):
                 if i % num_samples == 0:
                     print()
                 print('G: {}'.format(
-                    " ".join([self.decoder_idx_word[i] for i in pred if i not in [self.pad, self.eos]])))
+                    utils.join_subwords([self.decoder_idx_word[i] for i in pred if i not in [self.pad, self.eos]])))
     
     def linear_interpolate_between_inputs(self, checkpoint, start_sent, end_sent, num_samples=8):
 
@@ -630,8 +739,8 @@ class DetWEDModel(object):
         end_idx_seq = np.concatenate([end_idx_seq, np.zeros(max(0, self.decoder_num_tokens - len(end_idx_seq)))])[
                         :self.decoder_num_tokens]
 
-        # Reshape/tile so that the input has first dimension as batch size
-        inp_idx_seq = np.tile(np.vstack([start_idx_seq, end_idx_seq]), [self.batch_size//2, 1])
+        # The batch dimension is dynamic, only the two sentences are encoded
+        inp_idx_seq = np.vstack([start_idx_seq, end_idx_seq])
         # source_sent_lengths = [np.count_nonzero(seq) for seq in inp_idx_seq]
 
         # Get z_vector of first and last sentence
@@ -645,8 +754,7 @@ class DetWEDModel(object):
         steps = np.linspace(0, 1, num_samples)[:, None]
         sampled.append(s1_z * (1 - steps) + s2_z * steps)
 
-        sampled = np.tile(sampled[0], [self.batch_size//num_samples, 1])
-        # sampled = np.reshape(np.array(sampled), newshape=(self.batch_size, self.latent_dim))
+        sampled = sampled[0]
         with tf.Session() as sess:
             sess.run(tf.global_variables_initializer())
             saver = tf.train.Saver()
@@ -657,6 +765,6 @@ class DetWEDModel(object):
                                          self.keep_prob: 1.0,
                                          })
 
-            for i, pred in enumerate(result[:num_samples]):
+            for i, pred in enumerate(result):
                 print('G: {}'.format(
-                    " ".join([self.decoder_idx_word[i] for i in pred if i not in [self.pad, self.eos]])))
+                    utils.join_subwords([self.decoder_idx_word[i] for i in pred if i not in [self.pad, self.eos]])))
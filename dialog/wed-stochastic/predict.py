@@ -22,9 +22,8 @@ import pandas as pd
 import utils
 
 from stochastic_wed import StochasticWEDModel
-from sklearn.model_selection import train_test_split
 
-np.random.seed(1337)
+np.random.seed(config['seed'])
 
 if config['dataset'] == 'daily':
     train_data = pd.read_csv(config['data_dir'] + 'DailyDial/de_duplicated/df_daily_train.csv')
@@ -38,8 +37,14 @@ else:
     print('Invalid argument for --dataset !')
     exit()
 
-input_sentences = pd.concat([train_data['line'], val_data['line'], test_data['line']])
-output_sentences = pd.concat([train_data['reply'], val_data['reply'], test_data['reply']])
+if config['append_data']:
+    append_data = pd.read_csv(config['append_data'])
+else:
+    append_data = pd.DataFrame(columns=['line', 'reply'])
+
+# New pairs follow the test set, so that the cached tokenization can be extended
+input_sentences = pd.concat([train_data['line'], val_data['line'], test_data['line'], append_data['line']])
+output_sentences = pd.concat([train_data['reply'], val_data['reply'], test_data['reply'], append_data['reply']])
 
 true_val = val_data['reply']
 true_test = test_data['reply']
@@ -48,31 +53,74 @@ input_test = test_data['line']
 filters = '!"#$%&()*+/:;<=>@[\\]^`{|}~\t\n'
 w2v_path = config['w2v_file']
 
-print('[INFO] Tokenizing input and output sequences')
-x, input_word_index = utils.tokenize_sequence(input_sentences, 
-                                                filters, 
-                                                config['encoder_num_tokens'], 
-                                                config['encoder_vocab'])
+decoder_bpe = None
+if config['bpe_merges']:
+    # Learned without the appended pairs, so that their tokenization can extend the cached corpus
+    decoder_bpe = utils.learn_bpe(pd.concat([train_data['reply'], val_data['reply'], test_data['reply']]),
+                                  filters,
+                                  config['decoder_num_tokens'],
+                                  config['bpe_merges'],
+                                  num_workers=config['num_workers'],
+                                  tokenizer=config['tokenizer'],
+                                  cache_dir=config['cache_dir'])
 
-y, output_word_index = utils.tokenize_sequence(output_sentences, 
-                                                filters, 
-                                                config['decoder_num_tokens'], 
-                                                config['decoder_vocab'])
+print('[INFO] Tokenizing input and output sequences')
+x, input_word_index, y, output_word_index = utils.tokenize_pairs_cached(input_sentences,
+                                                                       output_sentences,
+                                                                       filters,
+                                                                       config['encoder_num_tokens'],
+                                                                       config['encoder_vocab'],
+                                                                       config['decoder_num_tokens'],
+                                                                       config['decoder_vocab'],
+                                                                       cache_dir=config['cache_dir'],
+                                                                       num_workers=config['num_workers'],
+                                                                       tokenizer=config['tokenizer'],
+                                                                       append=bool(config['append_data']),
+                                                                       encoder_hash_buckets=config['encoder_hash_buckets'],
+                                                                       decoder_bpe=decoder_bpe,
+                                                                       shared_vocab=config['shared_vocab'])
 
 print('[INFO] Split data into train-validation-test sets')
-dataset_sizes = [train_data.shape[0], val_data.shape[0], test_data.shape[0]]
+dataset_sizes = [train_data.shape[0], val_data.shape[0], test_data.shape[0], append_data.shape[0]]
 x_train, y_train, x_val, y_val, x_test, y_test = utils.create_data_split(x, y, dataset_sizes)
 
-encoder_embeddings_matrix = utils.create_embedding_matrix(input_word_index, 
-                                                               config['embedding_size'], 
-                                                               w2v_path)
-
-decoder_embeddings_matrix = utils.create_embedding_matrix(output_word_index, 
-                                                               config['embedding_size'], 
-                                                               w2v_path)
+if config['train_shards']:
+    # The model was trained with the vocabularies of the shards, the test pairs are encoded with them
+    input_word_index, output_word_index = utils.ShardedDataset(config['train_shards']).word_indices
+    x_test = utils.texts_to_ids(test_data['line'],
+                                input_word_index,
+                                filters,
+                                config['encoder_num_tokens'],
+                                num_workers=config['num_workers'],
+                                tokenizer=config['tokenizer'])
+    y_test = utils.texts_to_ids(test_data['reply'],
+                                output_word_index,
+                                filters,
+                                config['decoder_num_tokens'],
+                                num_workers=config['num_workers'],
+                                tokenizer=config['tokenizer'])
+
+if config['encoder_hash_buckets']:
+    encoder_embeddings_matrix = utils.create_hashed_embedding_matrix(config['encoder_hash_buckets'],
+                                                                     config['embedding_size'],
+                                                                     w2v_path)
+else:
+    encoder_embeddings_matrix = utils.create_embedding_matrix(input_word_index,
+                                                              config['embedding_size'],
+                                                              w2v_path,
+                                                              cache_dir=config['cache_dir'])
+
+if config['shared_vocab']:
+    # input_word_index and output_word_index are the same vocabulary
+    decoder_embeddings_matrix = encoder_embeddings_matrix
+else:
+    decoder_embeddings_matrix = utils.create_embedding_matrix(output_word_index,
+                                                              config['embedding_size'],
+                                                              w2v_path,
+                                                              cache_dir=config['cache_dir'])
 
 # Re-calculate the vocab size based on the word_idx dictionary
-config['encoder_vocab'] = len(input_word_index)
+config['encoder_vocab'] = len(encoder_embeddings_matrix)
 config['decoder_vocab'] = len(output_word_index)
 
 #----------------------------------------------------------------#
@@ -107,7 +155,7 @@ print('-'*100)
 print("[INFO] Generate with test set input ...")
 generated = ''
 for pred in preds[:10]:
-    generated += '\t\t' + ' '.join([model.decoder_idx_word[i] for i in pred if i not in [model.pad, model.eos]]) + '\n'
+    generated += '\t\t' + utils.join_subwords([model.decoder_idx_word[i] for i in pred if i not in [model.pad, model.eos]]) + '\n'
 print(generated)
 
 print('-'*100)
@@ -16,6 +16,14 @@ def model_argparse():
     
     parser.add_argument("--latent_dim", type=int, default=100, help='dimension of z-latent space')
     parser.add_argument("--batch_size", type=int, default=128, help='batch size')
+    parser.add_argument("--num_buckets", type=int, default=0, help='if > 0, training batches hold sentences of similar length, from this many length buckets chosen to minimize padding (not with --train_shards)')
+    parser.add_argument("--shuffle", type=int, default=0, help='1: reshuffle the training set every epoch, seeded with --seed plus the epoch')
+    parser.add_argument("--keep_remainder", type=int, default=0, help='1: also train on the last (number of training sentences) %% batch_size sentences, in a final batch padded with zero-weight examples')
+    parser.add_argument("--seed", type=int, default=1337, help='random seed of the data split and the training batch order')
+    parser.add_argument("--max_tokens", type=int, default=0, help='if > 0, batches hold a variable number of sentences, up to this many tokens (sentences x padded length) per batch, e.g., 2560 = 128 x 20; combine with --num_buckets to pack sentences of similar length')
+    parser.add_argument("--graph_input", type=int, default=0, help='if > 0, training batches are read in the TF graph from the in-memory id matrices, with lengths computed in the graph and up to this many batches prepared ahead of the training step (not with --ragged, --train_shards, --num_buckets or --max_tokens)')
+    parser.add_argument("--summary_every", type=int, default=1, help='number of training steps between two TensorBoard summaries')
+    parser.add_argument("--prefetch_batches", type=int, default=2, help='number of training batches prepared on a background thread while the current step runs')
     parser.add_argument("--n_epochs", type=int, default=20, help='number of epochs')
     parser.add_argument("--optimizer", type=str, default='adam', help='optimizer from: adam | sgd | rmsprop')
 
@@ -33,6 +41,15 @@ def model_argparse():
     
     parser.add_argument("--data", type=str, default='../data/snli_sentences_all.txt')
     parser.add_argument("--w2v_file", type=str, default='../w2v_models/w2v_300d_snli_all_sentences.pkl')
+    parser.add_argument("--cache_dir", type=str, default='../cache/', help='path to cache tokenized corpora, empty string disables caching')
+    parser.add_argument("--num_workers", type=int, default=1, help='number of processes used to tokenize the corpus')
+    parser.add_argument("--tokenizer", type=str, default='nltk', help='word tokenizer: nltk | native')
+    parser.add_argument("--bpe_merges", type=int, default=0, help='if > 0, split words into subwords with this many BPE merges, vocab_size then bounds the subword vocabulary (not with --train_shards)')
+    parser.add_argument("--ragged", type=int, default=0, help='1: keep the training corpus as a flat id array with offsets, batches are padded to their longest sentence')
+    parser.add_argument("--collapse_duplicates", type=int, default=0, help='1: train on the unique sentences of the training set, weighting the loss by their number of occurrences (not with --train_shards)')
+    parser.add_argument("--append_data", type=str, default='', help='new training data (txt file, 1 sentence per line), tokenized against the frozen vocabulary of the cached corpus')
+    parser.add_argument("--train_shards", type=str, default='', help='sharded training set built with build_shards.py, replaces the training split of the in-memory corpus')
+    parser.add_argument("--shuffle_buffer_size", type=int, default=100000, help='number of examples in the shuffle buffer of the sharded training set')
     parser.add_argument("--bleu_path", type=str, default='bleu/', help='path to save bleu scores')
     parser.add_argument("--model_checkpoint_dir", type=str, default='', help='path to save model checkpoints')
     parser.add_argument("--logs_dir", type=str, default='', help='path to save log files')
@@ -21,9 +21,8 @@ import numpy as np
 import utils
 
 from vae import VAEModel
-from sklearn.model_selection import train_test_split
 
-np.random.seed(1337)
+np.random.seed(config['seed'])
 
 snli_data = utils.get_sentences(file_path = config['data'])
 
@@ -33,21 +32,64 @@ sentences = [s.strip() for s in snli_data]
 
 np.random.shuffle(sentences)
 
+if config['append_data']:
+    # New sentences follow the shuffled corpus, so that its cached tokenization can be extended
+    sentences += [s.strip() for s in utils.get_sentences(config['append_data'])]
+
 print('[INFO] Tokenizing input and output sequences')
 filters = '!"#$%&()*+/:;<=>@[\\]^`{|}~\t\n'
-x, word_index = utils.tokenize_sequence(sentences,
-                                             filters,
-                                             config['num_tokens'],
-                                             config['vocab_size'])
+
+bpe = None
+if config['bpe_merges']:
+    # Learned without the appended sentences, so that their tokenization can extend the cached corpus
+    bpe = utils.learn_bpe(sentences[:len(snli_data)],
+                          filters,
+                          config['num_tokens'],
+                          config['bpe_merges'],
+                          num_workers=config['num_workers'],
+                          tokenizer=config['tokenizer'],
+                          cache_dir=config['cache_dir'])
+
+x, word_index, split_indices = utils.tokenize_sequence_cached(sentences,
+                                                              filters,
+                                                              config['num_tokens'],
+                                                              config['vocab_size'],
+                                                              cache_dir=config['cache_dir'],
+                                                              split_fn=utils.create_split_indices,
+                                                              num_workers=config['num_workers'],
+                                                              tokenizer=config['tokenizer'],
+                                                              append=bool(config['append_data']),
+                                                              bpe=bpe)
+
+if config['ragged']:
+    x = utils.RaggedCorpus.from_padded(x, len(word_index))
 
 print('[INFO] Split data into train-validation-test sets')
-x_train, _x_val_test = train_test_split(x, test_size = 0.1, random_state = 10)
-x_val, x_test = train_test_split(_x_val_test, test_size = 0.5, random_state = 10)
+train_indices, val_indices, test_indices = split_indices
+x_train, x_val, x_test = x[train_indices], x[val_indices], x[test_indices]
+
+train_weights = None
+if config['collapse_duplicates']:
+    # An epoch visits every distinct sentence once, its number of occurrences becomes its loss weight
+    x_train, train_weights = utils.collapse_duplicates(x_train)
+    print('[INFO] Collapsed the training set to {} unique sentences'.format(len(x_train)))
+
+if config['train_shards']:
+    # Out-of-core training set, the validation sentences are encoded with its vocabulary
+    x_train = utils.ShardedDataset(config['train_shards'], config['shuffle_buffer_size'], seed=1337)
+    word_index = x_train.word_indices[0]
+    x_val = utils.texts_to_ids([sentences[i] for i in val_indices],
+                               word_index,
+                               filters,
+                               config['num_tokens'],
+                               num_workers=config['num_workers'],
+                               tokenizer=config['tokenizer'])
 
 w2v = config['w2v_file']
 embeddings_matrix = utils.create_embedding_matrix(word_index,
                                                   config['embedding_size'],
-                                                  w2v)
+                                                  w2v,
+                                                  cache_dir=config['cache_dir'])
 
 # Re-calculate the vocab size based on the word_idx dictionary
 config['vocab_size'] = len(word_index)
@@ -58,7 +100,7 @@ model = VAEModel(config,
                     embeddings_matrix,
                     word_index)
 
-model.train(x_train, x_val)
+model.train(x_train, x_val, train_weights)
 
 gl.log_writer.close()
 
@@ -40,6 +40,14 @@ class VAEModel(object):
         self.anneal_till = config['anneal_till']
 
         self.batch_size = config['batch_size']
+        self.num_buckets = config['num_buckets']
+        self.shuffle = config['shuffle']
+        self.keep_remainder = config['keep_remainder']
+        self.seed = config['seed']
+        self.max_tokens = config['max_tokens']
+        self.graph_input = config['graph_input']
+        self.summary_every = config['summary_every']
+        self.prefetch_batches = config['prefetch_batches']
         self.epochs = config['n_epochs']
 
         self.embeddings_matrix = embeddings_matrix
@@ -74,18 +82,59 @@ class VAEModel(object):
     def init_placeholders(self):
         with tf.name_scope("model_inputs"):
             # Create palceholders for inputs to the model
-            self.input_data = tf.placeholder(tf.int32, [self.batch_size, self.num_tokens], name='input')
-            self.target_data = tf.placeholder(tf.int32, [self.batch_size, self.num_tokens], name='targets')
+            if self.graph_input:
+                # Training batches come from the input pipeline, other batches are fed as usual
+                batch_ids, batch_lengths, batch_weights = self.build_input_pipeline()
+                self.input_data = tf.placeholder_with_default(batch_ids, [None, None], name='input')
+                self.target_data = tf.placeholder_with_default(batch_ids, [None, None], name='targets')
+                self.source_sentence_length = tf.placeholder_with_default(batch_lengths, shape=(None,),
+                                                                          name='source_sentence_length')
+                self.target_sentence_length = tf.placeholder_with_default(batch_lengths, shape=(None,),
+                                                                          name='target_sentence_length')
+                self.example_weights = tf.placeholder_with_default(batch_weights, shape=(None,),
+                                                                   name='example_weights')  # Loss weights
+            else:
+                self.input_data = tf.placeholder(tf.int32, [None, None], name='input')
+                self.target_data = tf.placeholder(tf.int32, [None, None], name='targets')
+                self.source_sentence_length = tf.placeholder(tf.int32, shape=(None,),
+                                                             name='source_sentence_length')
+                self.target_sentence_length = tf.placeholder(tf.int32, shape=(None,),
+                                                             name='target_sentence_length')
+                self.example_weights = tf.placeholder_with_default(tf.ones(tf.shape(self.input_data)[:1]), shape=(None,),
+                                                                   name='example_weights')  # Loss weights
             self.lr = tf.placeholder(tf.float32, name='learning_rate', shape=())
             self.keep_prob = tf.placeholder(tf.float32, name='keep_prob')  # Dropout Keep Probability
-            self.source_sentence_length = tf.placeholder(tf.int32, shape=(self.batch_size,),
-                                                         name='source_sentence_length')
-            self.target_sentence_length = tf.placeholder(tf.int32, shape=(self.batch_size,),
-                                                         name='target_sentence_length')
             self.word_dropout_keep_prob = tf.placeholder(tf.float32, name='word_drop_keep_prob', shape=())
             self.lambda_coeff = tf.placeholder(tf.float32, name='lambda_coeff', shape=())
             self.z_temperature = tf.placeholder(tf.float32, name='z_temperature', shape=())
 
+    def build_input_pipeline(self):
+        """
+        Reads the training batches in the graph: the id matrix and the loss weights of the training set are fed
+        once per epoch to initialize self.train_iterator, the sentence lengths are computed in the graph and up to
+        graph_input batches are prepared ahead of the training step.
+        """
+        with tf.name_scope("input_pipeline"):
+            self.train_ids = tf.placeholder(tf.int32, [None, None], name='train_ids')
+            self.train_weights = tf.placeholder(tf.float32, [None], name='train_weights')
+            self.shuffle_seed = tf.placeholder(tf.int64, shape=(), name='shuffle_seed')
+
+            dataset = tf.contrib.data.Dataset.from_tensor_slices((self.train_ids, self.train_weights))
+            if self.shuffle:
+                dataset = dataset.shuffle(tf.cast(tf.shape(self.train_ids)[0], tf.int64), seed=self.shuffle_seed)
+            dataset = dataset.batch(self.batch_size)
+            if not self.keep_remainder:
+                dataset = dataset.filter(lambda ids, weights: tf.equal(tf.shape(ids)[0], self.batch_size))
+
+            def add_lengths(ids, weights):
+                lengths = tf.reduce_sum(tf.cast(tf.not_equal(ids, self.pad), tf.int32), axis=1)
+                return ids[:, :tf.reduce_max(lengths)], lengths, weights
+
+            dataset = dataset.map(add_lengths, output_buffer_size=self.graph_input)
+            self.train_iterator = dataset.make_initializable_iterator()
+
+            return self.train_iterator.get_next()
+
     def embedding_layer(self):
         with tf.name_scope("encoder_inputs"):
             self.embeddings = tf.Variable(
@@ -96,13 +145,13 @@ class VAEModel(object):
 
         with tf.name_scope("decoder_inputs"):
             keep = tf.where(
-                tf.random_uniform([self.batch_size, self.num_tokens]) < self.word_dropout_keep_prob,
-                tf.fill([self.batch_size, self.num_tokens], True),
-                tf.fill([self.batch_size, self.num_tokens], False))
+                tf.random_uniform(tf.shape(self.target_data)) < self.word_dropout_keep_prob,
+                tf.fill(tf.shape(self.target_data), True),
+                tf.fill(tf.shape(self.target_data), False))
             ending = tf.cast(keep, dtype=tf.int32) * self.target_data
-            ending = tf.strided_slice(ending, [0, 0], [self.batch_size, -1], [1, 1],
+            ending = tf.strided_slice(ending, [0, 0], [tf.shape(ending)[0], -1], [1, 1],
                                         name='slice_input')  # Minus 1 implies everything till the last dim
-            self.dec_input = tf.concat([tf.fill([self.batch_size, 1], self.word_index['GO']), ending], 1,
+            self.dec_input = tf.concat([tf.fill([tf.shape(self.target_data)[0], 1], self.word_index['GO']), ending], 1,
                                         name='dec_input')
             self.dec_embed_input = tf.nn.embedding_lookup(self.embeddings, self.dec_input)
             self.max_tar_len = tf.reduce_max(self.target_sentence_length)
@@ -164,7 +213,7 @@ class VAEModel(object):
  
             self.output_layer = Dense(self.vocab_size)
  
-            self.init_state = dec_cell.zero_state(self.batch_size, tf.float32) # tf.contrib.rnn.LSTMStateTuple(self.c_N, self.h_N) # self.enc_state[0] 
+            self.init_state = dec_cell.zero_state(tf.shape(self.z_vector)[0], tf.float32) # tf.contrib.rnn.LSTMStateTuple(self.c_N, self.h_N) # self.enc_state[0] 
  
             with tf.name_scope("training_decoder"):
                 training_helper = tf.contrib.seq2seq.TrainingHelper(inputs=self.dec_embed_input,
@@ -188,7 +237,7 @@ class VAEModel(object):
                 start_token = self.word_index['GO']
                 end_token = self.word_index['EOS']
  
-                start_tokens = tf.tile(tf.constant([start_token], dtype=tf.int32), [self.batch_size],
+                start_tokens = tf.tile(tf.constant([start_token], dtype=tf.int32), [tf.shape(self.z_vector)[0]],
                                        name='start_tokens')
  
                 inference_helper = tf.contrib.seq2seq.GreedyEmbeddingHelper(self.embeddings,
@@ -213,7 +262,7 @@ class VAEModel(object):
                 start_token = self.word_index['GO']
                 end_token = self.word_index['EOS']
  
-                start_tokens = tf.tile(tf.constant([start_token], dtype=tf.int32), [self.batch_size],
+                start_tokens = tf.tile(tf.constant([start_token], dtype=tf.int32), [tf.shape(self.z_vector)[0]],
                                        name='start_tokens')
  
                 inference_helper = tf.contrib.seq2seq.GreedyEmbeddingHelper(self.embeddings,
@@ -252,7 +301,7 @@ class VAEModel(object):
             self.var_list = tf.trainable_variables()
             self.lossL2 = tf.add_n([tf.nn.l2_loss(v) for v in self.var_list if 'bias' not in v.name]) * 0.001
 
-            self.cost = tf.reduce_sum(self.xent_loss + self.kl_loss_weighted) # + self.lossL2
+            self.cost = tf.reduce_sum(self.example_weights * (self.xent_loss + self.kl_loss_weighted)) # + self.lossL2
 
     def optimize(self):
         # Optimizer
@@ -330,7 +379,7 @@ class VAEModel(object):
         with open('bleu_logs.txt', 'w') as f:
             f.write('\n'.join(self.log_str))
 
-    def train(self, x_train, x_val):
+    def train(self, x_train, x_val, train_weights=None):
 
         print('[INFO] Training process started')
 
@@ -347,31 +396,30 @@ class VAEModel(object):
             sess.run(tf.global_variables_initializer())
 
             writer = tf.summary.FileWriter(self.logs_dir, sess.graph)
+            data_inputs = [] if self.graph_input else [self.input_data, self.target_data,
+                                                       self.source_sentence_length, self.target_sentence_length,
+                                                       self.example_weights]
+            train_step = utils.TrainStepExecutor(sess, [self.train_op], self.summary_op, data_inputs,
+                                                 [self.lr, self.keep_prob, self.lambda_coeff, self.z_temperature, self.word_dropout_keep_prob],
+                                                 self.summary_every, self.prefetch_batches,
+                                                 log_fetches=[tf.reduce_mean(self.xent_loss)])
 
             for epoch_i in range(1, self.epochs + 1):
 
                 start_time = time.time()
 
-                for batch_i, (input_batch, output_batch, sent_lengths) in enumerate(
-                        utils.get_batches(x_train, self.batch_size)):
+                for batch_i, (batch_feed, last_batch) in enumerate(train_step.iter_batches(self.get_train_feeds(sess, x_train, train_weights, epoch_i))):
 
                     try:
                         iter_i += 1
 
-                        _, _summary, self.train_xent = sess.run(
-                            [self.train_op, self.summary_op, self.xent_loss],
-                            feed_dict={self.input_data: input_batch,
-                                       self.target_data: output_batch,
-                                       self.lr: learning_rate,
-                                       self.source_sentence_length: sent_lengths,
-                                       self.target_sentence_length: sent_lengths,
-                                       self.keep_prob: self.dropout_keep_prob,
-                                       self.lambda_coeff: lambda_val,
-                                       self.z_temperature: self.z_temp,
-                                       self.word_dropout_keep_prob: wd_anneal,
-                                       })
-
-                        writer.add_summary(_summary, iter_i)
+                        logs, _summary = train_step.run(
+                            iter_i, batch_feed, [learning_rate, self.dropout_keep_prob, lambda_val, self.z_temp, wd_anneal], last_batch)
+                        if logs is not None:
+                            self.train_xent = logs[0]
+
+                        if _summary is not None:
+                            writer.add_summary(_summary, iter_i)
 
                         # KL Annealing till some iteration
                         if iter_i <= self.anneal_till:
@@ -391,29 +439,62 @@ class VAEModel(object):
                 # Anneal word dropout from 1.0 to the limit
                 wd_anneal = np.max([self.word_dropout_keep_probability, wd_anneal - 0.05])
                 
+                print(train_step.report())
                 time_consumption = time.time() - start_time
                 self.monitor(x_val, sess, epoch_i, time_consumption)
 
+    def get_train_feeds(self, sess, x_train, train_weights, epoch_i):
+        """
+        Yields the feed_dict entries of the training batches of an epoch. With graph_input, the input pipeline is
+        initialized instead and the entries are empty, the batches are read in the graph.
+        """
+        if not self.graph_input:
+            for input_batch, output_batch, sent_lengths, weights_batch in utils.get_weighted_batches(
+                    x_train, self.batch_size, train_weights, self.num_buckets, self.shuffle, self.seed + epoch_i,
+                    self.keep_remainder, self.max_tokens):
+                yield {self.input_data: input_batch,
+                       self.target_data: output_batch,
+                       self.source_sentence_length: sent_lengths,
+                       self.target_sentence_length: sent_lengths,
+                       self.example_weights: weights_batch}
+            return
+
+        if not isinstance(x_train, np.ndarray) or self.num_buckets or self.max_tokens:
+            raise ValueError('graph_input needs an in-memory id matrix and fixed-size batches')
+        if train_weights is None:
+            train_weights = np.ones(len(x_train), dtype=np.float32)
+
+        sess.run(self.train_iterator.initializer, feed_dict={self.train_ids: x_train,
+                                                             self.train_weights: train_weights,
+                                                             self.shuffle_seed: self.seed + epoch_i})
+        num_batches = len(x_train) // self.batch_size
+        if self.keep_remainder and len(x_train) % self.batch_size:
+            num_batches += 1
+        for _ in range(num_batches):
+            yield {}
+
     def validate(self, sess, x_val):
         # Calculate BLEU on validation data
         hypotheses_val = []
         references_val = []
 
-        for batch_i, (input_batch, output_batch, sent_lengths) in enumerate(
-                utils.get_batches(x_val, self.batch_size)):
+        for batch_i, (input_batch, output_batch, sent_lengths, mask) in enumerate(
+                utils.get_batches(x_val, self.batch_size, keep_remainder=True,
+                                  max_tokens=self.max_tokens)):
             answer_logits = sess.run(self.validate_sent,
                                      feed_dict={self.input_data: input_batch,
                                                 self.source_sentence_length: sent_lengths,
                                                 self.keep_prob: 1.0,
                                                 self.word_dropout_keep_prob: 1.0,
                                                 self.z_temperature: self.z_temp})
+            answer_logits, output_batch = answer_logits[mask], output_batch[mask]
 
             for pred, actual in zip(answer_logits, output_batch):
                 hypotheses_val.append(
                     word_tokenize(
-                        " ".join([self.idx_word[i] for i in pred if i not in [self.pad, -1, self.eos]])))
+                        utils.join_subwords([self.idx_word[i] for i in pred if i not in [self.pad, -1, self.eos]])))
                 references_val.append(
-                    [word_tokenize(" ".join([self.idx_word[i] for i in actual if i not in [self.pad, -1, self.eos]]))])
+                    [word_tokenize(utils.join_subwords([self.idx_word[i] for i in actual if i not in [self.pad, -1, self.eos]]))])
                 
         self.val_pred = ([" ".join(sent)    for sent in hypotheses_val])
         self.val_ref  = ([" ".join(sent[0]) for sent in references_val])
@@ -434,22 +515,24 @@ class VAEModel(object):
             saver = tf.train.Saver()
             # saver.restore(sess, checkpoint)
 
-            for batch_i, (input_batch, output_batch, sent_lengths) in enumerate(
-                    utils.get_batches(x_test, self.batch_size)):
+            for batch_i, (input_batch, output_batch, sent_lengths, mask) in enumerate(
+                    utils.get_batches(x_test, self.batch_size, keep_remainder=True,
+                                      max_tokens=self.max_tokens)):
                 result = sess.run(self.inference_logits, feed_dict={self.input_data: input_batch,
                                                                     self.source_sentence_length: sent_lengths,
                                                                     self.keep_prob: 1.0,
                                                                     self.word_dropout_keep_prob: 1.0,
                                                                     self.z_temperature: self.z_temp})
+                result, output_batch = result[mask], output_batch[mask]
 
                 pred_logits.extend(result)
 
                 for pred, actual in zip(result, output_batch):
                     hypotheses_test.append(
-                        word_tokenize(" ".join(
-                            [self.idx_word[i] for i in pred if i not in [self.pad, -1, self.eos]])))
+                        word_tokenize(
+                            utils.join_subwords([self.idx_word[i] for i in pred if i not in [self.pad, -1, self.eos]])))
                     references_test.append([word_tokenize(
-                        " ".join([self.idx_word[i] for i in actual if i not in [self.pad, -1, self.eos]]))])
+                        utils.join_subwords([self.idx_word[i] for i in actual if i not in [self.pad, -1, self.eos]]))])
 
             bleu_scores = utils.calculate_bleu_scores(references_test, hypotheses_test)
 
@@ -461,9 +544,9 @@ class VAEModel(object):
         for pred, actual in zip(preds, x_test):
             # Actual and generated
             print('A: {}'.format(
-                " ".join([self.idx_word[i] for i in actual if i not in [self.pad, self.eos]])))
+                utils.join_subwords([self.idx_word[i] for i in actual if i not in [self.pad, self.eos]])))
             print('G: {}\n'.format(
-                " ".join([self.idx_word[i] for i in pred if i not in [self.pad, self.eos]])))
+                utils.join_subwords([self.idx_word[i] for i in pred if i not in [self.pad, self.eos]])))
 
     def get_diversity_metrics(self, checkpoint, x_test, num_samples=10, num_iterations=3):
 
@@ -485,17 +568,19 @@ class VAEModel(object):
                 answer_logits = []
                 pred_sentences = []
 
-                for batch_i, (input_batch, output_batch, sent_lengths) in enumerate(
-                        utils.get_batches(x_test_repeated, self.batch_size)):
+                for batch_i, (input_batch, output_batch, sent_lengths, mask) in enumerate(
+                        utils.get_batches(x_test_repeated, self.batch_size, keep_remainder=True,
+                                          max_tokens=self.max_tokens)):
                     result = sess.run(self.inference_logits, feed_dict={self.input_data: input_batch,
                                                                         self.source_sentence_length: sent_lengths,
                                                                         self.keep_prob: 1.0,
                                                                         self.word_dropout_keep_prob: 1.0,
                                                                         self.z_temperature: self.z_temp})
+                    result = result[mask]
                     answer_logits.extend(result)
 
                 for idx, (actual, pred) in enumerate(zip(x_test_repeated, answer_logits)):
-                    pred_sentences.append(" ".join([self.idx_word[i] for i in pred if i not in [self.pad, self.eos]]))
+                    pred_sentences.append(utils.join_subwords([self.idx_word[i] for i in pred if i not in [self.pad, self.eos]]))
 
                     if (idx + 1) % num_samples == 0:
                         word_list = [word_tokenize(p) for p in pred_sentences]
@@ -529,7 +614,7 @@ class VAEModel(object):
 
             for pred in result:
                 print('G: {}'.format(
-                    " ".join([self.idx_word[i] for i in pred if i not in [self.pad, self.eos]])))
+                    utils.join_subwords([self.idx_word[i] for i in pred if i not in [self.pad, self.eos]])))
                 
     def random_sample_save(self, checkpoint, num_batches=1):
 
@@ -547,7 +632,7 @@ class VAEModel(object):
                                          self.z_temperature: self.z_temp})
 
                 for pred in result:
-                    sent = " ".join([self.idx_word[i] for i in pred if i not in [self.pad, self.eos]])
+                    sent = utils.join_subwords([self.idx_word[i] for i in pred if i not in [self.pad, self.eos]])
                     gen_samples.append(sent)
 
         # Create directories for saving sentences generated by random sampling
@@ -559,14 +644,14 @@ class VAEModel(object):
         with open(pwd + '/samples/' + 'sample.txt', 'w') as f:
             f.write('\n'.join(gen_samples))
             
-    def random_sample_in_session(self, sess):
-        z_sampled = np.random.normal(size=(self.batch_size, self.latent_dim))
+    def random_sample_in_session(self, sess, num_samples=10):
+        z_sampled = np.random.normal(size=(num_samples, self.latent_dim))
         result = sess.run(self.inference_logits,feed_dict={self.z_vector: z_sampled, self.keep_prob: 1.0,})
 
         generated = ''
 
-        for pred in result[:10]:
-            generated += '\t\t' + ' '.join([self.idx_word[i] for i in pred if i not in [self.pad, self.eos]]) + '\n'
+        for pred in result:
+            generated += '\t\t' + utils.join_subwords([self.idx_word[i] for i in pred if i not in [self.pad, self.eos]]) + '\n'
         return generated
 
     def linear_interpolate(self, checkpoint, num_samples):
@@ -580,7 +665,7 @@ class VAEModel(object):
             steps = np.linspace(0, 1, num_samples)[:, None]
             sampled.append(s1_z * (1 - steps) + s2_z * steps)
 
-        sampled = np.reshape(np.array(sampled), newshape=(self.batch_size, self.latent_dim))
+        sampled = np.reshape(np.array(sampled), newshape=(-1, self.latent_dim))
         with tf.Session() as sess:
             sess.run(tf.global_variables_initializer())
             saver = tf.train.Saver()
@@ -595,7 +680,7 @@ class VAEModel(object):
                 if i % num_samples == 0:
                     print()
                 print('G: {}'.format(
-                    " ".join([self.idx_word[i] for i in pred if i not in [self.pad, self.eos]])))
+                    utils.join_subwords([self.idx_word[i] for i in pred if i not in [self.pad, self.eos]])))
                 
     def linear_interpolate_between_inputs(self, checkpoint, start_sent, end_sent, num_samples=8):
 
@@ -610,8 +695,8 @@ class VAEModel(object):
         end_idx_seq = np.concatenate([end_idx_seq, np.zeros(max(0, self.num_tokens - len(end_idx_seq)))])[
                         :self.num_tokens]
 
-        # Reshape/tile so that the input has first dimension as batch size
-        inp_idx_seq = np.tile(np.vstack([start_idx_seq, end_idx_seq]), [self.batch_size//2, 1])
+        # The batch dimension is dynamic, only the two sentences are encoded
+        inp_idx_seq = np.vstack([start_idx_seq, end_idx_seq])
         # source_sent_lengths = [np.count_nonzero(seq) for seq in inp_idx_seq]
 
         # Get z_vector of first and last sentence
@@ -625,8 +710,7 @@ class VAEModel(object):
         steps = np.linspace(0, 1, num_samples)[:, None]
         sampled.append(s1_z * (1 - steps) + s2_z * steps)
 
-        sampled = np.tile(sampled[0], [self.batch_size//num_samples, 1])
-        # sampled = np.reshape(np.array(sampled), newshape=(self.batch_size, self.latent_dim))
+        sampled = sampled[0]
         with tf.Session() as sess:
             sess.run(tf.global_variables_initializer())
             saver = tf.train.Saver()
@@ -637,9 +721,9 @@ class VAEModel(object):
                                          self.keep_prob: 1.0,
                                          })
 
-            for i, pred in enumerate(result[:num_samples]):
+            for i, pred in enumerate(result):
                 print('G: {}'.format(
-                    " ".join([self.idx_word[i] for i in pred if i not in [self.pad, self.eos]])))
+                    utils.join_subwords([self.idx_word[i] for i in pred if i not in [self.pad, self.eos]])))
 
     def get_neighbourhood(self, checkpoint, x_test, temp=1.0, num_samples=10):
         answer_logits = []
@@ -651,21 +735,23 @@ class VAEModel(object):
             saver = tf.train.Saver()
             saver.restore(sess, checkpoint)
 
-            for batch_i, (input_batch, output_batch, sent_lengths) in enumerate(
-                    utils.get_batches(x_test_repeated, self.batch_size)):
+            for batch_i, (input_batch, output_batch, sent_lengths, mask) in enumerate(
+                    utils.get_batches(x_test_repeated, self.batch_size, keep_remainder=True,
+                                      max_tokens=self.max_tokens)):
                 result = sess.run(self.inference_logits, feed_dict={self.input_data: input_batch,
                                                                     self.source_sentence_length: sent_lengths,
                                                                     self.keep_prob: 1.0,
                                                                     self.word_dropout_keep_prob: 1.0,
                                                                     self.z_temperature: temp})
+                result = result[mask]
                 answer_logits.extend(result)
 
             for idx, (actual, pred) in enumerate(zip(x_test_repeated, answer_logits)):
-                pred_sentences.append(" ".join([self.idx_word[i] for i in pred if i not in [self.pad, self.eos]]))
+                pred_sentences.append(utils.join_subwords([self.idx_word[i] for i in pred if i not in [self.pad, self.eos]]))
 
         for j in range(len(pred_sentences)):
             if j % num_samples == 0:
-                print('\nA: {}'.format(" ".join([self.idx_word[i] for i in x_test_repeated[j] if i not in [self.pad, self.eos]])))
+                print('\nA: {}'.format(utils.join_subwords([self.idx_word[i] for i in x_test_repeated[j] if i not in [self.pad, self.eos]])))
             print('G: {}'.format(pred_sentences[j]))
 
     def get_zvector(self, checkpoint, x_test):
@@ -675,13 +761,15 @@ class VAEModel(object):
             saver = tf.train.Saver()
             saver.restore(sess, checkpoint)
 
-            for batch_i, (input_batch, output_batch, sent_lengths) in enumerate(
-                    utils.get_batches(x_test, self.batch_size)):
+            for batch_i, (input_batch, output_batch, sent_lengths, mask) in enumerate(
+                    utils.get_batches(x_test, self.batch_size, keep_remainder=True,
+                                      max_tokens=self.max_tokens)):
                 result = sess.run(self.z_mean, feed_dict={self.input_data: input_batch,
                                                           self.source_sentence_length: sent_lengths,
                                                           self.keep_prob: 1.0,
                                                           self.word_dropout_keep_prob: 1.0,
                                                           self.z_temperature: self.z_temp})
+                result = result[mask]
                 z_vecs.extend(result)
 
         return np.array(z_vecs)
@@ -693,13 +781,15 @@ class VAEModel(object):
             saver = tf.train.Saver()
             saver.restore(sess, checkpoint)
 
-            for batch_i, (input_batch, output_batch, sent_lengths) in enumerate(
-                    utils.get_batches(x_test, self.batch_size)):
+            for batch_i, (input_batch, output_batch, sent_lengths, mask) in enumerate(
+                    utils.get_batches(x_test, self.batch_size, keep_remainder=True,
+                                      max_tokens=self.max_tokens)):
                 result = sess.run(self.z_log_sigma, feed_dict={self.input_data: input_batch,
                                                           self.source_sentence_length: sent_lengths,
                                                           self.keep_prob: 1.0,
                                                           self.word_dropout_keep_prob: 1.0,
                                                           self.z_temperature: self.z_temp})
+                result = result[mask]
                 z_vecs.extend(result)
 
         return np.array(z_vecs)
\ No newline at end of file
@@ -2,31 +2,55 @@ from pathsetup import run_path_setup
 run_path_setup()
 
 import os
+import argparse
+import multiprocessing
 import gensim
 import numpy as np
 from nltk.tokenize import word_tokenize
 import utils
 
-def main():
-
-    snli_data = utils.get_sentences(file_path='data/snli_sentences_all.txt')
+W2V_PATH = 'w2v_models/w2v_300d_snli_all_sentences.pkl'
 
-    print('[INFO] Number of sentences = {}'.format(len(snli_data)))
+parser = argparse.ArgumentParser(description='Create word2vec embeddings for the SNLI sentences')
+parser.add_argument('-i', '--input_path', default='data/snli_sentences_all.txt', help='text file, 1 sentence per line')
+parser.add_argument('--streaming', type=int, default=0, help='if 1, tokenize in a process pool into a corpus file which gensim streams from disk (for corpora larger than memory)')
+parser.add_argument('--num_workers', type=int, default=multiprocessing.cpu_count(), help='number of tokenizing processes and gensim threads (--streaming)')
+parser.add_argument('--chunk_size', type=int, default=100000, help='number of sentences tokenized at a time, sentences are shuffled within their chunk (--streaming)')
+parser.add_argument('--tokenizer', type=str, default='nltk', help='word tokenizer: nltk | native (--streaming)')
+args = vars(parser.parse_args())
 
-    sentences = [s.strip() for s in snli_data]
 
-    np.random.shuffle(sentences)
-    sentences = [word_tokenize(s) for s in sentences]
-    w2v_model = gensim.models.Word2Vec(sentences,
-                                       size=300,
-                                       min_count=1,
-                                       iter=50)
+def main():
     if not os.path.exists('w2v_models'):
         os.mkdir('w2v_models')
 
-    w2v_model.save('w2v_models/w2v_300d_snli_all_sentences.pkl')
+    if args['streaming']:
+        corpus_path = os.path.splitext(W2V_PATH)[0] + '.tok.txt'
+        num_sentences = utils.write_w2v_corpus(utils.iter_file_sentences(args['input_path']),
+                                               corpus_path,
+                                               args['chunk_size'],
+                                               args['num_workers'],
+                                               args['tokenizer'])
+        print('[INFO] Number of sentences = {}'.format(num_sentences))
+        w2v_model = utils.train_w2v_streaming(corpus_path, workers=args['num_workers'])
+    else:
+        snli_data = utils.get_sentences(file_path=args['input_path'])
+
+        print('[INFO] Number of sentences = {}'.format(len(snli_data)))
+
+        sentences = [s.strip() for s in snli_data]
+
+        np.random.shuffle(sentences)
+        sentences = [word_tokenize(s) for s in sentences]
+        w2v_model = gensim.models.Word2Vec(sentences,
+                                           size=300,
+                                           min_count=1,
+                                           iter=50)
+
+    w2v_model.save(W2V_PATH)
+    utils.export_w2v_vectors(w2v_model, W2V_PATH)
     print('[INFO] Word embeddings pre-trained successfully')
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
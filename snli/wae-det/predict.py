@@ -20,9 +20,8 @@ import numpy as np
 import utils
 
 from det_wae import DetWAEModel
-from sklearn.model_selection import train_test_split
 
-np.random.seed(1337)
+np.random.seed(config['seed'])
 
 snli_data = utils.get_sentences(file_path = config['data'])
 
@@ -32,21 +31,54 @@ sentences = [s.strip() for s in snli_data]
 
 np.random.shuffle(sentences)
 
+if config['append_data']:
+    # New sentences follow the shuffled corpus, so that its cached tokenization can be extended
+    sentences += [s.strip() for s in utils.get_sentences(config['append_data'])]
+
 print('[INFO] Tokenizing input and output sequences')
 filters = '!"#$%&()*+/:;<=>@[\\]^`{|}~\t\n'
-x, word_index = utils.tokenize_sequence(sentences,
-                                             filters,
-                                             config['num_tokens'],
-                                             config['vocab_size'])
+
+bpe = None
+if config['bpe_merges']:
+    # Learned without the appended sentences, so that their tokenization can extend the cached corpus
+    bpe = utils.learn_bpe(sentences[:len(snli_data)],
+                          filters,
+                          config['num_tokens'],
+                          config['bpe_merges'],
+                          num_workers=config['num_workers'],
+                          tokenizer=config['tokenizer'],
+                          cache_dir=config['cache_dir'])
+
+x, word_index, split_indices = utils.tokenize_sequence_cached(sentences,
+                                                              filters,
+                                                              config['num_tokens'],
+                                                              config['vocab_size'],
+                                                              cache_dir=config['cache_dir'],
+                                                              split_fn=utils.create_split_indices,
+                                                              num_workers=config['num_workers'],
+                                                              tokenizer=config['tokenizer'],
+                                                              append=bool(config['append_data']),
+                                                              bpe=bpe)
 
 print('[INFO] Split data into train-validation-test sets')
-x_train, _x_val_test = train_test_split(x, test_size = 0.1, random_state = 10)
-x_val, x_test = train_test_split(_x_val_test, test_size = 0.5, random_state = 10)
+train_indices, val_indices, test_indices = split_indices
+x_train, x_val, x_test = x[train_indices], x[val_indices], x[test_indices]
+
+if config['train_shards']:
+    # The model was trained with the vocabulary of the shards, the test sentences are encoded with it
+    word_index = utils.ShardedDataset(config['train_shards']).word_indices[0]
+    x_test = utils.texts_to_ids([sentences[i] for i in test_indices],
+                                word_index,
+                                filters,
+                                config['num_tokens'],
+                                num_workers=config['num_workers'],
+                                tokenizer=config['tokenizer'])
 
 w2v = config['w2v_file']
 embeddings_matrix = utils.create_embedding_matrix(word_index,
                                                   config['embedding_size'],
-                                                  w2v)
+                                                  w2v,
+                                                  cache_dir=config['cache_dir'])
 
 # Re-calculate the vocab size based on the word_idx dictionary
 config['vocab_size'] = len(word_index)
@@ -76,7 +108,7 @@ print('-'*100)
 print("[INFO] Generate with test set input ...")
 generated = ''
 for pred in preds[:10]:
-    generated += '\t\t' + ' '.join([model.idx_word[i] for i in pred if i not in [model.pad, model.eos]]) + '\n'
+    generated += '\t\t' + utils.join_subwords([model.idx_word[i] for i in pred if i not in [model.pad, model.eos]]) + '\n'
 print(generated)
 
 print('-'*100)
@@ -0,0 +1,61 @@
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+import utils
+
+parser = argparse.ArgumentParser(description='Check that the native tokenizer reproduces the nltk + Keras tokenization')
+parser.add_argument('-i', '--input_paths', nargs='+', help='Text files (1 sentence per line) or dialog csv files (line,reply columns)', required=True)
+parser.add_argument('-n', '--num_tokens', type=int, default=20, help='Number of tokens per sequence')
+parser.add_argument('-v', '--vocab_size', type=int, default=20000, help='Vocabulary size')
+parser.add_argument('-f', '--filters', type=str, default='!"#$%&()*+/:;<=>@[\\]^`{|}~\t\n', help='Keras tokenizer filters')
+parser.add_argument('-m', '--max_mismatches', type=int, default=10, help='Number of mismatching sentences to print')
+args = vars(parser.parse_args())
+
+
+def read_sentences(path):
+    """
+    Reads the sentences of a corpus file, csv files contribute both the line and the reply column
+    """
+    if path.endswith('.csv'):
+        data = pd.read_csv(path)
+        return data['line'].astype(str).tolist() + data['reply'].astype(str).tolist()
+
+    return [s.strip() for s in utils.get_sentences(path)]
+
+
+def timed_tokenize(sentences, tokenizer):
+    """
+    Runs tokenize_sequence with the given tokenizer and returns its outputs along with the elapsed time
+    """
+    start = time.time()
+    x, word_index = utils.tokenize_sequence(sentences, args['filters'], args['num_tokens'], args['vocab_size'],
+                                            tokenizer=tokenizer)
+    return x, word_index, time.time() - start
+
+
+if __name__ == "__main__":
+
+    conforms = True
+    for path in args['input_paths']:
+        sentences = read_sentences(path)
+
+        x_nltk, word_index_nltk, t_nltk = timed_tokenize(sentences, 'nltk')
+        x_native, word_index_native, t_native = timed_tokenize(sentences, 'native')
+
+        mismatches = np.where((x_nltk != x_native).any(axis=1))[0]
+        same_vocab = word_index_nltk == word_index_native
+
+        print('-'*50)
+        print(path)
+        print('Sentences = {}, mismatching = {}, identical word_index = {}'.format(len(sentences), len(mismatches), same_vocab))
+        print('nltk = {:.2f}s, native = {:.2f}s, speedup = {:.1f}x'.format(t_nltk, t_native, t_nltk / max(t_native, 1e-6)))
+        for i in mismatches[:args['max_mismatches']]:
+            print('  {!r}'.format(sentences[i]))
+
+        conforms = conforms and len(mismatches) == 0 and same_vocab
+
+    print('-'*50)
+    sys.exit(0 if conforms else 1)
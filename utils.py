@@ -1,15 +1,27 @@
+import io
+import os
+import re
+import csv
+import zlib
+import time
+import queue
+import pickle
+import shutil
+import heapq
+import hashlib
+import threading
+import multiprocessing
+from collections import Counter
 import numpy as np
 import gensim
-import re
 from nltk.tokenize import word_tokenize
 from nltk.translate.bleu_score import corpus_bleu
 from nltk.collocations import BigramCollocationFinder
 from nltk.probability import FreqDist
 from sklearn.decomposition import PCA
 from sklearn.manifold import TSNE
+from sklearn.model_selection import train_test_split
 from matplotlib import pyplot as plt
-from keras.preprocessing.text import Tokenizer
-from keras.preprocessing.sequence import pad_sequences
 
 
 def calculate_bleu_scores(references, hypotheses):
@@ -74,38 +86,650 @@ def calculate_entropy(corpus):
     return ent
 
 
-def tokenize_sequence(sentences, filters, max_num_words, max_vocab_size):
+# Penn Treebank regular expressions, as applied by nltk.word_tokenize to every sentence. Each substitution is
+# paired with the input characters it can act on (None: always applied), so that it can be skipped cheaply.
+_TREEBANK_STARTING_QUOTES = [
+    (re.compile(u'([\u00ab\u201c\u2018\u201e]|[`]+)'), r' \1 ', u'\u00ab\u201c\u2018\u201e`'),
+    (re.compile(r'^\"'), r'``', '"'),
+    (re.compile(r'(``)'), r' \1 ', '`"'),
+    (re.compile(r'([ \(\[{<])(\"|\'{2})'), r'\1 `` ', '"\''),
+    (re.compile(r'(?i)(?<!\w)(\')(?!(?:re|ve|ll|m|t|s|d|n)\b)(?=\w)'), r'\1 ', '\''),
+]
+
+_TREEBANK_PUNCTUATION = [
+    (re.compile(u'([^\\.])(\\.)([\\]\\)}>"\'\u00bb\u201d\u2019 ]*)\\s*$'), r'\1 \2 \3 ', '.'),
+    (re.compile(r'([:,])([^\d])'), r' \1 \2', ':,'),
+    (re.compile(r'([:,])$'), r' \1 ', ':,'),
+    (re.compile(r'\.{2,}'), r' \g<0> ', '.'),
+    (re.compile(r'[;@#$%&]'), r' \g<0> ', ';@#$%&'),
+    (re.compile(u'[\u2012-\u2015]'), r' \g<0> ', u'\u2012\u2013\u2014\u2015'),
+    (re.compile(r'([^\.])(\.)([\]\)}>"\']*)\s*$'), r'\1 \2\3 ', '.'),
+    (re.compile(r'[?!]'), r' \g<0> ', '?!'),
+    (re.compile(r"([^'])' "), r"\1 ' ", '\''),
+    (re.compile(r'[*]'), r' \g<0> ', '*'),
+    (re.compile(r'[\]\[\(\)\{\}\<\>]'), r' \g<0> ', '[](){}<>'),
+    (re.compile(r'--'), r' -- ', '-'),
+]
+
+_TREEBANK_ENDING_QUOTES = [
+    (re.compile(u'([\u00bb\u201d\u2019])'), r' \1 ', u'\u00bb\u201d\u2019'),
+    (re.compile(r"''"), " '' ", '\''),
+    (re.compile(r'"'), " '' ", '"'),
+    (re.compile(r'\s+'), ' ', None),
+    (re.compile(r"([^' ])('[sS]|'[mM]|'[dD]|') "), r'\1 \2 ', '\'"'),
+    (re.compile(r"([^' ])('ll|'LL|'re|'RE|'ve|'VE|n't|N'T) "), r'\1 \2 ', '\'"'),
+]
+
+_TREEBANK_CONTRACTIONS = [re.compile(r) for r in [
+    r'(?i)\b(can)(not)\b', r"(?i)\b(d)('ye)\b", r'(?i)\b(gim)(me)\b', r'(?i)\b(gon)(na)\b',
+    r'(?i)\b(got)(ta)\b', r'(?i)\b(lem)(me)\b', r"(?i)\b(more)('n)\b", r'(?i)\b(wan)(na)(?=\s)',
+    r"(?i) ('t)(is)\b", r"(?i) ('t)(was)\b"]]
+_TREEBANK_CONTRACTIONS_GUARD = re.compile(r"(?i)not|'ye|mme|nna|tta|'n|'t")
+_CONTRACTION_WORDS = frozenset(['cannot', 'gimme', 'gonna', 'gotta', 'lemme', 'wanna'])
+_STANDALONE_PUNCTUATION = frozenset([',', '.', '?', '!', ';', ':'])
+
+# Potential sentence endings and the abbreviations after which a period does not end a sentence
+_SENTENCE_END_RE = re.compile(u'\\S*[.?!][\\]\\)}"\'\u00bb\u201d\u2019]*(?=\\s+\\S)')
+_SENTENCE_END_CLOSING = u')]}"\'\u00bb\u201d\u2019'
+_SENTENCE_END_OPENING = u'([{"\'`\u00ab\u201c\u2018'
+_ABBREVIATIONS = frozenset([
+    'mr', 'mrs', 'ms', 'dr', 'prof', 'st', 'jr', 'sr', 'mt', 'ft', 'vs', 'etc', 'inc', 'ltd', 'co', 'corp',
+    'no', 'gen', 'gov', 'sen', 'rep', 'col', 'lt', 'sgt', 'capt', 'rev', 'ave', 'blvd', 'dept', 'est', 'fig',
+    'jan', 'feb', 'mar', 'apr', 'jun', 'jul', 'aug', 'sep', 'sept', 'oct', 'nov', 'dec',
+    'e.g', 'i.e', 'a.m', 'p.m', 'u.s', 'u.s.a', 'u.k', 'd.c'])
+
+
+def _period_ends_sentence(token):
     """
-    Tokenizes a given input sequence of words.
+    Decides whether a token ending with a period ends a sentence, i.e., is not an abbreviation, initial or ellipsis.
+    """
+    word = token[:-1].lstrip(_SENTENCE_END_OPENING).lstrip('.').lower()
+    if not word or token.endswith('..') or len(word) == 1 and word.isalpha():
+        return False
+
+    return word not in _ABBREVIATIONS and word.split('-')[-1] not in _ABBREVIATIONS
+
+
+def split_sentences(text):
+    """
+    Splits a text into sentences, approximating the decisions of the NLTK Punkt model:
+    a sentence ends after ? and !, and after a period unless it belongs to an abbreviation,
+    an initial or an ellipsis.
 
     Args:
-        sentences: List of sentences
-        filters: List of filters/punctuations to omit (for Keras tokenizer)
-        max_num_words: Number of words to be considered in the fixed length sequence
+        text: input string
+
+    Returns:
+        sentences: list of sentences (substrings of text)
+
+    """
+    sentences = []
+    start = 0
+    for match in _SENTENCE_END_RE.finditer(text):
+        token = match.group().rstrip(_SENTENCE_END_CLOSING)
+        if token.endswith('.') and not _period_ends_sentence(token):
+            continue
+
+        # A period directly followed by ? or ! ends a sentence on its own (e.g., "on t.v.?")
+        core = token.rstrip('?!')
+        if core != token and core.endswith('.') and _period_ends_sentence(core):
+            end = match.start() + len(core)
+            sentences.append(text[start:end])
+            start = end
+
+        sentences.append(text[start:match.end()])
+        start = match.end()
+        while start < len(text) and text[start].isspace():
+            start += 1
+    sentences.append(text[start:].rstrip())
+
+    return sentences
+
+
+def treebank_tokenize(sentence):
+    """
+    Tokenizes a single sentence with the Penn Treebank conventions of nltk.word_tokenize.
+
+    Args:
+        sentence: input sentence
+
+    Returns:
+        tokens: list of tokens
+
+    """
+    chars = set(sentence)  # The substitutions only introduce spaces and quotes covered by the triggers
+    for regexp, substitution, triggers in _TREEBANK_STARTING_QUOTES + _TREEBANK_PUNCTUATION:
+        if not chars.isdisjoint(triggers):
+            sentence = regexp.sub(substitution, sentence)
+
+    sentence = ' ' + sentence + ' '
+    for regexp, substitution, triggers in _TREEBANK_ENDING_QUOTES:
+        if triggers is None or not chars.isdisjoint(triggers):
+            sentence = regexp.sub(substitution, sentence)
+    if _TREEBANK_CONTRACTIONS_GUARD.search(sentence):
+        for regexp in _TREEBANK_CONTRACTIONS:
+            sentence = regexp.sub(r' \1 \2 ', sentence)
+
+    return sentence.split()
+
+
+def _simple_tokenize(sentence):
+    """
+    Fast path of native_tokenize for already space-separated text, i.e., alphanumeric words and standalone
+    punctuation, optionally with a final punctuation attached to the last word. Returns None for any other
+    input, where the Treebank rules could change the whitespace split.
+    """
+    tokens = sentence.split()
+    for t in tokens[:-1]:
+        if not (t.isalnum() and t.lower() not in _CONTRACTION_WORDS or t in _STANDALONE_PUNCTUATION):
+            return None
+
+    if tokens and tokens[-1] not in _STANDALONE_PUNCTUATION:
+        last = tokens[-1]
+        if last[-1] in '.?!':
+            tokens[-1:] = [last[:-1], last[-1]]
+            last = last[:-1]
+        if not last.isalnum() or last.lower() in _CONTRACTION_WORDS:
+            return None
+
+    return tokens
+
+
+def native_tokenize(sentence, filters, max_num_words):
+    """
+    Single-pass replacement for nltk.word_tokenize followed by the Keras Tokenizer:
+    Treebank tokenization, truncation to max_num_words tokens, lower casing and splitting on filters.
+
+    Args:
+        sentence: input sentence
+        filters: List of filters/punctuations to omit
+        max_num_words: Number of Treebank tokens to be considered
+
+    Returns:
+        tokens: list of words
+
+    """
+    return split_words(' '.join(_word_tokens(sentence, 'native')[:max_num_words]), filters)
+
+
+def _word_tokens(sentence, tokenizer):
+    """
+    Returns all Treebank tokens of a sentence, computed by nltk.word_tokenize or natively.
+    """
+    if tokenizer != 'native':
+        return word_tokenize(sentence)
+
+    tokens = _simple_tokenize(sentence)
+    if tokens is None:
+        tokens = [t for s in split_sentences(sentence) for t in treebank_tokenize(s)]
+
+    return tokens
+
+
+def word_tokenize_sentences(sentences, tokenizer='nltk'):
+    """
+    Returns the Treebank tokens of every sentence, tokenizer is 'nltk' or 'native', see tokenize_sequence.
+    """
+    return [_word_tokens(s, tokenizer) for s in sentences]
+
+
+def split_words(text, filters):
+    """
+    Splits a text into words in the same way as the Keras Tokenizer: lower casing, replacing filters by spaces
+    and splitting on spaces.
+
+    Args:
+        text: input string
+        filters: List of filters/punctuations to omit
+
+    Returns:
+        words: list of words
+
+    """
+    text = text.lower().translate(str.maketrans(filters, ' ' * len(filters)))
+
+    return [w for w in text.split(' ') if w]
+
+
+def _tokenize_shard(args):
+    """
+    Tokenizes one shard of sentences (executed in a worker process).
+    """
+    sentences, filters, max_num_words, tokenizer = args
+    if tokenizer == 'native':
+        # Repeated sentences (frequent in dialog corpora) are tokenized once
+        tokenized = dict()
+        for s in sentences:
+            if s not in tokenized:
+                tokenized[s] = native_tokenize(s, filters, max_num_words)
+        return [tokenized[s] for s in sentences]
+
+    return [' '.join(word_tokenize(s)[:max_num_words]) for s in sentences]
+
+
+def count_words(token_lists, word_counts=None):
+    """
+    Counts word frequencies, keeping words in the order of their first occurrence.
+
+    Args:
+        token_lists: iterable of lists of words
+        word_counts: (Optional) Counter to be updated
+
+    Returns:
+        word_counts: Counter of word frequencies
+
+    """
+    word_counts = Counter() if word_counts is None else word_counts
+    for tokens in token_lists:
+        word_counts.update(tokens)
+
+    return word_counts
+
+
+def _count_shard(args):
+    """
+    Counts the word frequencies of one chunk of sentences (executed in a worker process).
+    """
+    sentences, filters, max_num_words, tokenizer = args
+    sentences = _tokenize_shard((sentences, filters, max_num_words, tokenizer))
+    if tokenizer != 'native':
+        sentences = [split_words(s, filters) for s in sentences]
+
+    return count_words(sentences)
+
+
+def iter_chunks(iterable, chunk_size):
+    """
+    Groups the items of an iterable into lists of (at most) chunk_size items.
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_file_sentences(file_path):
+    """
+    Lazily reads a corpus file with one sentence per line.
+    """
+    with open(file_path, 'r') as f:
+        for line in f:
+            yield line.strip()
+
+
+def merge_word_counts(shard_counts):
+    """
+    Merges word frequencies counted on consecutive shards of a corpus. As long as the shards are given in
+    corpus order, the result equals the counts of the whole corpus, including the order of first occurrence.
+
+    Args:
+        shard_counts: iterable of word frequency dictionaries
+
+    Returns:
+        word_counts: Counter of word frequencies
+
+    """
+    word_counts = Counter()
+    for counts in shard_counts:
+        word_counts.update(counts)
+
+    return word_counts
+
+
+def count_words_streaming(sentences, filters, max_num_words, chunk_size=10000, num_workers=1, tokenizer='nltk'):
+    """
+    Counts the word frequencies of a stream of sentences chunk by chunk, so that at most
+    num_workers chunks of raw text are held in memory at a time.
+
+    Args:
+        sentences: iterable of sentences, e.g., iter_file_sentences(file_path)
+        filters: List of filters/punctuations to omit
+        max_num_words: Number of words to be considered per sentence
+        chunk_size: Number of sentences per chunk
+        num_workers: Number of processes counting chunks in parallel
+        tokenizer: 'nltk' or 'native', see tokenize_sequence
+
+    Returns:
+        word_counts: Counter of word frequencies, in the order of first occurrence
+
+    """
+    chunks = ((chunk, filters, max_num_words, tokenizer) for chunk in iter_chunks(sentences, chunk_size))
+    if num_workers <= 1:
+        return merge_word_counts(_count_shard(chunk) for chunk in chunks)
+
+    word_counts = Counter()
+    with multiprocessing.Pool(num_workers) as pool:
+        for window in iter_chunks(chunks, num_workers):
+            word_counts.update(merge_word_counts(pool.map(_count_shard, window)))
+
+    return word_counts
+
+
+def build_vocabulary(corpora, filters, max_num_words, max_vocab_size, chunk_size=10000, num_workers=1,
+                     tokenizer='nltk'):
+    """
+    Streaming counterpart of the vocabulary built by tokenize_sequence: word frequencies are counted chunk by
+    chunk on each corpus shard and merged, without holding the raw text in memory.
+
+    Args:
+        corpora: list of corpus shards in corpus order, each a file path (1 sentence per line) or an iterable of sentences
+        filters: List of filters/punctuations to omit
+        max_num_words: Number of words to be considered per sentence
         max_vocab_size: Number of most frequently occurring words to be kept in the vocabulary
+        chunk_size: Number of sentences per chunk
+        num_workers: Number of processes counting chunks in parallel
+        tokenizer: 'nltk' or 'native', see tokenize_sequence
 
     Returns:
-        x : List of padded/truncated indices created from list of sentences
         word_index: dictionary storing the word-to-index correspondence
 
     """
+    shard_counts = []
+    for corpus in corpora:
+        sentences = iter_file_sentences(corpus) if isinstance(corpus, str) else corpus
+        shard_counts.append(count_words_streaming(sentences, filters, max_num_words, chunk_size, num_workers,
+                                                  tokenizer))
+
+    word_index = build_word_index(merge_word_counts(shard_counts))
+
+    return {k: v for k, v in word_index.items() if v < max_vocab_size}
+
+
+def build_word_index(word_counts):
+    """
+    Creates the word-to-index dictionary from word frequencies, in the same order as the Keras Tokenizer:
+    PAD, UNK, GO and EOS first, followed by words in decreasing order of frequency (ties broken by first occurrence).
 
-    sentences = [' '.join(word_tokenize(s)[:max_num_words]) for s in sentences]
+    Args:
+        word_counts: dictionary of word frequencies, in the order of first occurrence
 
-    tokenizer = Tokenizer(filters=filters)
-    tokenizer.fit_on_texts(sentences)
+    Returns:
+        word_index: dictionary storing the word-to-index correspondence
 
+    """
     word_index = dict()
     word_index['PAD'] = 0
     word_index['UNK'] = 1
     word_index['GO'] = 2
     word_index['EOS'] = 3
 
-    for i, word in enumerate(dict(tokenizer.word_index).keys()):
+    for i, word in enumerate(sorted(word_counts, key=word_counts.get, reverse=True)):
         word_index[word] = i + 4
 
-    tokenizer.word_index = word_index
-    x = tokenizer.texts_to_sequences(list(sentences))
+    return word_index
+
+
+def pad_sequences_post(sequences, max_num_words, value=0):
+    """
+    Pads/truncates index sequences at the end to a fixed length.
+
+    Args:
+        sequences: list of index sequences
+        max_num_words: length of the padded sequences
+        value: padding index
+
+    Returns:
+        x: int32 array of shape [len(sequences), max_num_words]
+
+    """
+    x = np.full((len(sequences), max_num_words), value, dtype=np.int32)
+    for i, seq in enumerate(sequences):
+        seq = seq[:max_num_words]
+        x[i, :len(seq)] = seq
+
+    return x
+
+
+_SUBWORD_JOINT_RE = re.compile(r'@@( |$)')
+
+
+def join_subwords(tokens):
+    """
+    Joins tokens into a sentence, merging the subwords produced by BPE.encode back into words.
+    Equivalent to ' '.join(tokens) for word tokens.
+
+    Args:
+        tokens: list of words or subwords
+
+    Returns:
+        sentence: string of space separated words
+
+    """
+    return _SUBWORD_JOINT_RE.sub('', ' '.join(tokens))
+
+
+class BPE(object):
+    """
+    Byte pair encoding of words into subwords (Sennrich et al., 2016). Subwords which do not end a word carry
+    the '@@' suffix, e.g., 'unfolding' -> ['un@@', 'fold@@', 'ing'], so that join_subwords restores the words.
+    """
+
+    def __init__(self, merges):
+        self.merges = [tuple(m) for m in merges]
+        self.ranks = {m: i for i, m in enumerate(self.merges)}
+        self.cache = dict()
+
+    @staticmethod
+    def word_symbols(word):
+        return tuple(word[:-1]) + (word[-1] + '</w>',)
+
+    @classmethod
+    def learn(cls, word_counts, num_merges, min_frequency=2):
+        """
+        Learns merge operations from word frequencies, most frequent symbol pair first.
+
+        Args:
+            word_counts: dictionary of word frequencies, e.g., returned by count_words_streaming
+            num_merges: maximum number of merge operations
+            min_frequency: stop once the most frequent pair occurs less often
+
+        Returns:
+            bpe: BPE object
+
+        """
+        words = [list(cls.word_symbols(w)) for w in word_counts]
+        counts = list(word_counts.values())
+
+        pair_counts = Counter()
+        pair_words = dict()
+        for i, symbols in enumerate(words):
+            for pair in zip(symbols, symbols[1:]):
+                pair_counts[pair] += counts[i]
+                pair_words.setdefault(pair, set()).add(i)
+
+        # Max-heap with lazy deletion: entries whose count is outdated are skipped
+        heap = [(-c, pair) for pair, c in pair_counts.items()]
+        heapq.heapify(heap)
+
+        merges = []
+        while heap and len(merges) < num_merges:
+            c, pair = heapq.heappop(heap)
+            if -c != pair_counts.get(pair, 0):
+                continue
+            if -c < min_frequency:
+                break
+            merges.append(pair)
+
+            merged = pair[0] + pair[1]
+            changed = set()
+            for i in pair_words.pop(pair):
+                symbols = words[i]
+                for p in zip(symbols, symbols[1:]):
+                    pair_counts[p] -= counts[i]
+                    changed.add(p)
+
+                j, new_symbols = 0, []
+                while j < len(symbols):
+                    if j < len(symbols) - 1 and (symbols[j], symbols[j + 1]) == pair:
+                        new_symbols.append(merged)
+                        j += 2
+                    else:
+                        new_symbols.append(symbols[j])
+                        j += 1
+                words[i] = new_symbols
+
+                for p in zip(new_symbols, new_symbols[1:]):
+                    pair_counts[p] += counts[i]
+                    pair_words.setdefault(p, set()).add(i)
+                    changed.add(p)
+
+            del pair_counts[pair]
+            for p in changed:
+                if p != pair and pair_counts[p] > 0:
+                    heapq.heappush(heap, (-pair_counts[p], p))
+
+        return cls(merges)
+
+    @property
+    def fingerprint(self):
+        return hashlib.sha1(repr(self.merges).encode('utf-8')).hexdigest()
+
+    def segment(self, word):
+        """
+        Splits a word into subwords by applying the merge operations in the order they were learned.
+        """
+        if word in self.cache:
+            return self.cache[word]
+
+        symbols = list(self.word_symbols(word))
+        while len(symbols) > 1:
+            ranked = [(self.ranks.get(p, len(self.ranks)), j) for j, p in enumerate(zip(symbols, symbols[1:]))]
+            rank, j = min(ranked)
+            if rank == len(self.ranks):
+                break
+            symbols[j:j + 2] = [symbols[j] + symbols[j + 1]]
+
+        subwords = [s[:-4] if s.endswith('</w>') else s + '@@' for s in symbols]
+        self.cache[word] = subwords
+
+        return subwords
+
+    def encode(self, words):
+        """
+        Args:
+            words: list of words
+
+        Returns:
+            subwords: list of subwords
+
+        """
+        return [s for w in words for s in self.segment(w)]
+
+    def save(self, file_path):
+        with open(file_path, 'wb') as f:
+            pickle.dump(self.merges, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, file_path):
+        with open(file_path, 'rb') as f:
+            return cls(pickle.load(f))
+
+
+def learn_bpe(sentences, filters, max_num_words, num_merges, num_workers=1, tokenizer='nltk', cache_dir=''):
+    """
+    Learns a BPE model on the words of a corpus, as split by tokenize_sequence.
+
+    Args:
+        sentences: List of sentences
+        filters: List of filters/punctuations to omit
+        max_num_words: Number of words to be considered per sentence
+        num_merges: Number of merge operations, i.e., roughly the size of the subword vocabulary
+        num_workers: Number of processes used for word tokenization
+        tokenizer: 'nltk' or 'native', see tokenize_sequence
+        cache_dir: (Optional) directory where the merge operations are cached
+
+    Returns:
+        bpe: BPE object
+
+    """
+    sentences = list(sentences)
+
+    if cache_dir:
+        key = get_corpus_cache_key(sentences, filters, max_num_words, num_merges, tokenizer + '+bpe')
+        bpe_path = os.path.join(cache_dir, 'bpe_{}.pkl'.format(key))
+        if os.path.exists(bpe_path):
+            print('[INFO] Loaded BPE merges from cache {}'.format(key))
+            return BPE.load(bpe_path)
+
+    word_counts = count_words_streaming(sentences, filters, max_num_words, num_workers=num_workers,
+                                        tokenizer=tokenizer)
+    bpe = BPE.learn(word_counts, num_merges)
+
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        bpe.save(bpe_path + '.tmp{}'.format(os.getpid()))
+        os.replace(bpe_path + '.tmp{}'.format(os.getpid()), bpe_path)
+
+    return bpe
+
+
+def _tokenize(sentences, filters, max_num_words, num_workers=1, tokenizer='nltk'):
+    """
+    Word tokenizes a list of sentences, in num_workers processes if num_workers > 1.
+    """
+    sentences = list(sentences)
+    if num_workers > 1 and len(sentences) > num_workers:
+        # Contiguous shards, merged back in their original order
+        shard_size = int(np.ceil(len(sentences) / (4 * num_workers)))
+        shards = [(sentences[i:i + shard_size], filters, max_num_words, tokenizer)
+                  for i in range(0, len(sentences), shard_size)]
+        with multiprocessing.Pool(num_workers) as pool:
+            return [s for shard in pool.map(_tokenize_shard, shards) for s in shard]
+
+    return _tokenize_shard((sentences, filters, max_num_words, tokenizer))
+
+
+def tokenize_sequence(sentences, filters, max_num_words, max_vocab_size, num_workers=1, tokenizer='nltk', bpe=None):
+    """
+    Tokenizes a given input sequence of words.
+
+    Args:
+        sentences: List of sentences
+        filters: List of filters/punctuations to omit (for Keras tokenizer)
+        max_num_words: Number of words to be considered in the fixed length sequence
+        max_vocab_size: Number of most frequently occurring words to be kept in the vocabulary
+        num_workers: Number of processes used for word tokenization (the output does not depend on it)
+        tokenizer: 'nltk' (word_tokenize + Keras Tokenizer) or 'native' (single-pass regex tokenizer)
+        bpe: (Optional) BPE object, the words are split into subwords which make up the vocabulary
+
+    Returns:
+        x : List of padded/truncated indices created from list of sentences
+        word_index: dictionary storing the word-to-index correspondence
+
+    """
+
+    sentences = _tokenize(sentences, filters, max_num_words, num_workers, tokenizer)
+
+    if bpe is not None:
+        # Subwords end with '@@', which the Keras Tokenizer would filter out
+        if tokenizer != 'native':
+            sentences = [split_words(s, filters) for s in sentences]
+        sentences = [bpe.encode(words) for words in sentences]
+
+    if tokenizer == 'native' or bpe is not None:
+        word_index = build_word_index(count_words(sentences))
+        x = [[word_index[w] for w in tokens] for tokens in sentences]
+    else:
+        from keras.preprocessing.text import Tokenizer  # Only the nltk tokenizer depends on Keras
+
+        tokenizer = Tokenizer(filters=filters)
+        tokenizer.fit_on_texts(sentences)
+
+        word_index = dict()
+        word_index['PAD'] = 0
+        word_index['UNK'] = 1
+        word_index['GO'] = 2
+        word_index['EOS'] = 3
+
+        for i, word in enumerate(dict(tokenizer.word_index).keys()):
+            word_index[word] = i + 4
+
+        tokenizer.word_index = word_index
+        x = tokenizer.texts_to_sequences(list(sentences))
 
     for i, seq in enumerate(x):
         if any(t >= max_vocab_size for t in seq):
@@ -113,115 +737,1852 @@ def tokenize_sequence(sentences, filters, max_num_words, max_vocab_size):
         seq.append(word_index['EOS'])
         x[i] = seq
 
-    x = pad_sequences(x, padding='post', truncating='post', maxlen=max_num_words, value=word_index['PAD'])
+    x = pad_sequences_post(x, max_num_words, value=word_index['PAD'])
 
     word_index = {k: v for k, v in word_index.items() if v < max_vocab_size}
 
     return x, word_index
 
 
-def create_embedding_matrix(word_index, embedding_dim, w2v_path):
+def texts_to_ids(sentences, word_index, filters, max_num_words, num_workers=1, tokenizer='nltk', bpe=None):
     """
-    Create the initial embedding matrix for TF Graph.
+    Tokenizes sentences against a fixed vocabulary, e.g., one returned by tokenize_sequence.
+    Words outside of the vocabulary are mapped to UNK.
 
     Args:
+        sentences: List of sentences
         word_index: dictionary storing the word-to-index correspondence
-        embedding_dim: word2vec dimension
-        w2v_path: file path to the w2v pickle file
+        filters: List of filters/punctuations to omit
+        max_num_words: Number of words to be considered in the fixed length sequence
+        num_workers: Number of processes used for word tokenization
+        tokenizer: 'nltk' or 'native', see tokenize_sequence
+        bpe: (Optional) BPE object the vocabulary was built with
 
     Returns:
-        embeddings_matrix : numpy 2d-array with word vectors
+        x : padded/truncated indices created from list of sentences
 
     """
-    w2v_model = gensim.models.Word2Vec.load(w2v_path)
-    embeddings_matrix = np.random.uniform(-0.05, 0.05, size=(len(word_index), embedding_dim))
-    for word, i in word_index.items():
-        try:
-            embeddings_vector = w2v_model[word]
-            embeddings_matrix[i] = embeddings_vector
-        except KeyError:
-            pass
+    sentences = _tokenize(sentences, filters, max_num_words, num_workers, tokenizer)
+    if tokenizer != 'native':
+        sentences = [split_words(s, filters) for s in sentences]
+    if bpe is not None:
+        sentences = [bpe.encode(words) for words in sentences]
 
-    return embeddings_matrix
+    unk, eos = word_index['UNK'], word_index['EOS']
+    x = [[word_index.get(w, unk) for w in words] + [eos] for words in sentences]
 
+    return pad_sequences_post(x, max_num_words, value=word_index['PAD'])
 
-def get_sentences(file_path):
-    with open(file_path, 'r') as f:
-        data = f.readlines()
 
-    return data
+def _tokenize_pairs_shard(args):
+    """
+    Tokenizes one shard of (line, reply) pairs into lists of words (executed in a worker process).
+    """
+    lines, replies, filters, encoder_num_tokens, decoder_num_tokens, tokenizer = args
 
+    # An utterance is tokenized once, even if it is both a line and a reply
+    tokenized = dict()
 
-def clean_sentence(sent):
-    sent = re.sub(r'[^\w\s\?\.\,]', '', sent.strip().lower())  # Lower case, remove punctuations (except , ? .)
-    sent = re.sub(r'(([a-z]*)\d+.?\d*\%?)', ' NUM ', sent.strip())  # Replace Numbers with <NUM> token
-    return sent
+    def words(sentence, max_num_words):
+        if sentence not in tokenized:
+            tokenized[sentence] = _word_tokens(sentence, tokenizer)
+        return split_words(' '.join(tokenized[sentence][:max_num_words]), filters)
+
+    return [words(s, encoder_num_tokens) for s in lines], [words(s, decoder_num_tokens) for s in replies]
 
 
-def get_batches(x, batch_size):
+def _index_words(word_lists, max_num_words, max_vocab_size, word_index=None):
     """
-    Generate inputs and targets in a batch-wise fashion for feed-dict
+    Builds the vocabulary of lists of words (unless the full word_index is given) and converts them to a padded
+    index matrix, as in tokenize_sequence.
+    """
+    if word_index is None:
+        word_index = build_word_index(count_words(word_lists))
+    unk, eos = word_index['UNK'], word_index['EOS']
+
+    x = []
+    for words in word_lists:
+        seq = [word_index[w] for w in words]
+        x.append([t if t < max_vocab_size else unk for t in seq] + [eos])
+
+    x = pad_sequences_post(x, max_num_words, value=word_index['PAD'])
+
+    return x, {k: v for k, v in word_index.items() if v < max_vocab_size}
+
+
+def hash_words(words, num_buckets):
+    """
+    Maps words to num_buckets ids following PAD, UNK, GO and EOS, with a hash that does not depend on the process
+    (unlike the built-in hash of strings).
 
     Args:
-        x: entire source sequence array
-        batch_size: batch size
+        words: list of words
+        num_buckets: number of hash buckets
 
     Returns:
-        x_batch, y_batch, sentence_length
+        ids: list of word indices in [4, num_buckets + 4)
 
     """
+    return [4 + zlib.crc32(w.encode('utf-8')) % num_buckets for w in words]
 
-    for batch_i in range(0, len(x) // batch_size):
-        start_i = batch_i * batch_size
-        x_batch = x[start_i:start_i + batch_size]
-        y_batch = x[start_i:start_i + batch_size]
 
-        sentence_length = [np.count_nonzero(seq) for seq in x_batch]
+def _hash_words(word_lists, max_num_words, num_buckets):
+    """
+    Converts lists of words to a padded index matrix with hash_words. The returned word_index only contains
+    PAD, UNK, GO and EOS, so that the tokenizer state does not grow with the corpus.
+    """
+    word_index = build_word_index(dict())
+    x = [hash_words(words, num_buckets) + [word_index['EOS']] for words in word_lists]
 
-        yield x_batch, y_batch, sentence_length
+    return pad_sequences_post(x, max_num_words, value=word_index['PAD']), word_index
 
 
-def get_batches_xy(x, y, batch_size):
+def _check_shared_vocab(shared_vocab, encoder_hash_buckets, decoder_bpe):
     """
-    Generate inputs and targets in a batch-wise fashion for feed-dict
+    Raises ValueError for the options that a shared vocabulary cannot be combined with: hashed input words and
+    output subwords (the input words are not split, so the vocabulary would mix words and subwords).
+    """
+    if shared_vocab and encoder_hash_buckets:
+        raise ValueError('A shared vocabulary cannot be combined with hashed input words')
+    if shared_vocab and decoder_bpe is not None:
+        raise ValueError('A shared vocabulary cannot be combined with BPE output subwords')
+
+
+def tokenize_pairs(lines, replies, filters, encoder_num_tokens, encoder_vocab, decoder_num_tokens, decoder_vocab,
+                   num_workers=1, tokenizer='nltk', encoder_hash_buckets=0, decoder_bpe=None, shared_vocab=False):
+    """
+    Tokenizes (line, reply) pairs for the encoder and the decoder in a single pass. Utterances occurring on both
+    sides are word tokenized once. The outputs are the same as those of tokenize_sequence applied to the lines
+    and to the replies separately.
+
     Args:
-        x: entire source sequence array
-        y: entire output sequence array
-        batch_size: batch size
+        lines: List of input sentences
+        replies: List of output sentences
+        filters: List of filters/punctuations to omit
+        encoder_num_tokens: Number of words to be considered in the input sequences
+        encoder_vocab: Number of most frequently occurring words to be kept in the input vocabulary
+        decoder_num_tokens: Number of words to be considered in the output sequences
+        decoder_vocab: Number of most frequently occurring words to be kept in the output vocabulary
+        num_workers: Number of processes used for word tokenization
+        tokenizer: 'nltk' or 'native', see tokenize_sequence
+        encoder_hash_buckets: if > 0, input words are mapped to this many buckets by hash_words instead of an exact
+                              vocabulary (encoder_vocab is then ignored)
+        decoder_bpe: (Optional) BPE object, the output words are split into subwords
+        shared_vocab: if set, a single vocabulary of the input and output words (the decoder_vocab most frequent
+                      ones), so that the encoder and the decoder can share their embeddings (not with
+                      encoder_hash_buckets or decoder_bpe)
+
     Returns:
-        x_batch, y_batch, source_sentence_length, target_sentence_length
+        x, input_word_index, y, output_word_index
+
+    """
+    _check_shared_vocab(shared_vocab, encoder_hash_buckets, decoder_bpe)
+
+    lines, replies = list(lines), list(replies)
+    if num_workers > 1 and len(lines) > num_workers:
+        shard_size = int(np.ceil(len(lines) / (4 * num_workers)))
+        shards = [(lines[i:i + shard_size], replies[i:i + shard_size], filters, encoder_num_tokens,
+                   decoder_num_tokens, tokenizer) for i in range(0, len(lines), shard_size)]
+        with multiprocessing.Pool(num_workers) as pool:
+            shards = pool.map(_tokenize_pairs_shard, shards)
+        line_words = [words for shard in shards for words in shard[0]]
+        reply_words = [words for shard in shards for words in shard[1]]
+    else:
+        line_words, reply_words = _tokenize_pairs_shard((lines, replies, filters, encoder_num_tokens,
+                                                         decoder_num_tokens, tokenizer))
+
+    if decoder_bpe is not None:
+        reply_words = [decoder_bpe.encode(words) for words in reply_words]
+
+    if shared_vocab:
+        word_index = build_word_index(count_words(reply_words, count_words(line_words)))
+        x, input_word_index = _index_words(line_words, encoder_num_tokens, decoder_vocab, word_index)
+        y, output_word_index = _index_words(reply_words, decoder_num_tokens, decoder_vocab, word_index)
+        return x, input_word_index, y, output_word_index
+
+    if encoder_hash_buckets:
+        x, input_word_index = _hash_words(line_words, encoder_num_tokens, encoder_hash_buckets)
+    else:
+        x, input_word_index = _index_words(line_words, encoder_num_tokens, encoder_vocab)
+    y, output_word_index = _index_words(reply_words, decoder_num_tokens, decoder_vocab)
+
+    return x, input_word_index, y, output_word_index
+
+
+def _new_corpus_hash(filters, max_num_words, max_vocab_size, tokenizer, hash_buckets=0):
+    """
+    Starts the hash of a corpus with its tokenization settings, sentences are added with _update_corpus_hash.
     """
+    settings = (filters, max_num_words, max_vocab_size, tokenizer)
+    if hash_buckets:
+        settings += ('hash_buckets', hash_buckets)
 
-    for batch_i in range(0, len(x) // batch_size):
-        start_i = batch_i * batch_size
-        x_batch = x[start_i:start_i + batch_size]
-        y_batch = y[start_i:start_i + batch_size]
+    sha = hashlib.sha1()
+    sha.update(repr(settings).encode('utf-8'))
 
-        source_sentence_length = [np.count_nonzero(seq) for seq in x_batch]
-        target_sentence_length = [np.count_nonzero(seq) for seq in y_batch]
+    return sha
 
-        yield x_batch, y_batch, source_sentence_length, target_sentence_length
 
+def _cache_tokenizer(tokenizer, bpe=None):
+    """
+    Identifies the tokenizer in cache keys, including the merge operations of a BPE model.
+    """
+    return tokenizer if bpe is None else '{}+bpe{}'.format(tokenizer, bpe.fingerprint)
 
-def create_data_split(x, y, dataset_sizes):
+
+def _update_corpus_hash(sha, sentence):
+    sha.update(sentence.encode('utf-8'))
+    sha.update(b'\n')
+
+
+def get_corpus_cache_key(sentences, filters, max_num_words, max_vocab_size, tokenizer='nltk', hash_buckets=0):
     """
-    Create test-train split according to previously defined CSV files
-    Depending on the experiment - qgen or dialogue
+    Computes a content-addressed key for a tokenized corpus.
+
     Args:
-        x: input sequence of indices
-        y: output sequence of indices
+        sentences: List of sentences
+        filters: List of filters/punctuations to omit (for Keras tokenizer)
+        max_num_words: Number of words to be considered in the fixed length sequence
+        max_vocab_size: Number of most frequently occurring words to be kept in the vocabulary
+        tokenizer: word tokenizer used by tokenize_sequence
+        hash_buckets: number of hash buckets of a hashed vocabulary (0: exact vocabulary)
+
     Returns:
-        x_train, y_train, x_val, y_val, x_test, y_test: train val test split arrays
+        key: hex digest of the corpus contents and tokenization settings
+
     """
+    sha = _new_corpus_hash(filters, max_num_words, max_vocab_size, tokenizer, hash_buckets)
+    for s in sentences:
+        _update_corpus_hash(sha, s)
 
-    train_size, val_size, test_size = dataset_sizes[0], dataset_sizes[1], dataset_sizes[2],
+    return sha.hexdigest()
 
-    train_indices = range(train_size)
-    val_indices = range(train_size, train_size + val_size)
-    test_indices = range(train_size + val_size, train_size + val_size + test_size)
 
-    x_train = x[train_indices]
-    y_train = y[train_indices]
+def save_tokenized_cache(cache_dir, key, x, word_index, split_indices=None):
+    """
+    Stores the output of tokenize_sequence (and optionally the data split) on disk.
+    The entry is written to a temporary directory first and then renamed, so that
+    concurrent runs never observe a partially written cache entry.
+
+    Args:
+        cache_dir: root directory of the tokenization cache
+        key: cache key computed by get_corpus_cache_key
+        x: padded index matrix
+        word_index: dictionary storing the word-to-index correspondence
+        split_indices: (Optional) list of index arrays, e.g., [train, val, test]
+
+    """
+    entry_dir = os.path.join(cache_dir, key)
+    if os.path.exists(entry_dir):
+        return
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_dir = entry_dir + '.tmp{}'.format(os.getpid())
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    np.save(os.path.join(tmp_dir, 'x.npy'), np.asarray(x))
+    with open(os.path.join(tmp_dir, 'word_index.pkl'), 'wb') as f:
+        pickle.dump(word_index, f, protocol=pickle.HIGHEST_PROTOCOL)
+    if split_indices is not None:
+        for i, indices in enumerate(split_indices):
+            np.save(os.path.join(tmp_dir, 'split_{}.npy'.format(i)), np.asarray(indices))
+
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError:  # Another process created the same entry in the meantime
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def load_tokenized_cache(cache_dir, key):
+    """
+    Loads a cache entry written by save_tokenized_cache. The index matrix is memory-mapped.
+
+    Args:
+        cache_dir: root directory of the tokenization cache
+        key: cache key computed by get_corpus_cache_key
+
+    Returns:
+        x, word_index, split_indices (None if not cached) or None on a cache miss
+
+    """
+    entry_dir = os.path.join(cache_dir, key)
+    if not os.path.isdir(entry_dir):
+        return None
+
+    x = np.load(os.path.join(entry_dir, 'x.npy'), mmap_mode='r')
+    with open(os.path.join(entry_dir, 'word_index.pkl'), 'rb') as f:
+        word_index = pickle.load(f)
+
+    split_indices = []
+    while os.path.exists(os.path.join(entry_dir, 'split_{}.npy'.format(len(split_indices)))):
+        split_indices.append(np.load(os.path.join(entry_dir, 'split_{}.npy'.format(len(split_indices)))))
+
+    return x, word_index, split_indices or None
+
+
+def find_cached_prefix(cache_dir, sentences, filters, max_num_words, max_vocab_size, tokenizer='nltk'):
+    """
+    Finds the cache entry of the longest proper prefix of a corpus (tokenized with the same settings).
+
+    Args:
+        cache_dir: root directory of the tokenization cache
+        sentences: List of sentences
+        filters: List of filters/punctuations to omit (for Keras tokenizer)
+        max_num_words: Number of words to be considered in the fixed length sequence
+        max_vocab_size: Number of most frequently occurring words to be kept in the vocabulary
+        tokenizer: word tokenizer used by tokenize_sequence
+
+    Returns:
+        key, number of sentences of the cached prefix or None if no prefix is cached
+
+    """
+    if not os.path.isdir(cache_dir):
+        return None
+
+    # Only the prefix lengths of existing entries need to be hashed
+    entry_sizes = dict()
+    for key in os.listdir(cache_dir):
+        x_path = os.path.join(cache_dir, key, 'x.npy')
+        if '.tmp' not in key and os.path.exists(x_path):
+            entry_sizes.setdefault(len(np.load(x_path, mmap_mode='r')), set()).add(key)
+
+    prefix = None
+    sha = _new_corpus_hash(filters, max_num_words, max_vocab_size, tokenizer)
+    for i, s in enumerate(sentences):
+        if i in entry_sizes and sha.hexdigest() in entry_sizes[i]:
+            prefix = (sha.hexdigest(), i)
+        _update_corpus_hash(sha, s)
+
+    return prefix
+
+
+def append_npy(file_path, rows):
+    """
+    Appends rows to an array stored with np.save. Only the header and the new rows are written, unless the
+    header does not have room for the new shape, in which case the file is rewritten.
+
+    Args:
+        file_path: path to the .npy file
+        rows: array with the same dtype and trailing dimensions as the stored array
+
+    """
+    with open(file_path, 'r+b') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            write_header = np.lib.format.write_array_header_1_0
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            write_header = np.lib.format.write_array_header_2_0
+        header_size = f.tell()
+
+        rows = np.ascontiguousarray(rows, dtype=dtype)
+        if fortran_order or rows.shape[1:] != shape[1:]:
+            raise ValueError('Cannot append rows of shape {} to {}'.format(rows.shape, shape))
+
+        header = io.BytesIO()
+        write_header(header, {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False,
+                              'shape': (shape[0] + len(rows),) + shape[1:]})
+
+        if len(header.getvalue()) == header_size:
+            f.seek(0)
+            f.write(header.getvalue())
+            f.seek(0, os.SEEK_END)
+            f.write(rows.tobytes())
+            return
+
+    data = np.concatenate([np.load(file_path), rows])
+    np.save(file_path + '.tmp.npy', data)
+    os.replace(file_path + '.tmp.npy', file_path)
+
+
+def append_tokenized_cache(cache_dir, key, new_key, sentences, filters, max_num_words, num_workers=1,
+                           tokenizer='nltk', bpe=None):
+    """
+    Extends a cache entry with new sentences, tokenized against the frozen vocabulary of the entry, and moves it
+    to the key of the extended corpus. The new sentences are added to the first split (the training set).
+
+    Args:
+        cache_dir: root directory of the tokenization cache
+        key: cache key of the existing entry
+        new_key: cache key of the extended corpus
+        sentences: List of new sentences
+        filters: List of filters/punctuations to omit (for Keras tokenizer)
+        max_num_words: Number of words to be considered in the fixed length sequence
+        num_workers: Number of processes used for word tokenization
+        tokenizer: 'nltk' or 'native', see tokenize_sequence
+        bpe: (Optional) BPE object the vocabulary of the entry was built with
+
+    Returns:
+        x, word_index, split_indices of the extended corpus
+
+    """
+    entry_dir = os.path.join(cache_dir, key)
+    x, word_index, split_indices = load_tokenized_cache(cache_dir, key)
+    num_cached = len(x)
+    del x
+
+    append_npy(os.path.join(entry_dir, 'x.npy'), texts_to_ids(sentences, word_index, filters, max_num_words,
+                                                             num_workers, tokenizer, bpe))
+    if split_indices is not None:
+        split_indices[0] = np.concatenate([split_indices[0], np.arange(num_cached, num_cached + len(sentences))])
+        np.save(os.path.join(entry_dir, 'split_0.npy'), split_indices[0])
+
+    os.rename(entry_dir, os.path.join(cache_dir, new_key))
+
+    return load_tokenized_cache(cache_dir, new_key)
+
+
+def tokenize_sequence_cached(sentences, filters, max_num_words, max_vocab_size, cache_dir, split_fn=None,
+                             num_workers=1, tokenizer='nltk', append=False, bpe=None):
+    """
+    Wrapper around tokenize_sequence, which re-uses the outputs of a previous run on the same corpus.
+
+    Args:
+        sentences: List of sentences
+        filters: List of filters/punctuations to omit (for Keras tokenizer)
+        max_num_words: Number of words to be considered in the fixed length sequence
+        max_vocab_size: Number of most frequently occurring words to be kept in the vocabulary
+        cache_dir: root directory of the tokenization cache, caching is disabled if empty
+        split_fn: (Optional) function mapping the number of sentences to a list of split index arrays
+        num_workers: Number of processes used for word tokenization on a cache miss
+        tokenizer: 'nltk' or 'native', see tokenize_sequence
+        append: on a cache miss, extend the entry of the longest cached prefix of the corpus instead of
+                re-tokenizing everything, i.e., tokenize only the new sentences against its frozen vocabulary
+        bpe: (Optional) BPE object, see tokenize_sequence
+
+    Returns:
+        x : List of padded/truncated indices created from list of sentences
+        word_index: dictionary storing the word-to-index correspondence
+        split_indices: list of index arrays returned by split_fn (None if split_fn is not given)
+
+    """
+    sentences = list(sentences)
+
+    if cache_dir:
+        key = get_corpus_cache_key(sentences, filters, max_num_words, max_vocab_size,
+                                   _cache_tokenizer(tokenizer, bpe))
+        cached = load_tokenized_cache(cache_dir, key)
+        if cached is not None and (split_fn is None or cached[2] is not None):
+            print('[INFO] Loaded tokenized corpus from cache {}'.format(key))
+            return cached
+
+        prefix = find_cached_prefix(cache_dir, sentences, filters, max_num_words, max_vocab_size,
+                                    _cache_tokenizer(tokenizer, bpe)) if append else None
+        if prefix is not None and (split_fn is None or load_tokenized_cache(cache_dir, prefix[0])[2] is not None):
+            prefix_key, num_cached = prefix
+            print('[INFO] Appending {} sentences to cached corpus {}'.format(len(sentences) - num_cached, prefix_key))
+            return append_tokenized_cache(cache_dir, prefix_key, key, sentences[num_cached:], filters, max_num_words,
+                                          num_workers, tokenizer, bpe)
+
+    x, word_index = tokenize_sequence(sentences, filters, max_num_words, max_vocab_size, num_workers, tokenizer, bpe)
+    split_indices = split_fn(len(x)) if split_fn is not None else None
+
+    if cache_dir:
+        save_tokenized_cache(cache_dir, key, x, word_index, split_indices)
+
+    return x, word_index, split_indices
+
+
+def tokenize_pairs_cached(lines, replies, filters, encoder_num_tokens, encoder_vocab, decoder_num_tokens,
+                          decoder_vocab, cache_dir, num_workers=1, tokenizer='nltk', append=False,
+                          encoder_hash_buckets=0, decoder_bpe=None, shared_vocab=False):
+    """
+    Wrapper around tokenize_pairs, which shares its cache entries with tokenize_sequence_cached.
+
+    Args:
+        lines: List of input sentences
+        replies: List of output sentences
+        filters: List of filters/punctuations to omit
+        encoder_num_tokens: Number of words to be considered in the input sequences
+        encoder_vocab: Number of most frequently occurring words to be kept in the input vocabulary
+        decoder_num_tokens: Number of words to be considered in the output sequences
+        decoder_vocab: Number of most frequently occurring words to be kept in the output vocabulary
+        cache_dir: root directory of the tokenization cache, caching is disabled if empty
+        num_workers: Number of processes used for word tokenization on a cache miss
+        tokenizer: 'nltk' or 'native', see tokenize_sequence
+        append: extend cached prefixes of the corpus, see tokenize_sequence_cached (exact vocabularies only)
+        encoder_hash_buckets: number of hash buckets of the input words, see tokenize_pairs
+        decoder_bpe: (Optional) BPE object of the output words, see tokenize_pairs
+        shared_vocab: single vocabulary of the input and output words, see tokenize_pairs (not with append)
+
+    Returns:
+        x, input_word_index, y, output_word_index
+
+    """
+    _check_shared_vocab(shared_vocab, encoder_hash_buckets, decoder_bpe)
+    lines, replies = list(lines), list(replies)
+
+    if cache_dir and shared_vocab:
+        # The shared vocabulary depends on both sides, so both keys cover the lines and the replies
+        shared_tokenizer = '{}+shared{}'.format(_cache_tokenizer(tokenizer, decoder_bpe), len(lines))
+        line_key = get_corpus_cache_key(lines + replies, filters, encoder_num_tokens, decoder_vocab,
+                                        shared_tokenizer + '_lines')
+        reply_key = get_corpus_cache_key(lines + replies, filters, decoder_num_tokens, decoder_vocab,
+                                         shared_tokenizer + '_replies')
+    elif cache_dir:
+        line_key = get_corpus_cache_key(lines, filters, encoder_num_tokens, encoder_vocab, tokenizer,
+                                        encoder_hash_buckets)
+        reply_key = get_corpus_cache_key(replies, filters, decoder_num_tokens, decoder_vocab,
+                                         _cache_tokenizer(tokenizer, decoder_bpe))
+
+    if cache_dir:
+        cached_lines = load_tokenized_cache(cache_dir, line_key)
+        cached_replies = load_tokenized_cache(cache_dir, reply_key)
+
+        if cached_lines is not None and cached_replies is not None:
+            print('[INFO] Loaded tokenized corpora from cache {}, {}'.format(line_key, reply_key))
+            return cached_lines[0], cached_lines[1], cached_replies[0], cached_replies[1]
+
+        if append and not encoder_hash_buckets and not shared_vocab:
+            x, input_word_index, _ = tokenize_sequence_cached(lines, filters, encoder_num_tokens, encoder_vocab,
+                                                              cache_dir, num_workers=num_workers,
+                                                              tokenizer=tokenizer, append=True)
+            y, output_word_index, _ = tokenize_sequence_cached(replies, filters, decoder_num_tokens, decoder_vocab,
+                                                               cache_dir, num_workers=num_workers,
+                                                               tokenizer=tokenizer, append=True, bpe=decoder_bpe)
+            return x, input_word_index, y, output_word_index
+
+    x, input_word_index, y, output_word_index = tokenize_pairs(lines, replies, filters, encoder_num_tokens,
+                                                               encoder_vocab, decoder_num_tokens, decoder_vocab,
+                                                               num_workers, tokenizer, encoder_hash_buckets,
+                                                               decoder_bpe, shared_vocab)
+
+    if cache_dir:
+        save_tokenized_cache(cache_dir, line_key, x, input_word_index)
+        save_tokenized_cache(cache_dir, reply_key, y, output_word_index)
+
+    return x, input_word_index, y, output_word_index
+
+
+def _w2v_tokenize_chunk(args):
+    """
+    Word tokenizes one chunk of sentences into lines of space-separated tokens (executed in a worker process).
+    """
+    sentences, tokenizer = args
+    return ''.join(' '.join(_word_tokens(s, tokenizer)) + '\n' for s in sentences)
+
+
+def write_w2v_corpus(sentences, corpus_path, chunk_size=100000, num_workers=1, tokenizer='nltk', shuffle=True):
+    """
+    Word tokenizes a stream of sentences chunk by chunk in num_workers processes and writes the pre-tokenized
+    corpus (1 sentence of space-separated tokens per line) for train_w2v_streaming. At most num_workers chunks of
+    raw text are held in memory at a time. The file is renamed into place once complete.
+
+    Args:
+        sentences: iterable of sentences, e.g., iter_file_sentences(file_path)
+        corpus_path: path of the tokenized corpus file
+        chunk_size: Number of sentences per chunk
+        num_workers: Number of processes tokenizing chunks in parallel
+        tokenizer: 'nltk' or 'native', see tokenize_sequence
+        shuffle: if set, the sentences are shuffled within their chunk (with the global numpy random state)
+
+    Returns:
+        num_sentences: number of sentences written
+
+    """
+    def chunks():
+        for chunk in iter_chunks(sentences, chunk_size):
+            if shuffle:
+                np.random.shuffle(chunk)
+            yield chunk, tokenizer
+
+    num_sentences = 0
+    tmp_path = corpus_path + '.tmp{}'.format(os.getpid())
+    with open(tmp_path, 'w', encoding='utf-8', buffering=1 << 20) as f:
+        if num_workers <= 1:
+            for chunk in chunks():
+                f.write(_w2v_tokenize_chunk(chunk))
+                num_sentences += len(chunk[0])
+        else:
+            with multiprocessing.Pool(num_workers) as pool:
+                for window in iter_chunks(chunks(), num_workers):
+                    for chunk, lines in zip(window, pool.map(_w2v_tokenize_chunk, window)):
+                        f.write(lines)
+                        num_sentences += len(chunk[0])
+    os.replace(tmp_path, corpus_path)
+
+    return num_sentences
+
+
+def train_w2v_streaming(corpus_path, size=300, window=5, iterations=50, workers=0):
+    """
+    Trains word2vec on a corpus written by write_w2v_corpus, which gensim streams from disk in every epoch
+    instead of holding the tokenized sentences in memory.
+
+    Args:
+        corpus_path: path of the tokenized corpus file
+        size: word2vec dimension
+        window: context window size
+        iterations: number of epochs
+        workers: number of gensim worker threads (0: all cores)
+
+    Returns:
+        w2v_model: trained gensim Word2Vec model
+
+    """
+    return gensim.models.Word2Vec(gensim.models.word2vec.LineSentence(corpus_path),
+                                  size=size,
+                                  min_count=1,
+                                  window=window,
+                                  iter=iterations,
+                                  workers=workers or multiprocessing.cpu_count())
+
+
+def create_embedding_matrix(word_index, embedding_dim, w2v_path, cache_dir=''):
+    """
+    Create the initial embedding matrix for TF Graph. Words without a word2vec vector keep a random initialization.
+
+    Args:
+        word_index: dictionary storing the word-to-index correspondence
+        embedding_dim: word2vec dimension
+        w2v_path: file path to the w2v pickle file
+        cache_dir: (Optional) directory where the word2vec vectors aligned with word_index are cached, so that
+                   the w2v model is only loaded on a cache miss
+
+    Returns:
+        embeddings_matrix : numpy 2d-array with word vectors
+
+    """
+    # Drawn first, so that the random rows (and the global random state) do not depend on cache hits
+    embeddings_matrix = np.random.uniform(-0.05, 0.05, size=(len(word_index), embedding_dim))
+
+    cached = None
+    if cache_dir:
+        key = get_embedding_cache_key(word_index, embedding_dim, w2v_path)
+        cached = load_embedding_cache(cache_dir, key)
+        if cached is not None:
+            print('[INFO] Loaded embedding matrix from cache {}'.format(key))
+
+    if cached is None:
+        cached = align_w2v_vectors(word_index, embedding_dim, w2v_path)
+        if cache_dir:
+            save_embedding_cache(cache_dir, key, *cached)
+
+    vectors, found = cached
+    embeddings_matrix[found] = vectors[found]
+
+    return embeddings_matrix
+
+
+def align_w2v_vectors(word_index, embedding_dim, w2v_path):
+    """
+    Gathers the word2vec vectors of a vocabulary in a single indexing operation over the w2v vector matrix.
+    The vectors-only export of the model (see export_w2v_vectors) is used if it is up to date, only the
+    gathered rows are then read from disk.
+
+    Returns:
+        vectors: numpy 2d-array of shape [len(word_index), embedding_dim], zero rows for words without a vector
+        found: boolean array, whether a word has a word2vec vector
+
+    """
+    w2v_index, w2v_vectors = _w2v_index_vectors(w2v_path)
+
+    rows = np.full(len(word_index), -1, dtype=np.int64)
+    for word, i in word_index.items():
+        rows[i] = w2v_index.get(word, -1)
+
+    found = rows >= 0
+    vectors = np.zeros((len(word_index), embedding_dim), dtype=w2v_vectors.dtype)
+    vectors[found] = w2v_vectors[rows[found]]
+
+    return vectors, found
+
+
+def _w2v_index_vectors(w2v_path):
+    """
+    Word-to-row dictionary and vector matrix of the word2vec model at w2v_path, from its vectors-only export if
+    it is up to date (see load_w2v_vectors), otherwise from the full gensim model.
+    """
+    exported = load_w2v_vectors(w2v_path)
+    if exported is not None:
+        return exported
+
+    wv = gensim.models.Word2Vec.load(w2v_path).wv
+    return {word: entry.index for word, entry in wv.vocab.items()}, wv.vectors
+
+
+def _w2v_export_paths(w2v_path):
+    prefix = os.path.splitext(w2v_path)[0]
+    return prefix + '.vocab.txt', prefix + '.vectors.npy'
+
+
+def export_w2v_vectors(w2v_model, w2v_path):
+    """
+    Exports the word vectors of a gensim model saved at w2v_path without its training state: the words in index
+    order (1 per line) and a float32 .npy matrix next to it, which load_w2v_vectors memory-maps.
+    """
+    vocab_path, vectors_path = _w2v_export_paths(w2v_path)
+    tmp = '.tmp{}'.format(os.getpid())
+
+    with open(vocab_path + tmp, 'w', encoding='utf-8') as f:
+        f.write(''.join(word + '\n' for word in w2v_model.wv.index2word))
+    with open(vectors_path + tmp, 'wb') as f:  # np.save would append .npy to the temporary name
+        np.save(f, w2v_model.wv.vectors.astype(np.float32))
+
+    # The vectors are renamed last, load_w2v_vectors checks that they are newer than the model
+    os.replace(vocab_path + tmp, vocab_path)
+    os.replace(vectors_path + tmp, vectors_path)
+
+
+def load_w2v_vectors(w2v_path):
+    """
+    Loads the vectors-only export of the gensim model at w2v_path (see export_w2v_vectors), the vectors are
+    memory-mapped, so that processes share their pages and only read the rows they use.
+
+    Returns:
+        word_to_row, vectors or None if there is no export (or it is older than the model)
+
+    """
+    vocab_path, vectors_path = _w2v_export_paths(w2v_path)
+    if not os.path.exists(vectors_path) or not os.path.exists(vocab_path):
+        return None
+    if os.path.exists(w2v_path) and os.path.getmtime(vectors_path) < os.path.getmtime(w2v_path):
+        return None
+
+    with open(vocab_path, 'r', encoding='utf-8') as f:
+        word_to_row = {line.rstrip('\n'): i for i, line in enumerate(f)}
+
+    return word_to_row, np.load(vectors_path, mmap_mode='r')
+
+
+def get_embedding_cache_key(word_index, embedding_dim, w2v_path):
+    """
+    Computes a key of the word2vec vectors of a vocabulary from the path, size and modification time of the w2v
+    files (the pickle, the arrays gensim stores next to it and the vectors-only export) and the word-to-index
+    correspondence. The files are not read, so checking the cache does not cost a full read of the model.
+    """
+    sha = hashlib.sha1()
+    sha.update(repr(('w2v', embedding_dim)).encode('utf-8'))
+
+    w2v_dir = os.path.abspath(os.path.dirname(w2v_path) or '.')
+    prefix = os.path.splitext(os.path.basename(w2v_path))[0]
+    for name in sorted(f for f in os.listdir(w2v_dir) if f == prefix or f.startswith(prefix + '.')):
+        stat = os.stat(os.path.join(w2v_dir, name))
+        sha.update(repr((os.path.join(w2v_dir, name), stat.st_size, stat.st_mtime_ns)).encode('utf-8'))
+
+    for word, i in sorted(word_index.items(), key=lambda item: item[1]):
+        _update_corpus_hash(sha, '{} {}'.format(i, word))
+
+    return sha.hexdigest()
+
+
+def save_embedding_cache(cache_dir, key, vectors, found):
+    """
+    Stores the output of align_w2v_vectors like save_tokenized_cache, in the entry emb_<key> of cache_dir.
+    """
+    entry_dir = os.path.join(cache_dir, 'emb_' + key)
+    if os.path.exists(entry_dir):
+        return
+
+    tmp_dir = entry_dir + '.tmp{}'.format(os.getpid())
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    np.save(os.path.join(tmp_dir, 'vectors.npy'), vectors)
+    np.save(os.path.join(tmp_dir, 'found.npy'), found)
+
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError:  # Another process created the same entry in the meantime
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def load_embedding_cache(cache_dir, key):
+    """
+    Loads a cache entry written by save_embedding_cache. The vectors are memory-mapped.
+
+    Returns:
+        vectors, found or None on a cache miss
+
+    """
+    entry_dir = os.path.join(cache_dir, 'emb_' + key)
+    if not os.path.isdir(entry_dir):
+        return None
+
+    return (np.load(os.path.join(entry_dir, 'vectors.npy'), mmap_mode='r'),
+            np.load(os.path.join(entry_dir, 'found.npy')))
+
+
+def create_hashed_embedding_matrix(num_buckets, embedding_dim, w2v_path):
+    """
+    Create the initial embedding matrix of a hashed vocabulary (see hash_words): every bucket is initialized with
+    the mean word2vec vector of the words hashed to it. The vectors-only export of the model is used if it is
+    up to date, like in align_w2v_vectors.
+
+    Args:
+        num_buckets: number of hash buckets
+        embedding_dim: word2vec dimension
+        w2v_path: file path to the w2v pickle file
+
+    Returns:
+        embeddings_matrix : numpy 2d-array of shape [num_buckets + 4, embedding_dim]
+
+    """
+    w2v_index, w2v_vectors = _w2v_index_vectors(w2v_path)
+    embeddings_matrix = np.random.uniform(-0.05, 0.05, size=(num_buckets + 4, embedding_dim))
+
+    words = [None] * len(w2v_index)
+    for word, row in w2v_index.items():
+        words[row] = word
+
+    bucket_ids = hash_words(words, num_buckets)
+    sums = np.zeros_like(embeddings_matrix)
+    np.add.at(sums, bucket_ids, w2v_vectors)
+    counts = np.bincount(bucket_ids, minlength=num_buckets + 4)
+
+    found = counts > 0
+    embeddings_matrix[found] = sums[found] / counts[found, None]
+
+    return embeddings_matrix
+
+
+def get_sentences(file_path):
+    with open(file_path, 'r') as f:
+        data = f.readlines()
+
+    return data
+
+
+def clean_sentence(sent):
+    sent = re.sub(r'[^\w\s\?\.\,]', '', sent.strip().lower())  # Lower case, remove punctuations (except , ? .)
+    sent = re.sub(r'(([a-z]*)\d+.?\d*\%?)', ' NUM ', sent.strip())  # Replace Numbers with <NUM> token
+    return sent
+
+
+def ragged_dtype(vocab_size):
+    """
+    Returns the narrowest integer dtype that can hold the word indices of a vocabulary of the given size.
+    """
+    if vocab_size <= np.iinfo(np.uint16).max + 1:
+        return np.uint16
+
+    return np.int32
+
+
+class RaggedCorpus(object):
+    """
+    Compact alternative to the padded index matrix of tokenize_sequence: all sequences (without padding) are
+    stored back to back in one flat array of a narrow dtype, along with the offset and the length of every
+    sequence. Indexing with an int returns a single sequence, any other index (slice, range, index array)
+    returns a RaggedCorpus with the selected sequences, so that it can be split like the padded matrix.
+    """
+
+    def __init__(self, ids, offsets, lengths):
+        """
+        Args:
+            ids: flat array of word indices
+            offsets: int64 array of len(lengths) + 1 sequence boundaries within ids
+            lengths: int32 array of sequence lengths
+        """
+        self.ids = ids
+        self.offsets = offsets
+        self.lengths = lengths
+
+    @classmethod
+    def from_padded(cls, x, vocab_size, pad=0):
+        """
+        Creates a RaggedCorpus from a (post-)padded index matrix.
+
+        Args:
+            x: padded index matrix, e.g., returned by tokenize_sequence
+            vocab_size: vocabulary size, determines the dtype of the flat id array
+            pad: padding index
+
+        Returns:
+            corpus: RaggedCorpus
+
+        """
+        x = np.asarray(x)
+        mask = x != pad
+        lengths = np.count_nonzero(mask, axis=1).astype(np.int32)
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+
+        return cls(x[mask].astype(ragged_dtype(vocab_size)), offsets, lengths)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return self.ids[self.offsets[index]:self.offsets[index + 1]]
+
+        indices = np.arange(len(self))[index]
+        lengths = self.lengths[indices]
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+
+        # Position of every selected id in the flat array
+        positions = np.repeat(self.offsets[indices] - offsets[:-1], lengths) + np.arange(offsets[-1])
+
+        return RaggedCorpus(self.ids[positions], offsets, lengths)
+
+    @property
+    def nbytes(self):
+        return self.ids.nbytes + self.offsets.nbytes + self.lengths.nbytes
+
+    def pad(self, start, end, pad=0):
+        """
+        Pads the sequences start, ..., end - 1 to the length of the longest of them.
+
+        Args:
+            start: index of the first sequence
+            end: index after the last sequence
+            pad: padding index
+
+        Returns:
+            x_batch: int32 index matrix of shape [end - start, max length]
+            lengths: lengths of the sequences
+
+        """
+        lengths = self.lengths[start:end]
+        x_batch = np.full((len(lengths), lengths.max(initial=0)), pad, dtype=np.int32)
+        x_batch[np.arange(x_batch.shape[1]) < lengths[:, None]] = self.ids[self.offsets[start]:self.offsets[end]]
+
+        return x_batch, lengths
+
+
+def concatenate_ragged(corpora):
+    """
+    Concatenates RaggedCorpus objects into one.
+    """
+    lengths = np.concatenate([c.lengths for c in corpora])
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    return RaggedCorpus(np.concatenate([c.ids for c in corpora]), offsets, lengths)
+
+
+def write_sharded_dataset(dataset_dir, chunks, word_indices, fields=('x',), shard_size=1000000):
+    """
+    Writes a corpus that does not fit into memory as a sharded dataset: every shard stores the (unpadded) id
+    sequences of each field in a flat array plus their lengths, and index.pkl lists the shards, their sizes and
+    the vocabularies. Only one shard is held in memory at a time.
+
+    Args:
+        dataset_dir: output directory
+        chunks: iterable of tuples of padded index matrices (one per field), e.g., returned by texts_to_ids
+        word_indices: list of the word-to-index dictionaries of the fields
+        fields: names of the fields, e.g., ('x', 'y') for (line, reply) pairs
+        shard_size: (minimum) number of examples per shard
+
+    """
+    os.makedirs(dataset_dir, exist_ok=True)
+    shards = []
+    pending = []
+
+    def write_shard():
+        name = 'shard_{:05d}'.format(len(shards))
+        for field, word_index, corpora in zip(fields, word_indices, zip(*pending)):
+            corpus = concatenate_ragged(corpora)
+            np.save(os.path.join(dataset_dir, '{}_{}_ids.npy'.format(name, field)), corpus.ids)
+            np.save(os.path.join(dataset_dir, '{}_{}_lengths.npy'.format(name, field)), corpus.lengths)
+        shards.append((name, sum(len(chunk[0]) for chunk in pending)))
+        del pending[:]
+
+    pending_size = 0
+    for chunk in chunks:
+        pending.append([RaggedCorpus.from_padded(x, len(word_index)) for x, word_index in zip(chunk, word_indices)])
+        pending_size += len(chunk[0])
+        if pending_size >= shard_size:
+            write_shard()
+            pending_size = 0
+    if pending:
+        write_shard()
+
+    # The index is written last, a dataset without index is incomplete
+    with open(os.path.join(dataset_dir, 'index.pkl'), 'wb') as f:
+        pickle.dump({'fields': list(fields), 'shards': shards, 'word_indices': word_indices}, f,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def build_sentence_shards(corpus_path, dataset_dir, filters, max_num_words, max_vocab_size, shard_size=1000000,
+                          chunk_size=100000, num_workers=1, tokenizer='nltk'):
+    """
+    Builds a sharded dataset from a corpus file with one sentence per line, in two streaming passes:
+    one for the vocabulary (see build_vocabulary), one for the id sequences.
+
+    Args:
+        corpus_path: path to the corpus file
+        dataset_dir: output directory
+        filters: List of filters/punctuations to omit
+        max_num_words: Number of words to be considered in the fixed length sequence
+        max_vocab_size: Number of most frequently occurring words to be kept in the vocabulary
+        shard_size: (minimum) number of sentences per shard
+        chunk_size: Number of sentences tokenized at a time
+        num_workers: Number of processes used for word tokenization
+        tokenizer: 'nltk' or 'native', see tokenize_sequence
+
+    """
+    word_index = build_vocabulary([corpus_path], filters, max_num_words, max_vocab_size, chunk_size, num_workers,
+                                  tokenizer)
+
+    chunks = ((texts_to_ids(sentences, word_index, filters, max_num_words, num_workers, tokenizer),)
+              for sentences in iter_chunks(iter_file_sentences(corpus_path), chunk_size))
+    write_sharded_dataset(dataset_dir, chunks, [word_index], ('x',), shard_size)
+
+
+def iter_csv_column(csv_path, column):
+    """
+    Lazily reads one column of a csv file, e.g., the 'line' or 'reply' column of a dialog corpus.
+    """
+    with open(csv_path, 'r', newline='') as f:
+        for row in csv.DictReader(f):
+            yield row[column]
+
+
+def pair_shingles(line, reply, ngram=2):
+    """
+    Word n-grams of a (line, reply) pair, prefixed with their side so that swapped pairs are not similar.
+
+    Args:
+        line: input sentence
+        reply: output sentence
+        ngram: n-gram size, sentences with fewer words contribute a single shingle
+
+    Returns:
+        shingles: set of strings
+
+    """
+    shingles = set()
+    for side, sentence in (('l', line), ('r', reply)):
+        words = sentence.split()
+        shingles.add(side + ':' + ' '.join(words[:ngram]))
+        shingles.update(side + ':' + ' '.join(words[i:i + ngram]) for i in range(1, len(words) - ngram + 1))
+
+    return shingles
+
+
+class MinHashLSH(object):
+    """
+    Near-duplicate search by MinHash signatures and locality sensitive hashing: the signatures are cut into bands
+    and documents sharing the hash of a band become candidates, whose Jaccard similarity is then estimated from
+    the full signatures. Indexing and querying take time linear in the number of documents (plus candidates).
+    """
+    PRIME = (1 << 31) - 1
+
+    def __init__(self, num_perm=128, threshold=0.8, seed=1337):
+        self.num_perm = num_perm
+        self.threshold = threshold
+        self.num_bands, self.band_size = self.lsh_params(num_perm, threshold)
+
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, self.PRIME, size=(num_perm, 1)).astype(np.int64)
+        self.b = rng.randint(0, self.PRIME, size=(num_perm, 1)).astype(np.int64)
+
+        self.signatures = np.zeros((0, num_perm), dtype=np.uint32)
+        self.buckets = [dict() for _ in range(self.num_bands)]
+
+    @staticmethod
+    def lsh_params(num_perm, threshold):
+        """
+        Chooses the number of bands and rows per band whose similarity threshold (1/bands)^(1/rows) is the largest
+        one not above the given threshold, i.e., favouring recall.
+        """
+        params = [(num_perm // r, r) for r in range(1, num_perm + 1) if num_perm % r == 0]
+        below = [(b, r) for b, r in params if (1. / b) ** (1. / r) <= threshold]
+
+        return max(below, key=lambda p: (1. / p[0]) ** (1. / p[1])) if below else params[-1]
+
+    def compute_signatures(self, shingle_sets, chunk_size=2000):
+        """
+        Args:
+            shingle_sets: list of sets of strings, e.g., from pair_shingles
+            chunk_size: number of documents hashed at a time (memory grows with chunk_size * num_perm)
+
+        Returns:
+            signatures: uint32 array of shape [len(shingle_sets), num_perm]
+
+        """
+        signatures = np.zeros((len(shingle_sets), self.num_perm), dtype=np.uint32)
+        for start in range(0, len(shingle_sets), chunk_size):
+            chunk = shingle_sets[start:start + chunk_size]
+            hashes = np.array([zlib.crc32(s.encode('utf-8')) for shingles in chunk for s in (shingles or {''})],
+                              dtype=np.int64) % self.PRIME
+            offsets = np.cumsum([0] + [max(len(shingles), 1) for shingles in chunk[:-1]])
+
+            permuted = (self.a * hashes[None, :] + self.b) % self.PRIME
+            signatures[start:start + len(chunk)] = np.minimum.reduceat(permuted, offsets, axis=1).T
+
+        return signatures
+
+    def band_keys(self, signature):
+        return [signature[i * self.band_size:(i + 1) * self.band_size].tobytes() for i in range(self.num_bands)]
+
+    def index(self, signatures):
+        """
+        Adds documents to the index, they are numbered in the order they are added.
+        """
+        offset = len(self.signatures)
+        for i, signature in enumerate(signatures):
+            for bucket, key in zip(self.buckets, self.band_keys(signature)):
+                bucket.setdefault(key, []).append(offset + i)
+
+        self.signatures = np.concatenate([self.signatures, signatures])
+
+    def query(self, signatures):
+        """
+        Finds the most similar indexed document of each query whose estimated Jaccard similarity reaches the
+        threshold.
+
+        Args:
+            signatures: signatures of the queries
+
+        Returns:
+            matches: list of (query number, document number, estimated similarity)
+
+        """
+        matches = []
+        for i, signature in enumerate(signatures):
+            candidates = set()
+            for bucket, key in zip(self.buckets, self.band_keys(signature)):
+                candidates.update(bucket.get(key, ()))
+            if not candidates:
+                continue
+
+            candidates = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+            similarity = (self.signatures[candidates] == signature).mean(axis=1)
+            best = similarity.argmax()
+            if similarity[best] >= self.threshold:
+                matches.append((i, int(candidates[best]), float(similarity[best])))
+
+        return matches
+
+
+def write_pairs_csv(csv_path, pairs, header=('line', 'reply'), buffer_size=1 << 20):
+    """
+    Writes (line, reply) pairs in the format of the dialog csv files.
+
+    Args:
+        csv_path: output csv file
+        pairs: iterable of (line, reply) tuples, or of rows matching the header
+        header: column names, no header is written if None
+        buffer_size: size of the write buffer in bytes
+
+    """
+    with open(csv_path, 'w', newline='', buffering=buffer_size) as f:
+        writer = csv.writer(f, lineterminator='\n')
+        if header is not None:
+            writer.writerow(header)
+        writer.writerows(pairs)
+
+
+def save_pair_index(index_dir, name, utterances, pair_ids, buffer_size=1 << 20):
+    """
+    Stores a dialog corpus as its distinct utterances and a (line_id, reply_id) index into them.
+
+    Args:
+        index_dir: output directory
+        name: name of the corpus split, e.g., 'train'
+        utterances: list of distinct utterances (without newlines), in the order of their ids
+        pair_ids: int array of shape [num_pairs, 2]
+        buffer_size: size of the write buffer in bytes
+
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    with open(os.path.join(index_dir, name + '_utterances.txt'), 'w', buffering=buffer_size) as f:
+        for utterance in utterances:
+            f.write(utterance)
+            f.write('\n')
+    np.save(os.path.join(index_dir, name + '_pairs.npy'), np.asarray(pair_ids, dtype=np.int32))
+
+
+def load_pair_index(index_dir, name):
+    """
+    Loads a corpus written by save_pair_index.
+
+    Returns:
+        utterances, pair_ids
+
+    """
+    with open(os.path.join(index_dir, name + '_utterances.txt'), 'r') as f:
+        utterances = [line[:-1] for line in f]
+
+    return utterances, np.load(os.path.join(index_dir, name + '_pairs.npy'))
+
+
+def iter_indexed_pairs(utterances, pair_ids):
+    """
+    Lazily resolves a (line_id, reply_id) index into (line, reply) pairs.
+    """
+    for line_id, reply_id in pair_ids:
+        yield utterances[line_id], utterances[reply_id]
+
+
+def build_pair_shards(csv_path, dataset_dir, filters, encoder_num_tokens, encoder_vocab, decoder_num_tokens,
+                      decoder_vocab, shard_size=1000000, chunk_size=100000, num_workers=1, tokenizer='nltk'):
+    """
+    Builds a sharded dataset of (line, reply) pairs from a dialog csv file, in streaming passes.
+
+    Args:
+        csv_path: path to a csv file with line and reply columns
+        dataset_dir: output directory
+        filters: List of filters/punctuations to omit
+        encoder_num_tokens: Number of words to be considered in the input sequences
+        encoder_vocab: Number of most frequently occurring words to be kept in the input vocabulary
+        decoder_num_tokens: Number of words to be considered in the output sequences
+        decoder_vocab: Number of most frequently occurring words to be kept in the output vocabulary
+        shard_size: (minimum) number of pairs per shard
+        chunk_size: Number of pairs tokenized at a time
+        num_workers: Number of processes used for word tokenization
+        tokenizer: 'nltk' or 'native', see tokenize_sequence
+
+    """
+    input_word_index = build_vocabulary([iter_csv_column(csv_path, 'line')], filters, encoder_num_tokens,
+                                        encoder_vocab, chunk_size, num_workers, tokenizer)
+    output_word_index = build_vocabulary([iter_csv_column(csv_path, 'reply')], filters, decoder_num_tokens,
+                                         decoder_vocab, chunk_size, num_workers, tokenizer)
+
+    def chunks():
+        for pairs in iter_chunks(zip(iter_csv_column(csv_path, 'line'), iter_csv_column(csv_path, 'reply')),
+                                 chunk_size):
+            lines, replies = zip(*pairs)
+            yield (texts_to_ids(lines, input_word_index, filters, encoder_num_tokens, num_workers, tokenizer),
+                   texts_to_ids(replies, output_word_index, filters, decoder_num_tokens, num_workers, tokenizer))
+
+    write_sharded_dataset(dataset_dir, chunks(), [input_word_index, output_word_index], ('x', 'y'), shard_size)
+
+
+class ShardedDataset(object):
+    """
+    Reader of a dataset written by write_sharded_dataset. It can be used in place of the in-memory training
+    data of the models: get_batches/get_batches_xy stream the shards (in random order, memory-mapped) through
+    a bounded shuffle buffer, so memory usage does not depend on the size of the corpus. Every pass over the
+    dataset is shuffled differently.
+    """
+
+    def __init__(self, dataset_dir, shuffle_buffer_size=100000, seed=None):
+        """
+        Args:
+            dataset_dir: directory of the sharded dataset
+            shuffle_buffer_size: number of examples held in the shuffle buffer
+            seed: (Optional) seed of the shard order and the shuffle buffer
+        """
+        with open(os.path.join(dataset_dir, 'index.pkl'), 'rb') as f:
+            index = pickle.load(f)
+
+        self.dataset_dir = dataset_dir
+        self.fields = index['fields']
+        self.shards = index['shards']
+        self.word_indices = index['word_indices']
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.random_state = np.random.RandomState(seed)
+
+    def __len__(self):
+        return sum(size for _, size in self.shards)
+
+    def load_shard(self, name):
+        """
+        Returns the fields of a shard as memory-mapped RaggedCorpus objects.
+        """
+        corpora = []
+        for field in self.fields:
+            path = os.path.join(self.dataset_dir, '{}_{}_'.format(name, field))
+            lengths = np.load(path + 'lengths.npy')
+            offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=offsets[1:])
+            corpora.append(RaggedCorpus(np.load(path + 'ids.npy', mmap_mode='r'), offsets, lengths))
+
+        return corpora
+
+    def iter_examples(self):
+        """
+        Yields the examples (tuples of id sequences, one per field) in shuffled order.
+        """
+        buffer = []
+        for shard_i in self.random_state.permutation(len(self.shards)):
+            corpora = self.load_shard(self.shards[shard_i][0])
+            for i in range(len(corpora[0])):
+                example = tuple(np.array(corpus[i]) for corpus in corpora)
+                if len(buffer) < self.shuffle_buffer_size:
+                    buffer.append(example)
+                else:
+                    j = self.random_state.randint(len(buffer))
+                    yield buffer[j]
+                    buffer[j] = example
+
+        self.random_state.shuffle(buffer)
+        for example in buffer:
+            yield example
+
+    def get_batches(self, batch_size, keep_remainder=False):
+        """
+        Yields batches in the format of get_batches (one field) or get_batches_xy (two fields),
+        padded to the longest sequence of the batch. With keep_remainder, the last partial batch is filled up
+        with repeated examples and the mask of its valid examples is yielded as well. A single remaining example
+        is added to the previous batch instead.
+        """
+        chunks = iter_chunks(self.iter_examples(), batch_size)
+        next_examples = next(chunks, None)
+        while next_examples is not None:
+            examples, next_examples = next_examples, next(chunks, None)
+            if keep_remainder and next_examples is not None and len(next_examples) == 1:
+                examples, next_examples = examples + next_examples, None
+
+            num_valid = len(examples)
+            if num_valid < batch_size:
+                if not keep_remainder:
+                    break
+                examples = [examples[i % num_valid] for i in range(batch_size)]
+
+            batch = []
+            for sequences in zip(*examples):
+                lengths = np.array([len(seq) for seq in sequences], dtype=np.int32)
+                x_batch = np.zeros((len(examples), lengths.max()), dtype=np.int32)
+                for i, seq in enumerate(sequences):
+                    x_batch[i, :len(seq)] = seq
+                batch.append((x_batch, lengths))
+
+            if len(batch) == 1:
+                batch = (batch[0][0], batch[0][0], batch[0][1])
+            else:
+                batch = (batch[0][0], batch[1][0], batch[0][1], batch[1][1])
+
+            if keep_remainder:
+                yield batch + (_batch_mask(len(examples), num_valid),)
+            else:
+                yield batch
+
+
+def sequence_lengths(x):
+    """
+    Number of non-padding ids of every sequence of an index matrix or RaggedCorpus.
+    """
+    if isinstance(x, RaggedCorpus):
+        return np.asarray(x.lengths, dtype=np.int64)
+
+    return np.count_nonzero(x, axis=1)
+
+
+def length_bucket_boundaries(lengths, num_buckets):
+    """
+    Chooses the bucket boundaries which minimize the number of padded time steps, i.e., the sum over buckets of
+    the number of sequences times the longest length, by dynamic programming over the length histogram.
+
+    Args:
+        lengths: sequence lengths
+        num_buckets: maximum number of buckets
+
+    Returns:
+        boundaries: increasing list of the maximum length of every bucket
+
+    """
+    values, counts = np.unique(lengths, return_counts=True)
+    cum_counts = np.concatenate([[0], np.cumsum(counts)])
+    num_values, num_buckets = len(values), min(num_buckets, len(values))
+
+    # cost[j, i]: padded steps of the i shortest distinct lengths in j buckets, start[j, i]: start of the last bucket
+    cost = np.full((num_buckets + 1, num_values + 1), np.inf)
+    cost[0, 0] = 0
+    start = np.zeros((num_buckets + 1, num_values + 1), dtype=np.int64)
+    for j in range(1, num_buckets + 1):
+        for i in range(j, num_values + 1):
+            candidates = cost[j - 1, :i] + (cum_counts[i] - cum_counts[:i]) * values[i - 1]
+            start[j, i] = np.argmin(candidates)
+            cost[j, i] = candidates[start[j, i]]
+
+    boundaries, i = [], num_values
+    for j in range(num_buckets, 0, -1):
+        boundaries.append(values[i - 1])
+        i = start[j, i]
+
+    return boundaries[::-1]
+
+
+def bucketed_batch_indices(lengths, batch_size, num_buckets, rng=np.random, keep_remainder=False, pad_remainder=True):
+    """
+    Groups sequences of similar length into batches: the sequences are shuffled within their length bucket,
+    cut into batches in bucket order and the batches are shuffled, so each call gives a new epoch order.
+    The last len(lengths) % batch_size sequences (of a random bucket) are left out, unless keep_remainder is set.
+
+    Args:
+        lengths: sequence lengths, e.g., from sequence_lengths, or a tuple of source and target lengths
+                 (every pair of a source and a target bucket is then a bucket)
+        batch_size: batch size
+        num_buckets: maximum number of buckets (per side), see length_bucket_boundaries
+        rng: np.random.RandomState (or the np.random module) drawing the order
+        keep_remainder, pad_remainder: see _batch_indices
+
+    Returns:
+        batches: list of (index array, number of valid examples) tuples
+
+    """
+    batches = _split_order(_bucketed_order(lengths, num_buckets, rng), batch_size, keep_remainder, pad_remainder)
+    rng.shuffle(batches)
+
+    return batches
+
+
+def _bucketed_order(lengths, num_buckets, rng=np.random):
+    """
+    Random order of the examples in which the examples of every length bucket are consecutive.
+    """
+    bucket_ids = 0
+    for side_lengths in (lengths if isinstance(lengths, tuple) else (lengths,)):
+        side_ids = np.searchsorted(length_bucket_boundaries(side_lengths, num_buckets), side_lengths)
+        bucket_ids = bucket_ids * num_buckets + side_ids
+
+    order = rng.permutation(len(side_lengths))
+
+    return order[np.argsort(bucket_ids[order], kind='stable')]
+
+
+def token_budget_batch_indices(lengths, max_tokens, order=None, min_size=2):
+    """
+    Packs consecutive examples of an order into batches of at most max_tokens tokens, counting every example of
+    a batch at the padded length of the batch, so that batches of short sequences hold more examples. A batch
+    holds at least min_size examples (the MMD penalties compare pairs of examples), even if they exceed the budget.
+
+    Args:
+        lengths: sequence lengths, or a tuple of source and target lengths (an example then counts the padded
+                 source plus the padded target length)
+        max_tokens: token budget of a batch, e.g., batch_size x num_tokens
+        order: (Optional) order of the examples, e.g., from _bucketed_order (default: the corpus order)
+        min_size: minimum number of examples per batch
+
+    Returns:
+        batches: list of index arrays, covering all examples
+
+    """
+    sides = lengths if isinstance(lengths, tuple) else (lengths,)
+    if order is None:
+        order = np.arange(len(sides[0]))
+
+    rows = list(zip(*[np.asarray(side)[order].tolist() for side in sides]))
+    batches, start, padded = [], 0, [0] * len(sides)
+    for i, row in enumerate(rows):
+        grown = [max(p, l) for p, l in zip(padded, row)]
+        if i - start >= min_size and (i - start + 1) * sum(grown) > max_tokens:
+            batches.append(order[start:i])
+            start, grown = i, list(row)
+        padded = grown
+
+    if start < len(rows):
+        if len(rows) - start < min_size and batches:
+            batches[-1] = np.concatenate([batches[-1], order[start:]])
+        else:
+            batches.append(order[start:])
+
+    return batches
+
+
+def _split_order(order, batch_size, keep_remainder=False, pad_remainder=True):
+    """
+    Cuts an index order into (index array, number of valid examples) batches. With keep_remainder, the final
+    partial batch is kept and, with pad_remainder, filled up to batch_size by repeating its own indices, the
+    repeated rows come last. A padded remainder of a single example is added to the previous batch instead.
+    """
+    num_full = len(order) // batch_size * batch_size
+    batches = [(order[i:i + batch_size], batch_size) for i in range(0, num_full, batch_size)]
+    if keep_remainder and num_full < len(order):
+        remainder = order[num_full:]
+        if pad_remainder and len(remainder) == 1 and batches:
+            batches[-1] = (order[num_full - batch_size:], batch_size + 1)
+        else:
+            batches.append((np.resize(remainder, batch_size) if pad_remainder else remainder, len(remainder)))
+
+    return batches
+
+
+def _batch_indices(num_examples, batch_size, num_buckets=0, lengths=None, shuffle=False, seed=None,
+                   keep_remainder=False, max_tokens=0, pad_remainder=True):
+    """
+    Indices of the batches of a corpus: consecutive slices or, if num_buckets > 0 or shuffle is set, index arrays
+    of a random order (only the indices are permuted, the data is not copied). Every batch comes with its number
+    of valid examples: all batches are full, except for the last one if keep_remainder is set.
+
+    Args:
+        num_examples: number of examples of the corpus
+        batch_size: batch size
+        num_buckets: if > 0, length-bucketed batches, see bucketed_batch_indices
+        lengths: sequence lengths (num_buckets > 0 only)
+        shuffle: if set, the examples are shuffled
+        seed: (Optional) seed of the order, the global numpy random state is used if None
+        keep_remainder: if set, the last num_examples % batch_size examples form a final batch, which is padded
+                        with repeated examples to batch_size. A single remaining example is added to the previous
+                        batch instead, as its padded batch would only have one example of nonzero weight
+        max_tokens: if > 0, batches of up to max_tokens (padded) tokens instead of batch_size examples, see
+                    token_budget_batch_indices. They cover all examples, in order unless num_buckets or shuffle is set
+        pad_remainder: if not set, the final batch of keep_remainder is not padded but smaller, the models accept
+                       any batch size. Training pads it (or merges it), so that the MMD of a batch always
+                       compares at least two weighted examples
+
+    Returns:
+        batches: list of (slice or index array, number of valid examples) tuples
+
+    """
+    rng = np.random if seed is None else np.random.RandomState(seed)
+
+    if max_tokens:
+        if num_buckets:
+            order = _bucketed_order(lengths, num_buckets, rng)
+        else:
+            order = rng.permutation(num_examples) if shuffle else None
+        batches = token_budget_batch_indices(lengths, max_tokens, order)
+        if num_buckets or shuffle:
+            rng.shuffle(batches)
+        return [(index, len(index)) for index in batches]
+
+    if num_buckets:
+        return bucketed_batch_indices(lengths, batch_size, num_buckets, rng, keep_remainder, pad_remainder)
+
+    if shuffle:
+        return _split_order(rng.permutation(num_examples), batch_size, keep_remainder, pad_remainder)
+
+    num_full = num_examples // batch_size * batch_size
+    batches = [(slice(start_i, start_i + batch_size), batch_size) for start_i in range(0, num_full, batch_size)]
+    if keep_remainder and num_full < num_examples:
+        if pad_remainder and num_examples - num_full == 1 and batches:
+            batches[-1] = (slice(num_full - batch_size, num_examples), batch_size + 1)
+        elif pad_remainder:
+            batches.append((np.resize(np.arange(num_full, num_examples), batch_size), num_examples - num_full))
+        else:
+            batches.append((slice(num_full, num_examples), num_examples - num_full))
+
+    return batches
+
+
+def _get_batch(x, index):
+    """
+    Returns one batch of (padded) sequences along with their lengths. Batches taken by an index array (bucketed
+    or shuffled batches) are cut to their longest sequence.
+    """
+    if isinstance(x, RaggedCorpus):
+        if isinstance(index, slice):
+            return x.pad(index.start, index.stop)
+        return x[index].pad(0, len(index))
+
+    x_batch = x[index]
+    sentence_length = [np.count_nonzero(seq) for seq in x_batch]
+    if not isinstance(index, slice):
+        x_batch = x_batch[:, :max(sentence_length)]
+
+    return x_batch, sentence_length
+
+
+def _batch_mask(batch_size, num_valid):
+    """
+    Boolean mask of the valid (not padded) examples of a batch.
+    """
+    return np.arange(batch_size) < num_valid
+
+
+def get_batches(x, batch_size, num_buckets=0, shuffle=False, seed=None, keep_remainder=False, max_tokens=0):
+    """
+    Generate inputs and targets in a batch-wise fashion for feed-dict
+
+    Args:
+        x: entire source sequence array, RaggedCorpus or ShardedDataset (batches are then padded to their longest sequence)
+        batch_size: batch size
+        num_buckets: if > 0, batches of sentences of similar length in random order, see bucketed_batch_indices
+        shuffle: if set, batches of a random order (sharded datasets are always shuffled)
+        seed: (Optional) seed of the random order, e.g., shifted by the epoch to draw a new order every epoch
+        keep_remainder: if set, the last len(x) % batch_size sentences are not dropped, but form a final, smaller
+                        batch, and the mask of the valid sentences is yielded as well (a batch of a sharded dataset
+                        is padded with repeated sentences instead)
+        max_tokens: if > 0, batches of a variable number of sentences, up to max_tokens padded tokens per batch
+                    (see token_budget_batch_indices), which cover every sentence
+
+    Returns:
+        x_batch, y_batch, sentence_length (, mask if keep_remainder is set)
+
+    """
+
+    if isinstance(x, ShardedDataset):
+        if num_buckets or max_tokens:
+            raise ValueError('Length buckets and token budgets are not supported for sharded datasets')
+        for batch in x.get_batches(batch_size, keep_remainder):
+            yield batch
+        return
+
+    lengths = sequence_lengths(x) if num_buckets or max_tokens else None
+    for index, num_valid in _batch_indices(len(x), batch_size, num_buckets, lengths, shuffle, seed, keep_remainder,
+                                           max_tokens, pad_remainder=False):
+        x_batch, sentence_length = _get_batch(x, index)
+
+        if keep_remainder:
+            yield x_batch, x_batch, sentence_length, _batch_mask(len(x_batch), num_valid)
+        else:
+            yield x_batch, x_batch, sentence_length
+
+
+def get_weighted_batches(x, batch_size, weights=None, num_buckets=0, shuffle=False, seed=None, keep_remainder=False,
+                         max_tokens=0):
+    """
+    Same batches as get_batches, followed by the loss weights of their examples.
+
+    Args:
+        x: entire source sequence array or RaggedCorpus
+        batch_size: batch size
+        weights: (Optional) per-example loss weights aligned with x, e.g., from collapse_duplicates (default: ones)
+        num_buckets, shuffle, seed, max_tokens: see get_batches
+        keep_remainder: see get_batches, but the last batch is padded to batch_size with repeated examples of weight 0
+                        (a single remaining example is added to the previous batch instead)
+
+    Returns:
+        x_batch, y_batch, sentence_length, weights_batch
+
+    """
+    if isinstance(x, ShardedDataset):
+        if weights is not None:
+            raise ValueError('Loss weights are not supported for sharded datasets')
+        for batch in get_batches(x, batch_size, num_buckets, shuffle, seed, keep_remainder, max_tokens):
+            weights_batch = np.ones(len(batch[0]), dtype=np.float32)
+            if keep_remainder:
+                weights_batch *= batch[3]
+            yield batch[0], batch[1], batch[2], weights_batch
+        return
+
+    lengths = sequence_lengths(x) if num_buckets or max_tokens else None
+    for index, num_valid in _batch_indices(len(x), batch_size, num_buckets, lengths, shuffle, seed, keep_remainder,
+                                           max_tokens):
+        x_batch, sentence_length = _get_batch(x, index)
+        if weights is None:
+            weights_batch = np.ones(len(x_batch), dtype=np.float32)
+        else:
+            weights_batch = weights[index].astype(np.float32)
+        weights_batch *= _batch_mask(len(x_batch), num_valid)
+
+        yield x_batch, x_batch, sentence_length, weights_batch
+
+
+def collapse_duplicates(x):
+    """
+    Collapses identical rows into unique rows, in the order of their first occurrence. The number of occurrences
+    of each row is returned as its loss weight (normalized to a mean of 1), so that an epoch over the unique rows
+    optimizes the same objective as an epoch over all rows.
+
+    Args:
+        x: index matrix or RaggedCorpus
+
+    Returns:
+        x_unique: unique rows (of the same type as x)
+        weights: float32 array of per-row loss weights
+
+    """
+    dense = x.pad(0, len(x))[0] if isinstance(x, RaggedCorpus) else np.ascontiguousarray(x)
+    rows = dense.view(np.dtype((np.void, dense.dtype.itemsize * dense.shape[1]))).ravel()
+    _, first, counts = np.unique(rows, return_index=True, return_counts=True)
+
+    order = np.argsort(first)
+    weights = counts[order] / counts.mean()
+
+    return x[first[order]], weights.astype(np.float32)
+
+
+def get_batches_xy(x, y, batch_size, num_buckets=0, shuffle=False, seed=None, keep_remainder=False, max_tokens=0):
+    """
+    Generate inputs and targets in a batch-wise fashion for feed-dict
+    Args:
+        x: entire source sequence array, RaggedCorpus or ShardedDataset (batches are then padded to their longest sequence)
+        y: entire output sequence array or RaggedCorpus (ignored for a ShardedDataset with source and target fields)
+        batch_size: batch size
+        num_buckets: if > 0, batches of pairs of similar source and target lengths, see get_batches
+        shuffle, seed, keep_remainder: see get_batches
+        max_tokens: see get_batches, a pair counts its padded source plus its padded target length
+    Returns:
+        x_batch, y_batch, source_sentence_length, target_sentence_length (, mask if keep_remainder is set)
+    """
+
+    if isinstance(x, ShardedDataset):  # Holds both the source and the target sequences
+        if num_buckets or max_tokens:
+            raise ValueError('Length buckets and token budgets are not supported for sharded datasets')
+        for batch in x.get_batches(batch_size, keep_remainder):
+            yield batch
+        return
+
+    lengths = (sequence_lengths(x), sequence_lengths(y)) if num_buckets or max_tokens else None
+    for index, num_valid in _batch_indices(len(x), batch_size, num_buckets, lengths, shuffle, seed, keep_remainder,
+                                           max_tokens, pad_remainder=False):
+        x_batch, source_sentence_length = _get_batch(x, index)
+        y_batch, target_sentence_length = _get_batch(y, index)
+
+        if keep_remainder:
+            yield x_batch, y_batch, source_sentence_length, target_sentence_length, _batch_mask(len(x_batch), num_valid)
+        else:
+            yield x_batch, y_batch, source_sentence_length, target_sentence_length
+
+
+def get_weighted_batches_xy(x, y, batch_size, weights=None, num_buckets=0, shuffle=False, seed=None,
+                            keep_remainder=False, max_tokens=0):
+    """
+    Same batches as get_batches_xy, followed by the loss weights of their examples.
+    Args:
+        x, y: see get_batches_xy
+        batch_size: batch size
+        weights: (Optional) per-example loss weights aligned with x (default: ones)
+        num_buckets, shuffle, seed, max_tokens: see get_batches_xy
+        keep_remainder: see get_batches, but the last batch is padded to batch_size with repeated examples of weight 0
+                        (a single remaining example is added to the previous batch instead)
+    Returns:
+        x_batch, y_batch, source_sentence_length, target_sentence_length, weights_batch
+    """
+    if isinstance(x, ShardedDataset):
+        if weights is not None:
+            raise ValueError('Loss weights are not supported for sharded datasets')
+        for batch in get_batches_xy(x, y, batch_size, num_buckets, shuffle, seed, keep_remainder, max_tokens):
+            weights_batch = np.ones(len(batch[0]), dtype=np.float32)
+            if keep_remainder:
+                weights_batch *= batch[4]
+            yield batch[:4] + (weights_batch,)
+        return
+
+    lengths = (sequence_lengths(x), sequence_lengths(y)) if num_buckets or max_tokens else None
+    for index, num_valid in _batch_indices(len(x), batch_size, num_buckets, lengths, shuffle, seed, keep_remainder,
+                                           max_tokens):
+        x_batch, source_sentence_length = _get_batch(x, index)
+        y_batch, target_sentence_length = _get_batch(y, index)
+        if weights is None:
+            weights_batch = np.ones(len(x_batch), dtype=np.float32)
+        else:
+            weights_batch = weights[index].astype(np.float32)
+        weights_batch *= _batch_mask(len(x_batch), num_valid)
+
+        yield x_batch, y_batch, source_sentence_length, target_sentence_length, weights_batch
+
+
+class BackgroundIterator(object):
+    """
+    Iterates over an iterable on a background thread, holding up to buffer_size items ahead of the consumer, e.g.,
+    to prepare the next batch while the current training step runs. Exceptions of the iterable are raised in the
+    consumer. produce_time is the time spent producing the items, wait_time the time the consumer waited for them.
+    """
+    _END = object()
+
+    def __init__(self, iterable, buffer_size=2):
+        self.queue = queue.Queue(maxsize=max(1, buffer_size))
+        self.produce_time = 0.
+        self.wait_time = 0.
+        self.thread = threading.Thread(target=self._produce, args=(iterable,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _produce(self, iterable):
+        try:
+            iterator = iter(iterable)
+            while True:
+                start = time.time()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                self.produce_time += time.time() - start
+                self.queue.put((item, None))
+        except Exception as e:
+            self.queue.put((self._END, e))
+            return
+
+        self.queue.put((self._END, None))
+
+    def __iter__(self):
+        while True:
+            start = time.time()
+            item, error = self.queue.get()
+            self.wait_time += time.time() - start
+            if error is not None:
+                raise error
+            if item is self._END:
+                return
+            yield item
+
+
+class TrainStepExecutor(object):
+    """
+    Runs training steps through callables compiled once with Session.make_callable, instead of building a
+    feed_dict for every step. The batches are prepared on a background thread while the current step runs
+    (see BackgroundIterator). Only the training ops are fetched at every step, the logged values are fetched on
+    the last step of an epoch and, with the summaries, every summary_every steps.
+    """
+
+    def __init__(self, sess, fetches, summary_op, data_inputs, scalar_inputs, summary_every=1, prefetch_batches=2,
+                 log_fetches=()):
+        """
+        Args:
+            sess: TensorFlow session
+            fetches: list of ops run at every step, e.g., the train op
+            summary_op: merged summary op, run in addition every summary_every steps
+            data_inputs: input tensors fed from every batch (empty if the batches are read in the graph)
+            scalar_inputs: input tensors fed with the hyperparameters of every step, e.g., the learning rate
+            summary_every: number of steps between two summaries
+            prefetch_batches: number of batches prepared ahead of the training step
+            log_fetches: scalar tensors fetched on summary steps and on the last step of an epoch, e.g., the loss
+        """
+        self.data_inputs = list(data_inputs)
+        feed_list = self.data_inputs + list(scalar_inputs)
+        self.num_fetches = len(fetches)
+        self.step = sess.make_callable(list(fetches), feed_list)
+        self.log_step = sess.make_callable(list(fetches) + list(log_fetches), feed_list)
+        self.summary_step = sess.make_callable(list(fetches) + list(log_fetches) + [summary_op], feed_list)
+        self.summary_every = max(1, summary_every)
+        self.prefetch_batches = prefetch_batches
+        self.batches = None
+
+    def iter_batches(self, batch_feeds):
+        """
+        Iterates over the batch feeds (dicts from data input to value) of an epoch, preparing them in the background.
+        Yields (batch feed, whether it is the last batch of the epoch) tuples.
+        """
+        self.batches = BackgroundIterator(batch_feeds, self.prefetch_batches)
+
+        batches = iter(self.batches)
+        batch_feed = next(batches, None)
+        while batch_feed is not None:
+            next_feed = next(batches, None)
+            yield batch_feed, next_feed is None
+            batch_feed = next_feed
+
+    def run(self, iter_i, batch_feed, scalars, last=False):
+        """
+        Runs training step iter_i on a batch feed with the given values of the scalar inputs.
+
+        Returns:
+            logs: values of the log fetches, or None if they are not fetched at this step (not the last step of
+                  the epoch and no summary due)
+            summary: serialized summary, or None if no summary is due at this step
+
+        """
+        args = [batch_feed[tensor] for tensor in self.data_inputs] + list(scalars)
+        if iter_i % self.summary_every == 0:
+            values = self.summary_step(*args)
+            return values[self.num_fetches:-1], values[-1]
+        if last:
+            return self.log_step(*args)[self.num_fetches:], None
+
+        self.step(*args)
+        return None, None
+
+    def report(self):
+        """
+        Host-side batch preparation of the last epoch, which overlapped with the training steps.
+        """
+        return '[INFO] Batches prepared in the background: {:.1f}s, training steps waited for them: {:.1f}s'.format(
+            self.batches.produce_time, self.batches.wait_time)
+
+
+def create_data_split(x, y, dataset_sizes):
+    """
+    Create test-train split according to previously defined CSV files
+    Depending on the experiment - qgen or dialogue
+    Args:
+        x: input sequence of indices
+        y: output sequence of indices
+        dataset_sizes: train, val and test sizes, optionally followed by the number of appended training examples
+    Returns:
+        x_train, y_train, x_val, y_val, x_test, y_test: train val test split arrays
+    """
+
+    train_size, val_size, test_size = dataset_sizes[0], dataset_sizes[1], dataset_sizes[2],
+
+    train_indices = range(train_size)
+    val_indices = range(train_size, train_size + val_size)
+    test_indices = range(train_size + val_size, train_size + val_size + test_size)
+
+    if len(dataset_sizes) > 3:  # Examples appended after the test set belong to the training set
+        offset = train_size + val_size + test_size
+        train_indices = list(train_indices) + list(range(offset, offset + dataset_sizes[3]))
+
+    x_train = x[train_indices]
+    y_train = y[train_indices]
     x_val = x[val_indices]
     y_val = y[val_indices]
     x_test = x[test_indices]
@@ -230,6 +2591,23 @@ def create_data_split(x, y, dataset_sizes):
     return x_train, y_train, x_val, y_val, x_test, y_test
 
 
+def create_split_indices(num_examples):
+    """
+    Create the 90/5/5 train-val-test split used for the SNLI experiments, as index arrays.
+    Indexing the data with these arrays is equivalent to the two calls of
+    train_test_split(x, test_size=..., random_state=10) on the data itself.
+    Args:
+        num_examples: number of sentences in the corpus
+    Returns:
+        train_indices, val_indices, test_indices
+    """
+
+    train_indices, val_test_indices = train_test_split(np.arange(num_examples), test_size=0.1, random_state=10)
+    val_indices, test_indices = train_test_split(val_test_indices, test_size=0.5, random_state=10)
+
+    return [train_indices, val_indices, test_indices]
+
+
 def plot_2d(zvectors, labels, method):
     if method == 'tsne':
         cluster = TSNE(n_components=2, random_state=17)